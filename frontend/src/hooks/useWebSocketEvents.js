@@ -1,31 +1,45 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { toast } from 'react-toastify';
 import { formatLocalDateTime } from '../utils/timeUtils';
 
 const WEBSOCKET_URL = process.env.REACT_APP_WEBSOCKET_URL || 'ws://localhost:8000/ws/manufacturing/';
 
+// Event topics shown by the dashboard notifications
+const DEFAULT_TOPICS = ['orders', 'material.low_stock'];
+
 export const useWebSocketEvents = () => {
     const [socket, setSocket] = useState(null);
     const [events, setEvents] = useState([]);
     const [connectionStatus, setConnectionStatus] = useState('disconnected');
+    // Last initial state version seen, so reconnects only fetch the changes
+    const stateVersion = useRef(null);
+    // Highest event sequence number received, to resume after a reconnect
+    const lastSeq = useRef(null);
+    // Recently received sequence numbers, events sent to several subscribed topics arrive once per topic
+    const seenSeqs = useRef(new Set());
 
     const connectWebSocket = useCallback(() => {
-        const newSocket = new WebSocket(WEBSOCKET_URL);
+        // Topics are passed up front so missed events can be replayed on connect
+        const params = new URLSearchParams({ topics: DEFAULT_TOPICS.join(',') });
+        if (lastSeq.current !== null) {
+            params.set('resume_from', lastSeq.current);
+        }
+        if (stateVersion.current !== null) {
+            params.set('since_version', stateVersion.current);
+        }
+        const newSocket = new WebSocket(`${WEBSOCKET_URL}?${params}`);
 
         newSocket.onopen = () => {
             console.log('WebSocket Connected');
             setConnectionStatus('connected');
             
-            // Request initial state on connection
-            newSocket.send(JSON.stringify({
-                type: 'request_initial_state'
-            }));
+            // The server sends the initial state or the missed events on connection
         };
 
         newSocket.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
-                handleWebSocketEvent(data);
+                handleWebSocketEvent(data, newSocket);
             } catch (error) {
                 console.error('Error parsing WebSocket message:', error);
             }
@@ -42,17 +56,42 @@ export const useWebSocketEvents = () => {
         setSocket(newSocket);
     }, []);
 
-    const handleWebSocketEvent = (eventData) => {
+    const handleWebSocketEvent = (eventData, ws) => {
         switch (eventData.type) {
             case 'initial_state':
+                stateVersion.current = eventData.version;
                 handleInitialState(eventData.data);
                 break;
+            case 'initial_state_delta':
+                stateVersion.current = eventData.version;
+                handleInitialStateDelta(eventData.changes);
+                break;
             case 'manufacturing_event':
                 handleManufacturingEvent(eventData);
                 break;
+            case 'manufacturing_events':
+                // Coalesced frame sent by the server every few hundred milliseconds
+                eventData.events.forEach(handleManufacturingEvent);
+                if (eventData.dropped) {
+                    // Events were dropped while we were behind, catch up on the state
+                    ws.send(JSON.stringify({
+                        type: 'request_initial_state',
+                        since_version: stateVersion.current
+                    }));
+                }
+                break;
             case 'workorder_details':
                 handleWorkOrderDetails(eventData.data);
                 break;
+            case 'resume_failed':
+                // Missed events are gone, the server sends the initial state instead
+                console.log('Event stream resume failed from', eventData.resume_from);
+                break;
+            case 'subscriptions':
+                if (eventData.rejected.length > 0) {
+                    console.warn('Rejected WebSocket topics:', eventData.rejected);
+                }
+                break;
             default:
                 console.warn('Unhandled WebSocket event:', eventData);
         }
@@ -73,9 +112,33 @@ export const useWebSocketEvents = () => {
         }
     };
 
+    const handleInitialStateDelta = (changes) => {
+        // Only alert on materials that became low while we were away
+        changes
+            .filter(change => change.section === 'low_stock_materials' && change.op === 'upsert')
+            .forEach(({ item }) => {
+                toast.warning(`Low Stock Alert: ${item.name} (${item.quantity}/${item.reorder_level})`, {
+                    position: "top-right",
+                    autoClose: 5000,
+                });
+            });
+    };
+
     const handleManufacturingEvent = (eventData) => {
         // Central event handling for all manufacturing events
-        const { event_type, data } = eventData;
+        const { event_type, data, seq } = eventData;
+
+        // Skip events already received through another topic or before a resume
+        if (seq !== undefined && seq !== null) {
+            if (seenSeqs.current.has(seq)) {
+                return;
+            }
+            seenSeqs.current.add(seq);
+            if (seenSeqs.current.size > 1000) {
+                seenSeqs.current.delete(seenSeqs.current.values().next().value);
+            }
+            lastSeq.current = Math.max(lastSeq.current ?? seq, seq);
+        }
 
         // Add to events list for tracking
         setEvents(prevEvents => [...prevEvents, { 
@@ -99,9 +162,12 @@ export const useWebSocketEvents = () => {
                 });
                 break;
             case 'material.low_stock':
-                toast.warning(`Low Stock Alert: ${data.material_name} (${data.current_quantity}/${data.reorder_level})`, {
-                    position: "top-right",
-                    autoClose: 5000,
+                // Reservations send one event for the whole batch of materials
+                (data.materials || [data]).forEach(material => {
+                    toast.warning(`Low Stock Alert: ${material.material_name} (${material.current_quantity}/${material.reorder_level})`, {
+                        position: "top-right",
+                        autoClose: 5000,
+                    });
                 });
                 break;
             default:
@@ -114,6 +180,18 @@ export const useWebSocketEvents = () => {
         console.log('Work Order Details:', workOrderDetails);
     };
 
+    const subscribe = useCallback((topics) => {
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'subscribe', topics }));
+        }
+    }, [socket]);
+
+    const unsubscribe = useCallback((topics) => {
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'unsubscribe', topics }));
+        }
+    }, [socket]);
+
     const requestWorkOrderDetails = useCallback((workOrderId) => {
         if (socket && socket.readyState === WebSocket.OPEN) {
             socket.send(JSON.stringify({
@@ -136,6 +214,8 @@ export const useWebSocketEvents = () => {
     return {
         events,
         connectionStatus,
-        requestWorkOrderDetails
+        requestWorkOrderDetails,
+        subscribe,
+        unsubscribe
     };
 };
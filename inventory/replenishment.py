@@ -0,0 +1,143 @@
+"""
+Replenishment planner
+
+Turns a batch of low stock materials into draft purchase orders, one per
+supplier:
+
+- the supplier of every material is resolved with one SupplierMaterial
+  query, preferring preferred suppliers, then the lowest typical price
+- quantity already on open orders is netted out with one aggregate, so a
+  repeated stock-out storm does not order the same shortfall twice
+- orders and their items are written with bulk_create
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from manufacturing.models import Material, SupplierMaterial
+from manufacturing.stock_alerts import LowStockScanner
+
+from .models import MaterialOrder, MaterialOrderItem
+
+# Orders whose items still count as on order
+OPEN_ORDER_STATUSES = ('DRAFT', 'PENDING', 'APPROVED', 'ORDERED', 'PARTIALLY_RECEIVED')
+# Lead time assumed when no supplier quotes one
+DEFAULT_LEAD_TIME_DAYS = 7
+
+
+class ReplenishmentPlanner:
+    """
+    Plan and create purchase orders for many materials at once
+    """
+
+    @staticmethod
+    def on_order(material_ids):
+        """
+        Quantity ordered but not yet received per material on open orders
+        """
+        return dict(
+            MaterialOrderItem.objects.filter(
+                material_id__in=material_ids,
+                order__status__in=OPEN_ORDER_STATUSES
+            ).values('material_id').annotate(
+                outstanding=Sum(F('quantity_ordered') - F('quantity_received'))
+            ).values_list('material_id', 'outstanding')
+        )
+
+    @staticmethod
+    def preferred_suppliers(material_ids):
+        """
+        Best SupplierMaterial row per material, in a single query
+        """
+        preferred = {}
+        for supplier_material in SupplierMaterial.objects.filter(
+            material_id__in=material_ids
+        ).order_by(
+            'material_id', '-is_preferred_supplier', F('typical_price_per_unit').asc(nulls_last=True), 'supplier_id'
+        ):
+            preferred.setdefault(supplier_material.material_id, supplier_material)
+        return preferred
+
+    @classmethod
+    def plan(cls, material_ids):
+        """
+        Group the order lines of the materials by supplier
+
+        Returns:
+            dict: lines, supplier id to a list of line dicts; unsupplied,
+            IDs of materials that need ordering but have no supplier
+        """
+        materials = Material.objects.filter(pk__in=material_ids).annotate(
+            available_stock=Coalesce('stock_summary__available', 'quantity')
+        ).only('id', 'quantity', 'reorder_level', 'cost_per_unit')
+        on_order = cls.on_order(material_ids)
+        suppliers = cls.preferred_suppliers(material_ids)
+
+        lines = defaultdict(list)
+        unsupplied = []
+        for material in materials:
+            quantity = LowStockScanner.refill_quantity(material.available_stock, material.reorder_level)
+            quantity -= on_order.get(material.id) or Decimal('0')
+            if quantity <= 0:
+                continue
+            supplier_material = suppliers.get(material.id)
+            if supplier_material is None:
+                unsupplied.append(material.id)
+                continue
+            unit_price = supplier_material.typical_price_per_unit
+            if unit_price is None:
+                unit_price = material.cost_per_unit or Decimal('0')
+            lines[supplier_material.supplier_id].append({
+                'material_id': material.id,
+                'quantity': quantity,
+                'unit_price': unit_price,
+                'lead_time': supplier_material.typical_lead_time or DEFAULT_LEAD_TIME_DAYS
+            })
+        return {'lines': dict(lines), 'unsupplied': unsupplied}
+
+    @classmethod
+    def create_orders(cls, material_ids, now=None):
+        """
+        Create one draft order per supplier for the materials
+
+        Returns:
+            dict: order_ids of the created orders and unsupplied material IDs
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            plan = cls.plan(material_ids)
+            lines = plan['lines']
+            orders = MaterialOrder.objects.bulk_create([
+                MaterialOrder(
+                    supplier_id=supplier_id,
+                    order_number=f"AUTO-{now:%Y%m%d%H%M%S%f}-{supplier_id}",
+                    status='DRAFT',
+                    priority='HIGH',
+                    expected_delivery_date=(now + timedelta(days=max(line['lead_time'] for line in supplier_lines))).date(),
+                    total_cost=sum(line['quantity'] * line['unit_price'] for line in supplier_lines),
+                    internal_notes=f"Automatic reorder of {len(supplier_lines)} low stock materials"
+                )
+                for supplier_id, supplier_lines in lines.items()
+            ])
+            # bulk_create skips save(), so the line totals are set here
+            MaterialOrderItem.objects.bulk_create([
+                MaterialOrderItem(
+                    order=order,
+                    material_id=line['material_id'],
+                    quantity_ordered=line['quantity'],
+                    unit_price=line['unit_price'],
+                    total_price=line['quantity'] * line['unit_price']
+                )
+                for order in orders
+                for line in lines[order.supplier_id]
+            ])
+
+        return {
+            'order_ids': [order.id for order in orders],
+            'unsupplied': plan['unsupplied']
+        }
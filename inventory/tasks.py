@@ -4,172 +4,73 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 
-from .models import Material
-from suppliers.models import Supplier
+from .models import Material, MaterialOrder
+from .replenishment import ReplenishmentPlanner
+from manufacturing.tasks import check_low_stock_materials
 
 @shared_task
 def check_low_stock_and_notify():
     """
-    Periodic task to check for low stock materials and send notifications
+    Periodic task to check for low stock materials and reorder them
+
+    The scan and the alert are done by the shared low stock scanner, so
+    materials already alerted within its cooldown are not reordered again
     """
-    # Find materials below reorder level
-    low_stock_materials = Material.objects.filter(
-        quantity__lte=F('reorder_level')
-    )
+    result = check_low_stock_materials()
     
-    if not low_stock_materials.exists():
-        return
+    # Automatically create purchase orders for all low stock materials at once
+    if result['material_ids']:
+        create_automatic_purchase_orders.delay(result['material_ids'])
+
+
+@shared_task
+def create_automatic_purchase_orders(material_ids):
+    """
+    Create draft purchase orders for low stock materials, one per supplier,
+    and send a single summary of them
+    """
+    result = ReplenishmentPlanner.create_orders(material_ids)
+    
+    if result['order_ids'] or result['unsupplied']:
+        send_replenishment_summary.delay(result['order_ids'], result['unsupplied'])
     
-    # Prepare email context
+    return result
+
+
+@shared_task
+def create_automatic_purchase_order(material_id):
+    """
+    Create an automatic purchase order for a low stock material
+    """
+    return create_automatic_purchase_orders(material_ids=[material_id])
+
+
+@shared_task
+def send_replenishment_summary(material_order_ids, unsupplied_material_ids=None):
+    """
+    Send one notification covering every automatically created purchase order
+    and the materials no supplier could be found for
+    """
     email_context = {
-        'low_stock_materials': low_stock_materials,
+        'material_orders': MaterialOrder.objects.filter(
+            id__in=material_order_ids
+        ).select_related('supplier').prefetch_related('items__material'),
+        'unsupplied_materials': Material.objects.filter(id__in=unsupplied_material_ids or []),
         'company_name': settings.COMPANY_NAME
     }
     
     # Render email templates
     html_message = render_to_string(
-        'emails/procurement/low_stock_alert.html', 
+        'emails/procurement/automatic_orders_summary.html', 
         email_context
     )
     plain_message = strip_tags(html_message)
     
     # Send email to procurement team
     send_mail(
-        subject=f'{settings.COMPANY_NAME} - Low Stock Alert',
+        subject=f'{settings.COMPANY_NAME} - Automatic Purchase Orders Created',
         message=plain_message,
         from_email=settings.DEFAULT_FROM_EMAIL,
         recipient_list=settings.PROCUREMENT_TEAM_EMAILS,
         html_message=html_message
     )
-    
-    # Automatically create purchase orders for low stock materials
-    for material in low_stock_materials:
-        create_automatic_purchase_order.delay(material.id)
-
-
-@shared_task
-def create_automatic_purchase_order(material_id):
-    """
-    Create an automatic purchase order for a low stock material
-    """
-    try:
-        material = Material.objects.get(id=material_id)
-        
-        # Calculate order quantity
-        order_quantity = material.max_stock_level - material.quantity
-        
-        # Find preferred suppliers for this material
-        preferred_suppliers = material.suppliers.filter(
-            is_preferred_supplier=True
-        )
-        
-        if not preferred_suppliers.exists():
-            # Fallback to all suppliers if no preferred supplier
-            preferred_suppliers = material.suppliers.all()
-        
-        if not preferred_suppliers.exists():
-            # No suppliers found, send an alert
-            send_no_supplier_alert.delay(material_id)
-            return
-        
-        # Choose the first preferred supplier
-        supplier = preferred_suppliers.first()
-        
-        # Create material order
-        material_order = MaterialOrder.objects.create(
-            supplier=supplier,
-            status='DRAFT',
-            priority='HIGH',
-            expected_delivery_date=timezone.now() + timedelta(days=7),
-            internal_notes=f'Automatic reorder for low stock material: {material.name}'
-        )
-        
-        # Create order item
-        MaterialOrderItem.objects.create(
-            order=material_order,
-            material=material,
-            quantity_ordered=order_quantity,
-            unit_price=material.typical_price_per_unit,
-            total_price=order_quantity * material.typical_price_per_unit
-        )
-        
-        # Update material order total cost
-        material_order.total_cost = material_order.items.aggregate(
-            total=Sum('total_price')
-        )['total'] or 0
-        material_order.save()
-        
-        # Notify procurement team about automatic order
-        send_automatic_order_notification.delay(material_order.id)
-    
-    except Material.DoesNotExist:
-        # Log error or handle material not found
-        pass
-
-
-@shared_task
-def send_no_supplier_alert(material_id):
-    """
-    Send an alert when no suppliers are found for a material
-    """
-    try:
-        material = Material.objects.get(id=material_id)
-        
-        # Render email templates
-        email_context = {
-            'material': material,
-            'company_name': settings.COMPANY_NAME
-        }
-        
-        html_message = render_to_string(
-            'emails/procurement/no_supplier_alert.html', 
-            email_context
-        )
-        plain_message = strip_tags(html_message)
-        
-        # Send email to procurement team
-        send_mail(
-            subject=f'{settings.COMPANY_NAME} - No Supplier Found for Low Stock Material',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=settings.PROCUREMENT_TEAM_EMAILS,
-            html_message=html_message
-        )
-    
-    except Material.DoesNotExist:
-        # Log error or handle material not found
-        pass
-
-
-@shared_task
-def send_automatic_order_notification(material_order_id):
-    """
-    Send notification about an automatically created purchase order
-    """
-    try:
-        material_order = MaterialOrder.objects.get(id=material_order_id)
-        
-        # Render email templates
-        email_context = {
-            'material_order': material_order,
-            'company_name': settings.COMPANY_NAME
-        }
-        
-        html_message = render_to_string(
-            'emails/procurement/automatic_order_created.html', 
-            email_context
-        )
-        plain_message = strip_tags(html_message)
-        
-        # Send email to procurement team
-        send_mail(
-            subject=f'{settings.COMPANY_NAME} - Automatic Purchase Order Created',
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=settings.PROCUREMENT_TEAM_EMAILS,
-            html_message=html_message
-        )
-    
-    except MaterialOrder.DoesNotExist:
-        # Log error or handle order not found
-        pass
@@ -0,0 +1,95 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase, override_settings
+
+from manufacturing.ledger import StockLedger
+from manufacturing.models import Material, Product, StockMovement, Supplier, SupplierMaterial, WorkOrder
+
+from . import tasks
+from .models import MaterialOrder, MaterialOrderItem
+from .replenishment import ReplenishmentPlanner
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class ReplenishmentPlannerTest(TestCase):
+    """
+    Low stock materials are ordered once, grouped by their best supplier
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.steel_mill = Supplier.objects.create(name='Steel Mill', email='mill@example.com')
+        cls.wholesaler = Supplier.objects.create(name='Wholesaler', email='sales@example.com')
+        cls.steel, cls.bolts, cls.paint, cls.wire = [
+            Material.objects.create(name=name, unit='KG', quantity=Decimal(quantity), reorder_level=Decimal('20'))
+            for name, quantity in (('Steel', '5'), ('Bolts', '10'), ('Paint', '0'), ('Wire', '30'))
+        ]
+        # Steel is cheaper at the wholesaler, but the mill is preferred
+        SupplierMaterial.objects.bulk_create([
+            SupplierMaterial(
+                supplier=cls.steel_mill, material=cls.steel, is_preferred_supplier=True,
+                typical_price_per_unit=Decimal('4'), typical_lead_time=10
+            ),
+            SupplierMaterial(supplier=cls.wholesaler, material=cls.steel, typical_price_per_unit=Decimal('3')),
+            SupplierMaterial(
+                supplier=cls.wholesaler, material=cls.bolts, typical_price_per_unit=Decimal('1'), typical_lead_time=3
+            ),
+            SupplierMaterial(supplier=cls.wholesaler, material=cls.wire, typical_price_per_unit=Decimal('2')),
+        ])
+        # Wire has 30 on hand but only 10 available
+        work_order = WorkOrder.objects.create(product=Product.objects.create(name='Fence'), quantity=Decimal('1'))
+        StockLedger.record([StockMovement(
+            material=cls.wire, movement_type='RESERVE', quantity=Decimal('20'), work_order=work_order
+        )])
+
+    def material_ids(self):
+        return [self.steel.id, self.bolts.id, self.paint.id, self.wire.id]
+
+    def test_plan_groups_lines_by_supplier(self):
+        plan = ReplenishmentPlanner.plan(self.material_ids())
+
+        self.assertEqual(plan['unsupplied'], [self.paint.id])
+        self.assertEqual(
+            [(line['material_id'], line['quantity'], line['unit_price']) for line in plan['lines'][self.steel_mill.id]],
+            [(self.steel.id, Decimal('35'), Decimal('4'))]
+        )
+        self.assertEqual(
+            sorted((line['material_id'], line['quantity']) for line in plan['lines'][self.wholesaler.id]),
+            [(self.bolts.id, Decimal('30')), (self.wire.id, Decimal('30'))]
+        )
+
+    def test_create_orders_once_per_supplier_and_nets_open_orders(self):
+        result = ReplenishmentPlanner.create_orders(self.material_ids())
+
+        orders = MaterialOrder.objects.filter(pk__in=result['order_ids'])
+        self.assertEqual(sorted(orders.values_list('supplier_id', flat=True)), sorted([self.steel_mill.id, self.wholesaler.id]))
+        wholesale_order = orders.get(supplier=self.wholesaler)
+        self.assertEqual(wholesale_order.status, 'DRAFT')
+        self.assertEqual(wholesale_order.total_cost, Decimal('90'))
+        self.assertEqual(wholesale_order.items.count(), 2)
+
+        # Everything short is on order now, a repeated run orders nothing
+        result = ReplenishmentPlanner.create_orders(self.material_ids())
+        self.assertEqual(result['order_ids'], [])
+        self.assertEqual(MaterialOrderItem.objects.count(), 3)
+
+    @override_settings(
+        COMPANY_NAME='Metalcraft',
+        DEFAULT_FROM_EMAIL='noreply@example.com',
+        PROCUREMENT_TEAM_EMAILS=['procurement@example.com']
+    )
+    def test_one_summary_email_per_run(self):
+        with mock.patch.object(tasks.send_replenishment_summary, 'delay') as delay:
+            result = tasks.create_automatic_purchase_orders(self.material_ids())
+        delay.assert_called_once_with(result['order_ids'], [self.paint.id])
+
+        tasks.send_replenishment_summary(result['order_ids'], [self.paint.id])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['procurement@example.com'])
+
+        # Nothing left to order, nothing to report
+        with mock.patch.object(tasks.send_replenishment_summary, 'delay') as delay:
+            tasks.create_automatic_purchase_orders([self.steel.id, self.bolts.id, self.wire.id])
+        delay.assert_not_called()
@@ -5,7 +5,10 @@ from django.db import transaction
 from django.utils import timezone
 
 from .models import MaterialOrder, MaterialOrderItem, Invoice
+from manufacturing.ledger import StockLedger
 from manufacturing.models import Material
+from manufacturing.stock_alerts import LowStockScanner
+from .replenishment import ReplenishmentPlanner
 from .serializers import MaterialOrderSerializer, MaterialOrderItemSerializer, InvoiceSerializer
 
 class MaterialOrderViewSet(viewsets.ModelViewSet):
@@ -89,10 +92,12 @@ class MaterialOrderViewSet(viewsets.ModelViewSet):
                     
                     order_item.save()
                     
-                    # Update material inventory
-                    material = order_item.material
-                    material.quantity += received_qty
-                    material.save()
+                    # Record the receipt in the stock ledger
+                    StockLedger.receive(
+                        order_item.material_id,
+                        received_qty,
+                        reference=order.order_number
+                    )
                 
                 except MaterialOrderItem.DoesNotExist:
                     return Response({
@@ -118,33 +123,30 @@ class MaterialOrderViewSet(viewsets.ModelViewSet):
         """
         Get suggested material orders for low stock materials
         """
-        low_stock_materials = Material.objects.filter(
-            quantity__lte=F('reorder_level')
+        plan = ReplenishmentPlanner.plan(
+            list(LowStockScanner.low_stock().values_list('id', flat=True))
         )
         
-        suggested_orders = []
+        # One suggested order per supplier
+        suggested_orders = [
+            {
+                'supplier_id': supplier_id,
+                'items': [
+                    {
+                        'material_id': line['material_id'],
+                        'suggested_quantity': line['quantity'],
+                        'unit_price': line['unit_price']
+                    }
+                    for line in lines
+                ]
+            }
+            for supplier_id, lines in plan['lines'].items()
+        ]
         
-        for material in low_stock_materials:
-            # Calculate required quantity
-            order_quantity = material.max_stock_level - material.quantity
-            
-            # Find preferred suppliers for this material
-            preferred_suppliers = material.suppliers.filter(
-                is_preferred_supplier=True
-            )
-            
-            if preferred_suppliers.exists():
-                supplier = preferred_suppliers.first()
-                
-                suggested_order = {
-                    'material': MaterialSerializer(material).data,
-                    'suggested_quantity': order_quantity,
-                    'suggested_supplier': SupplierSerializer(supplier).data
-                }
-                
-                suggested_orders.append(suggested_order)
-        
-        return Response(suggested_orders)
+        return Response({
+            'suggested_orders': suggested_orders,
+            'unsupplied_material_ids': plan['unsupplied']
+        })
 
 
 class MaterialOrderItemViewSet(viewsets.ModelViewSet):
@@ -6,6 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    # The test run has no Redis server, see metalcraft/test_settings.py
+    if sys.argv[1:2] == ["test"]:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "metalcraft.test_settings")
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "metalcraft.settings")
     try:
         from django.core.management import execute_from_command_line
@@ -1,13 +1,16 @@
 from django.db.models import Sum, Count, Avg, F, ExpressionWrapper, DecimalField, Q, Value
-from django.db.models.functions import TruncDay, TruncMonth
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
+from django.utils.dateparse import parse_date
 import logging
 from decimal import Decimal
 
 from .models import WorkOrder, ProductionLog, Material, Product, WorkStation, ProductWorkstationSequence
+from .costing import ProductCostCache, work_order_costs
+from .pagination import WorkOrderCursorPagination
+from .rollups import ProductionRollup
 
 logger = logging.getLogger(__name__)
 
@@ -35,12 +38,8 @@ class DashboardAnalyticsView(APIView):
                 )
             ).values('name', 'total_consumed', 'percentage').order_by('-total_consumed')
 
-            # Daily Production
-            daily_production = ProductionLog.objects.annotate(
-                day=TruncDay('created_at')
-            ).values('day').annotate(
-                total_quantity=Sum('quantity_produced')
-            ).order_by('day')
+            # Daily Production from the rollups plus today's logs
+            daily_production = ProductionRollup.daily_production()
 
             # Workstation Utilization
             workstation_utilization = WorkStation.objects.annotate(
@@ -61,7 +60,7 @@ class DashboardAnalyticsView(APIView):
                     'in_progress': in_progress_work_orders
                 },
                 'material_usage': list(material_usage),
-                'daily_production': list(daily_production),
+                'daily_production': daily_production,
                 'workstation_utilization': list(workstation_utilization),
                 'product_performance': list(product_performance)
             })
@@ -74,15 +73,8 @@ class EfficiencyTrendView(APIView):
 
     def get(self, request):
         try:
-            # Detailed efficiency trends
-            efficiency_trend = ProductionLog.objects.annotate(
-                month=TruncMonth('created_at')
-            ).values('month').annotate(
-                avg_efficiency=Avg('efficiency_rate', default=0),
-                total_production=Sum('quantity_produced', default=0)
-            ).order_by('month')
-
-            return Response(list(efficiency_trend))
+            # Detailed efficiency trends from the rollups plus today's logs
+            return Response(ProductionRollup.monthly_efficiency())
         except Exception as e:
             logger.error(f"Efficiency Trend Error: {str(e)}")
             return Response({'error': str(e)}, status=500)
@@ -90,6 +82,16 @@ class EfficiencyTrendView(APIView):
 class CostAnalyticsView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @staticmethod
+    def query_date(request, name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid {name}: {value}")
+        return day
+
     def get(self, request):
         try:
             # Cost-related analytics
@@ -100,38 +102,43 @@ class CostAnalyticsView(APIView):
                 )
             ).values('name', 'total_cost')
 
-            # Calculate estimated work order costs based on materials used
-            work_order_cost_analysis = WorkOrder.objects.annotate(
-                estimated_material_cost=Sum(
-                    F('product__productmaterial__material__cost_per_unit') * 
-                    F('product__productmaterial__quantity'),
-                    output_field=DecimalField()
-                )
-            ).values('id', 'product__name', 'estimated_material_cost')
+            try:
+                start_date = self.query_date(request, 'start_date')
+                end_date = self.query_date(request, 'end_date')
+                product_ids = [
+                    int(product_id)
+                    for product_id in request.query_params.get('product', '').split(',')
+                    if product_id
+                ]
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Work order quantity times the cached product material cost
+            work_orders = work_order_costs(start_date, end_date, product_ids)
+            work_order_cost_summary = work_orders.aggregate(
+                total_cost=Sum('estimated_material_cost', default=0),
+                avg_cost=Avg('estimated_material_cost', default=0)
+            )
 
-            # Aggregate work order cost statistics
-            work_order_cost_summary = WorkOrder.objects.aggregate(
-                total_cost=Sum(
-                    F('product__productmaterial__material__cost_per_unit') * 
-                    F('product__productmaterial__quantity'),
-                    output_field=DecimalField(),
-                    default=0
+            paginator = WorkOrderCursorPagination()
+            work_order_cost_analysis = paginator.paginate_queryset(
+                work_orders.values(
+                    'id', 'product__name', 'quantity', 'unit_material_cost',
+                    'estimated_material_cost', 'created_at'
                 ),
-                avg_cost=Avg(
-                    F('product__productmaterial__material__cost_per_unit') * 
-                    F('product__productmaterial__quantity'),
-                    output_field=DecimalField(),
-                    default=0
-                )
+                request,
+                view=self
             )
 
             return Response({
                 'material_cost_analysis': list(material_cost_analysis),
-                'work_order_cost_analysis': list(work_order_cost_analysis),
+                'work_order_cost_analysis': work_order_cost_analysis,
                 'work_order_cost': {
                     'total_cost': work_order_cost_summary['total_cost'],
                     'avg_cost': work_order_cost_summary['avg_cost']
-                }
+                },
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link()
             })
         except Exception as e:
             logger.error(f"Cost Analytics Error: {str(e)}")
@@ -140,223 +147,13 @@ class CostAnalyticsView(APIView):
 class ProfitabilityAnalyticsView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def calculate_product_profitability(self, product):
-        """
-        Calculate the profitability of a product by considering:
-        1. Material costs
-        2. Labor costs
-        3. Workstation operating costs
-        4. Sell price
-        
-        Returns a dictionary with detailed profitability metrics
-        """
-        from django.db.models import Sum, F
-        import logging
-        logger = logging.getLogger(__name__)
-
-        try:
-            logger.info(f"Calculating profitability for product: {product.name}")
-            logger.info(f"Product details - Sell Cost: {product.sell_cost}, Labor Cost: {product.labor_cost}")
-
-            # Calculate total material cost with detailed logging
-            material_costs_query = product.productmaterial_set.annotate(
-                material_total_cost=F('material__cost_per_unit') * F('quantity')
-            )
-            material_costs = material_costs_query.aggregate(
-                total_material_cost=Sum('material_total_cost')
-            )['total_material_cost'] or 0
-
-            # Detailed material cost breakdown
-            material_breakdown = list(material_costs_query.values('material__name', 'material_total_cost'))
-            
-            # Log material details
-            logger.info(f"Material Costs: {material_costs}")
-            logger.info(f"Material Breakdown: {material_breakdown}")
-
-            # Get the workstation sequence for this product
-            workstation_sequence = ProductWorkstationSequence.objects.filter(
-                product=product
-            ).select_related('workstation')
-
-            # Calculate total workstation operating costs
-            workstation_costs = 0
-            workstation_breakdown = []
-            for ws in workstation_sequence:
-                # Ensure hourly_operating_cost and estimated_time are not None
-                hourly_rate = ws.workstation.hourly_operating_cost or 0
-                
-                # Convert estimated time to hours as a Decimal
-                estimated_hours = (
-                    Decimal(str(ws.estimated_time.total_seconds() / 3600)) 
-                    if ws.estimated_time 
-                    else Decimal('0')
-                )
-                
-                # Ensure both are Decimal for multiplication
-                ws_cost = Decimal(str(hourly_rate)) * estimated_hours
-                workstation_costs += ws_cost
-                
-                workstation_breakdown.append({
-                    'workstation_name': ws.workstation.name,
-                    'hourly_rate': float(hourly_rate),
-                    'estimated_time_hours': float(estimated_hours),
-                    'cost': float(ws_cost)
-                })
-                
-                logger.info(f"Workstation {ws.workstation.name}: Hourly Rate = {hourly_rate}, Estimated Hours = {estimated_hours}, Cost = {ws_cost}")
-
-            # Ensure sell_cost and labor_cost are not None
-            sell_cost = product.sell_cost or 0
-            labor_cost = product.labor_cost or 0
-
-            # Calculate total costs
-            total_cost = material_costs + labor_cost + workstation_costs
-
-            # Calculate profitability
-            profit = sell_cost - total_cost
-            profit_margin = (profit / sell_cost * 100) if sell_cost > 0 else 0
-
-            # Categorize profitability
-            profitability_category = (
-                'Highly Profitable' if profit_margin > 30 else
-                'Profitable' if profit_margin > 15 else
-                'Low Margin' if profit_margin > 0 else
-                'Loss-Making'
-            )
-
-            # Comprehensive logging of profitability calculation
-            logger.info(f"Profitability Calculation for {product.name}:")
-            logger.info(f"Material Costs: {material_costs}")
-            logger.info(f"Labor Costs: {labor_cost}")
-            logger.info(f"Workstation Costs: {workstation_costs}")
-            logger.info(f"Total Cost: {total_cost}")
-            logger.info(f"Sell Cost: {sell_cost}")
-            logger.info(f"Profit: {profit}")
-            logger.info(f"Profit Margin: {profit_margin}%")
-            logger.info(f"Profitability Category: {profitability_category}")
-
-            return {
-                'product_id': product.id,
-                'product_name': product.name,
-                'material_costs': material_costs,
-                'material_breakdown': material_breakdown,
-                'labor_costs': labor_cost,
-                'workstation_costs': workstation_costs,
-                'workstation_breakdown': workstation_breakdown,
-                'total_cost': total_cost,
-                'sell_cost': sell_cost,
-                'profit': profit,
-                'profit_margin': profit_margin,
-                'profitability_category': profitability_category
-            }
-        except Exception as e:
-            logger.error(f"Error calculating profitability for product {product.name}: {str(e)}", exc_info=True)
-            return None
-
     def get(self, request):
         """
         Generate an overall profitability summary for all products
         """
-        import logging
-        from django.db import connection
-        logger = logging.getLogger(__name__)
-
         try:
-            # Log raw SQL queries for debugging
-            def log_queries():
-                for query in connection.queries:
-                    print(f"SQL Query: {query['sql']}")
-
-            # Fetch all products with more details
-            products = Product.objects.prefetch_related(
-                'productmaterial_set', 
-                'productmaterial_set__material',
-                'workstation_sequences',
-                'workstation_sequences__workstation'
-            )
-            
-            # Extensive logging
-            print("=" * 50)
-            print("PROFITABILITY ANALYTICS DEBUG")
-            print("=" * 50)
-            
-            # Log database connection details
-            print(f"Database: {connection.settings_dict['NAME']}")
-            print(f"Total number of products: {products.count()}")
-            
-            # Detailed product logging
-            for product in products:
-                print(f"\nProduct: {product.name}")
-                print(f"ID: {product.id}")
-                print(f"Sell Cost: {product.sell_cost}")
-                print(f"Labor Cost: {product.labor_cost}")
-                
-                # Log materials
-                print("Materials:")
-                materials = product.productmaterial_set.all()
-                for material in materials:
-                    print(f"- {material.material.name}: Quantity = {material.quantity}, Cost per Unit = {material.material.cost_per_unit}")
-                
-                # Log workstation sequences
-                print("Workstation Sequences:")
-                workstation_sequences = product.workstation_sequences.all()
-                for seq in workstation_sequences:
-                    print(f"- {seq.workstation.name}: Estimated Time = {seq.estimated_time}, Hourly Cost = {seq.workstation.hourly_operating_cost}")
-            
-            print("=" * 50)
-            
-            # If no products exist
-            if not products.exists():
-                logger.warning("No products found in the database")
-                return Response({
-                    'total_products': 0,
-                    'total_sell_cost': 0,
-                    'total_cost': 0,
-                    'total_profit': 0,
-                    'average_profit_margin': 0,
-                    'products': []
-                })
-            
-            # Calculate profitability for each product
-            profitability_data = []
-            for product in products:
-                try:
-                    product_profitability = self.calculate_product_profitability(product)
-                    if product_profitability:
-                        profitability_data.append(product_profitability)
-                    else:
-                        print(f"WARNING: Could not calculate profitability for product {product.name}")
-                except Exception as prod_error:
-                    print(f"ERROR processing product {product.id}: {str(prod_error)}")
-                    logger.error(f"Error processing product {product.id}: {str(prod_error)}", exc_info=True)
-
-            # If no products have profitability calculated
-            if not profitability_data:
-                logger.warning("No products could be processed for profitability")
-                return Response({
-                    'total_products': len(products),
-                    'total_sell_cost': 0,
-                    'total_cost': 0,
-                    'total_profit': 0,
-                    'average_profit_margin': 0,
-                    'products': []
-                })
-
-            # Calculate summary metrics
-            summary = {
-                'total_products': len(products),
-                'total_sell_cost': sum(item['sell_cost'] for item in profitability_data),
-                'total_cost': sum(item['total_cost'] for item in profitability_data),
-                'total_profit': sum(item['profit'] for item in profitability_data),
-                'average_profit_margin': sum(item['profit_margin'] for item in profitability_data) / len(profitability_data),
-                'products': profitability_data
-            }
-
-            logger.info(f"Profitability Summary: {summary}")
-            return Response(summary)
-
+            return Response(ProductCostCache.profitability())
         except Exception as e:
-            print(f"CRITICAL ERROR: {str(e)}")
             logger.error(f"Unexpected error in profitability analytics: {str(e)}", exc_info=True)
             return Response({
                 'error': str(e)
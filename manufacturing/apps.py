@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ManufacturingConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "manufacturing"
+
+    def ready(self):
+        # Connect the rollup, cost cache, dashboard, dependency index and
+        # schedule repair signal receivers, and register the system checks
+        from . import checks, costing, dashboard, dependencies, rollups, scheduling  # noqa: F401
@@ -0,0 +1,38 @@
+"""
+System checks for the settings the real-time features depend on
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose contents no other process can see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn when the default cache is not shared between processes
+
+    Event sequence numbers, the replay buffer and the initial state snapshot
+    live in the cache. With a process-local backend every web process numbers
+    events on its own, so clients resume from the wrong position and receive
+    stale snapshots.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            f"The default cache backend {backend} is local to each process.",
+            hint=(
+                "Configure a shared cache such as "
+                "django.core.cache.backends.redis.RedisCache so that event "
+                "sequence numbers, replay and the initial state snapshot are "
+                "consistent across web processes and the outbox relay."
+            ),
+            id='manufacturing.W001',
+        )
+    ]
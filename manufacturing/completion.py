@@ -0,0 +1,184 @@
+"""
+Batched, idempotent work order completion
+
+A batch of IN_PROGRESS work orders is completed in one transaction:
+
+- the orders are locked and each one claims a WorkOrderCompletion row, its
+  idempotency key, so an order completed by an earlier run or a retried task
+  is reported and skipped instead of being applied twice
+- reserved stock of every order is consumed through one stock ledger call
+- orders for a fractional quantity are rejected, product stock is counted
+  in whole units
+- finished goods are added to the products with a single F() update
+- production logs are bulk created and folded into the daily rollups
+- dependents waiting on the orders are released with one update
+
+Nothing is written unless the whole batch commits, so a task retried after a
+failure starts again from a clean state.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .dependencies import DependencyIndex
+from .ledger import StockLedger
+from .models import MaterialReservation, Product, ProductionLog, StockMovement, WorkOrder, WorkOrderCompletion
+from .rollups import ProductionRollup
+
+
+def complete_work_orders(work_order_ids):
+    """
+    Complete a batch of work orders at once
+
+    Args:
+        work_order_ids (list): IDs of the work orders to complete
+
+    Returns:
+        list: One result dict per requested work order, with status
+        completed, duplicate or rejected
+    """
+    from .dashboard import WorkOrderDashboardStats  # Import here to avoid circular import
+    from .events import WorkOrderEventHandler  # Import here to avoid circular import
+
+    work_order_ids = list(dict.fromkeys(work_order_ids))
+    results = {}
+
+    with transaction.atomic():
+        work_orders = WorkOrder.objects.select_for_update().filter(pk__in=work_order_ids).only(
+            'id', 'product_id', 'quantity', 'status', 'workstation_id', 'assigned_to_id'
+        ).in_bulk()
+        completed_at = dict(
+            WorkOrderCompletion.objects.filter(work_order_id__in=work_orders).values_list(
+                'work_order_id', 'completed_at'
+            )
+        )
+
+        batch = []
+        for work_order_id in work_order_ids:
+            work_order = work_orders.get(work_order_id)
+            if work_order is None:
+                results[work_order_id] = {'status': 'rejected', 'reason': 'Work order not found'}
+            elif work_order_id in completed_at:
+                results[work_order_id] = {
+                    'status': 'duplicate',
+                    'completed_at': completed_at[work_order_id].isoformat()
+                }
+            elif work_order.quantity != work_order.quantity.to_integral_value():
+                results[work_order_id] = {
+                    'status': 'rejected',
+                    'reason': f"Quantity {work_order.quantity} is not a whole number of units"
+                }
+            else:
+                try:
+                    work_order.validate_status_transition('COMPLETED')
+                except ValueError as e:
+                    results[work_order_id] = {'status': 'rejected', 'reason': str(e)}
+                else:
+                    batch.append(work_order)
+
+        if batch:
+            now = timezone.now()
+            batch_ids = [work_order.id for work_order in batch]
+
+            # A concurrent run claiming the same order fails here and rolls back
+            WorkOrderCompletion.objects.bulk_create([
+                WorkOrderCompletion(work_order=work_order, quantity_produced=work_order.quantity, completed_at=now)
+                for work_order in batch
+            ])
+
+            reservations = MaterialReservation.objects.filter(work_order_id__in=batch_ids)
+            StockLedger.record([
+                StockMovement(
+                    material_id=material_id,
+                    movement_type='CONSUME',
+                    quantity=quantity,
+                    work_order_id=work_order_id,
+                    reference=f"WO-{work_order_id}"
+                )
+                for work_order_id, material_id, quantity in reservations.values_list(
+                    'work_order_id', 'material_id', 'quantity_reserved'
+                )
+            ])
+            reservations.delete()
+
+            products = _restock_products(batch)
+
+            logs = [
+                ProductionLog(
+                    work_order=work_order,
+                    workstation_id=work_order.workstation_id,
+                    quantity_produced=int(work_order.quantity),
+                    created_by_id=work_order.assigned_to_id
+                )
+                for work_order in batch
+            ]
+            for log in logs:
+                log.calculate_efficiency(save_instance=False)
+            ProductionLog.objects.bulk_create(logs)
+            ProductionRollup.record_many(logs, {work_order.id: work_order.product_id for work_order in batch})
+
+            WorkOrder.objects.filter(pk__in=batch_ids).update(status='COMPLETED', end_date=now, updated_at=now)
+            DependencyIndex.completed(batch_ids)
+
+            WorkOrderEventHandler.handle_bulk_completion(batch_ids, products)
+            transaction.on_commit(WorkOrderDashboardStats.invalidate)
+
+            for work_order_id in batch_ids:
+                results[work_order_id] = {'status': 'completed', 'completed_at': now.isoformat()}
+
+    return [{'work_order_id': work_order_id, **results[work_order_id]} for work_order_id in work_order_ids]
+
+
+def _restock_products(work_orders):
+    """
+    Add the produced quantities to their products in one locked update
+
+    The update bypasses Product.save, so the stock status is recomputed here
+    and the product_status_changed receiver is called for every product. No
+    other Product.save hook applies: cost summaries and the initial state
+    snapshot do not read product stock.
+
+    Returns:
+        list: Dicts with product_id, product_name, quantity_produced,
+        new_product_quantity, old_status and new_status
+    """
+    produced = defaultdict(Decimal)
+    for work_order in work_orders:
+        produced[work_order.product_id] += work_order.quantity
+
+    from .events import product_status_changed  # Import here to avoid circular import
+
+    products = list(Product.objects.select_for_update().filter(pk__in=produced).only(
+        'id', 'name', 'current_quantity', 'restock_level', 'max_stock_level', 'stock_status'
+    ))
+    changes = []
+    for product in products:
+        old_status = product.stock_status
+        product.current_quantity += int(produced[product.id])
+        product.update_stock_status(save_instance=False)
+        changes.append({
+            'product_id': product.id,
+            'product_name': product.name,
+            'quantity_produced': produced[product.id],
+            'new_product_quantity': product.current_quantity,
+            'old_status': old_status,
+            'new_status': product.stock_status
+        })
+
+    Product.objects.filter(pk__in=produced).update(
+        current_quantity=F('current_quantity') + Case(
+            *[When(pk=product_id, then=Value(int(quantity))) for product_id, quantity in produced.items()],
+            default=Value(0),
+            output_field=models.IntegerField()
+        ),
+        stock_status=Case(
+            *[When(pk=change['product_id'], then=Value(change['new_status'])) for change in changes],
+            default=F('stock_status')
+        )
+    )
+    for product in products:
+        product_status_changed(Product, product, created=False)
+    return changes
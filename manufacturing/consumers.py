@@ -1,35 +1,69 @@
+import asyncio
 import json
 import logging
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .models import WorkStation, WorkOrder, ProductionLog, Material, Product
-from .events import EventType
+from .events import EventType, Topic
+from .replay import EventReplayBuffer
+from .snapshot import InitialStateSnapshot
 
 logger = logging.getLogger(__name__)
 
 class ManufacturingConsumer(AsyncWebsocketConsumer):
+    # Events received within this many seconds are sent as one frame
+    coalesce_window = 0.15
+    # Buffered events per connection before the oldest are dropped
+    max_pending_events = 500
+    # Payload keys identifying the entity an event is about, most specific first
+    entity_keys = ('work_order_id', 'workstation_id', 'material_id', 'product_id')
+    # Topic groups a single connection may join
+    max_topics = 200
+
     async def connect(self):
         """
         Handle new WebSocket connection
-        Add user to manufacturing updates group
+        Join the topic groups requested in the ?topics= query string, more
+        can be added later with subscribe messages
         """
-        await self.channel_layer.group_add(
-            "manufacturing",  # Matches event dispatch group
-            self.channel_name
-        )
+        self.pending_events = {}
+        self.dropped_events = 0
+        self.flush_task = None
+        self.event_counter = 0
+        self.topics = set()
+
         await self.accept()
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        requested = [
+            topic for value in query.get('topics', []) for topic in value.split(',') if topic
+        ]
+        if requested:
+            await self.subscribe(requested)
         
-        # Optional: Send initial state on connection
-        await self.send_initial_state()
+        # A reconnecting client that sent the last sequence number it saw only
+        # needs the events it missed
+        resume_from = query.get('resume_from', [None])[0]
+        if resume_from and await self.resume(self.parse_position(resume_from)):
+            return
+
+        # Send initial state on connection, only the changes when the client
+        # reconnects with the last version it saw
+        since_version = query.get('since_version', [None])[0]
+        await self.send_initial_state(self.parse_position(since_version))
 
     async def disconnect(self, close_code):
         """
-        Remove user from manufacturing updates group on disconnect
+        Leave every subscribed topic group on disconnect
         """
-        await self.channel_layer.group_discard(
-            "manufacturing",
-            self.channel_name
-        )
+        if self.flush_task:
+            self.flush_task.cancel()
+
+        for topic in self.topics:
+            await self.channel_layer.group_discard(topic, self.channel_name)
+        self.topics = set()
 
     async def receive(self, text_data):
         """
@@ -42,29 +76,108 @@ class ManufacturingConsumer(AsyncWebsocketConsumer):
             
             # Dispatch based on message type
             if message_type == 'request_initial_state':
-                await self.send_initial_state()
+                await self.send_initial_state(self.parse_position(text_data_json.get('since_version')))
             elif message_type == 'request_workorder_details':
                 work_order_id = text_data_json.get('work_order_id')
                 await self.send_workorder_details(work_order_id)
+            elif message_type == 'subscribe':
+                await self.subscribe(text_data_json.get('topics', []))
+            elif message_type == 'unsubscribe':
+                await self.unsubscribe(text_data_json.get('topics', []))
+            elif message_type == 'resume':
+                await self.resume(self.parse_position(text_data_json.get('resume_from')))
         except json.JSONDecodeError:
             logger.error("Invalid JSON received")
         except Exception as e:
             logger.error(f"WebSocket receive error: {e}")
 
-    async def send_initial_state(self):
+    async def subscribe(self, topics):
         """
-        Send initial manufacturing state to connected client
+        Join the channel groups of the requested topics
+        Unknown topics and topics beyond max_topics are reported as rejected
+        """
+        rejected = []
+        for topic in topics:
+            if topic in self.topics:
+                continue
+            if not Topic.is_valid(topic) or len(self.topics) >= self.max_topics:
+                rejected.append(topic)
+                continue
+            await self.channel_layer.group_add(topic, self.channel_name)
+            self.topics.add(topic)
+        await self.send_subscriptions(rejected)
+
+    async def unsubscribe(self, topics):
+        """
+        Leave the channel groups of the given topics
+        """
+        for topic in topics:
+            if topic in self.topics:
+                await self.channel_layer.group_discard(topic, self.channel_name)
+                self.topics.discard(topic)
+        await self.send_subscriptions()
+
+    async def send_subscriptions(self, rejected=()):
+        """
+        Confirm the topics this connection is subscribed to
         """
-        initial_state = {
-            'workstations': await self.get_workstation_status(),
-            'low_stock_materials': await self.get_low_stock_materials(),
-            'pending_work_orders': await self.get_pending_work_orders()
-        }
         await self.send(text_data=json.dumps({
-            'type': 'initial_state',
-            'data': initial_state
+            'type': 'subscriptions',
+            'topics': sorted(self.topics),
+            'rejected': list(rejected)
         }))
 
+    @staticmethod
+    def parse_position(value):
+        """
+        Sequence number or version sent by a client, None when it is not one
+        """
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    async def resume(self, resume_from):
+        """
+        Replay the events missed on subscribed topics since a sequence number
+
+        Returns:
+            bool: False when resume_from is missing or invalid, or the missed
+                events are no longer buffered, and the client has to reload
+                its state instead
+        """
+        missed = None
+        if resume_from is not None:
+            missed = await sync_to_async(EventReplayBuffer.since)(resume_from, self.topics)
+        if missed is None:
+            await self.send(text_data=json.dumps({
+                'type': 'resume_failed',
+                'resume_from': resume_from
+            }))
+            return False
+
+        await self.send(text_data=json.dumps({
+            'type': 'manufacturing_events',
+            'resumed': True,
+            'events': [
+                {
+                    'seq': message['seq'],
+                    'event_type': message['event_type'],
+                    'data': message['data'],
+                    'timestamp': message.get('timestamp')
+                }
+                for message in missed
+            ]
+        }, default=str))
+        return True
+
+    async def send_initial_state(self, since_version=None):
+        """
+        Send the shared initial state snapshot to the connected client
+        """
+        message = await self.get_initial_state(since_version)
+        await self.send(text_data=json.dumps(message, default=str))
+
     async def send_workorder_details(self, work_order_id):
         """
         Send detailed information about a specific work order
@@ -78,32 +191,73 @@ class ManufacturingConsumer(AsyncWebsocketConsumer):
     async def event_message(self, event):
         """
         Generic event handler for all manufacturing events
-        Broadcasts events to connected clients
+        Buffers the event and sends it with the next coalesced frame
         """
-        await self.send(text_data=json.dumps({
-            'type': 'manufacturing_event',
+        self.pending_events[self.coalesce_key(event)] = {
+            'seq': event.get('seq'),
             'event_type': event['event_type'],
-            'data': event['data']
-        }))
+            'data': event['data'],
+            'timestamp': event.get('timestamp')
+        }
 
-    @database_sync_to_async
-    def get_workstation_status(self):
-        """Retrieve current workstation statuses"""
-        return list(WorkStation.objects.values('id', 'name', 'status'))
+        # Backpressure: keep the buffer bounded for clients that fall behind
+        overflow = len(self.pending_events) - self.max_pending_events
+        if overflow > 0:
+            for key in list(self.pending_events)[:overflow]:
+                del self.pending_events[key]
+            self.dropped_events += overflow
 
-    @database_sync_to_async
-    def get_low_stock_materials(self):
-        """Retrieve materials below reorder level"""
-        return list(Material.objects.filter(
-            quantity__lte=models.F('reorder_level')
-        ).values('id', 'name', 'quantity', 'reorder_level'))
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_after_window())
+
+    async def event_batch(self, event):
+        """
+        Batch of events relayed from the outbox in one group message
+        """
+        for item in event['events']:
+            await self.event_message(item)
+
+    def coalesce_key(self, event):
+        """
+        Events about the same entity replace each other within a window,
+        events without an entity ID are never merged
+        """
+        data = event.get('data') or {}
+        for entity_key in self.entity_keys:
+            if entity_key in data:
+                return (event['event_type'], entity_key, data[entity_key])
+        self.event_counter += 1
+        return (event['event_type'], None, self.event_counter)
+
+    async def flush_after_window(self):
+        """
+        Wait for the coalescing window, then send buffered events as one frame
+        Events arriving while the frame is being sent wait for the next one
+        """
+        try:
+            await asyncio.sleep(self.coalesce_window)
+            while self.pending_events:
+                # Merged events keep their first position, send them in sequence order
+                events = sorted(self.pending_events.values(), key=lambda item: item['seq'] or 0)
+                dropped = self.dropped_events
+                self.pending_events = {}
+                self.dropped_events = 0
+
+                frame = {
+                    'type': 'manufacturing_events',
+                    'events': events
+                }
+                if dropped:
+                    # Client missed events and should reload its state
+                    frame['dropped'] = dropped
+                await self.send(text_data=json.dumps(frame, default=str))
+        finally:
+            self.flush_task = None
 
     @database_sync_to_async
-    def get_pending_work_orders(self):
-        """Retrieve pending work orders"""
-        return list(WorkOrder.objects.filter(
-            status='PENDING'
-        ).values('id', 'product__name', 'quantity'))
+    def get_initial_state(self, since_version):
+        """Cached initial state, or the deltas since the given version"""
+        return InitialStateSnapshot.as_message(since_version)
 
     @database_sync_to_async
     def get_workorder_details(self, work_order_id):
@@ -120,8 +274,8 @@ class ManufacturingConsumer(AsyncWebsocketConsumer):
                     {
                         'name': pm.material.name,
                         'required_quantity': pm.quantity * work_order.quantity,
-                        'available_quantity': pm.material.quantity
-                    } for pm in work_order.product.productmaterial_set.all()
+                        'available_quantity': pm.material.available_quantity
+                    } for pm in work_order.product.productmaterial_set.select_related('material__stock_summary')
                 ]
             }
         except WorkOrder.DoesNotExist:
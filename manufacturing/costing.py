@@ -0,0 +1,414 @@
+"""
+Batch product costing
+
+The bill of materials, the workstation routing and the material and
+workstation rate tables are loaded once, in five queries, into column arrays:
+
+- BOM lines: material index and quantity, sliced per product by bom_offsets
+- Routing steps: workstation index and duration in microseconds, sliced by
+  route_offsets
+
+Line costs are computed column-wise in one pass and summed per product
+through the offsets, so costing the whole catalogue issues no per-product
+queries and does no per-row float round trips.
+"""
+from array import array
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Material, Product, ProductCostSummary, ProductMaterial, ProductWorkstationSequence, WorkOrder,
+    WorkStation
+)
+
+ZERO = Decimal('0')
+MICROSECONDS_PER_HOUR = Decimal(3600 * 10 ** 6)
+COST_FIELD = DecimalField(max_digits=20, decimal_places=4)
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def duration_microseconds(duration):
+    """Whole microseconds in a timedelta, zero for None"""
+    return duration // timedelta(microseconds=1) if duration else 0
+
+
+def profitability_category(profit_margin):
+    return (
+        'Highly Profitable' if profit_margin > 30 else
+        'Profitable' if profit_margin > 15 else
+        'Low Margin' if profit_margin > 0 else
+        'Loss-Making'
+    )
+
+
+def profitability(product_id, name, sell_cost, labor_cost, material_costs, material_breakdown,
+                  workstation_costs, workstation_breakdown):
+    """
+    Total cost, profit and margin of one product from its cost components
+    """
+    total_cost = material_costs + labor_cost + workstation_costs
+    profit = sell_cost - total_cost
+    profit_margin = (profit / sell_cost * 100) if sell_cost > 0 else 0
+
+    return {
+        'product_id': product_id,
+        'product_name': name,
+        'material_costs': material_costs,
+        'material_breakdown': material_breakdown,
+        'labor_costs': labor_cost,
+        'workstation_costs': workstation_costs,
+        'workstation_breakdown': workstation_breakdown,
+        'total_cost': total_cost,
+        'sell_cost': sell_cost,
+        'profit': profit,
+        'profit_margin': profit_margin,
+        'profitability_category': profitability_category(profit_margin)
+    }
+
+
+def profitability_summary(products):
+    """
+    Catalogue-wide totals with the per-product figures
+    """
+    if not products:
+        return {
+            'total_products': 0,
+            'total_sell_cost': 0,
+            'total_cost': 0,
+            'total_profit': 0,
+            'average_profit_margin': 0,
+            'products': []
+        }
+
+    return {
+        'total_products': len(products),
+        'total_sell_cost': sum(item['sell_cost'] for item in products),
+        'total_cost': sum(item['total_cost'] for item in products),
+        'total_profit': sum(item['profit'] for item in products),
+        'average_profit_margin': sum(item['profit_margin'] for item in products) / len(products),
+        'products': products
+    }
+
+
+class CostingEngine:
+    """
+    Material, workstation and labour cost plus margin for many products
+
+    Args:
+        products (iterable): (id, name, sell_cost, labor_cost) rows
+        bom (iterable): (product_id, material_id, quantity) rows
+        routing (iterable): (product_id, workstation_id, estimated_time) rows
+            in sequence order
+        materials (iterable): (id, name, cost_per_unit) rows
+        workstations (iterable): (id, name, hourly_operating_cost) rows
+    """
+
+    def __init__(self, products, bom, routing, materials, workstations):
+        self.product_ids = array('q')
+        self.product_names = []
+        self.sell_costs = []
+        self.labor_costs = []
+        for product_id, name, sell_cost, labor_cost in products:
+            self.product_ids.append(product_id)
+            self.product_names.append(name)
+            self.sell_costs.append(sell_cost or ZERO)
+            self.labor_costs.append(labor_cost or ZERO)
+        product_index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+
+        material_index = {}
+        self.material_names = []
+        self.material_rates = []
+        for material_id, name, cost_per_unit in materials:
+            material_index[material_id] = len(self.material_names)
+            self.material_names.append(name)
+            self.material_rates.append(cost_per_unit)
+
+        workstation_index = {}
+        self.workstation_names = []
+        self.workstation_rates = []
+        for workstation_id, name, hourly_cost in workstations:
+            workstation_index[workstation_id] = len(self.workstation_names)
+            self.workstation_names.append(name)
+            self.workstation_rates.append(hourly_cost or ZERO)
+
+        self.bom_offsets, bom_lines = self._group(
+            ((product_index.get(product_id), (material_index[material_id], quantity))
+             for product_id, material_id, quantity in bom)
+        )
+        self.bom_materials = array('q', (material for material, _ in bom_lines))
+        self.bom_quantities = [quantity for _, quantity in bom_lines]
+
+        self.route_offsets, route_steps = self._group(
+            ((product_index.get(product_id), (workstation_index[workstation_id], estimated_time))
+             for product_id, workstation_id, estimated_time in routing)
+        )
+        self.route_workstations = array('q', (workstation for workstation, _ in route_steps))
+        self.route_microseconds = array(
+            'q', (duration_microseconds(estimated_time) for _, estimated_time in route_steps)
+        )
+
+    def _group(self, rows):
+        """
+        Counting sort of (product index, value) rows into a flat value list
+        and per-product offsets, keeping the input order within a product
+        """
+        rows = [(i, value) for i, value in rows if i is not None]
+        offsets = array('q', bytes(8 * (len(self.product_ids) + 1)))
+        for i, _ in rows:
+            offsets[i + 1] += 1
+        for i in range(len(self.product_ids)):
+            offsets[i + 1] += offsets[i]
+
+        values = [None] * len(rows)
+        position = array('q', offsets[:-1])
+        for i, value in rows:
+            values[position[i]] = value
+            position[i] += 1
+        return offsets, values
+
+    @classmethod
+    def from_database(cls, product_ids=None):
+        """
+        Load the tables for all products, or only the given ones
+        """
+        products = Product.objects.order_by('id')
+        bom = ProductMaterial.objects.order_by('id')
+        routing = ProductWorkstationSequence.objects.order_by('product_id', 'sequence_order')
+        materials = Material.objects.all()
+        workstations = WorkStation.objects.all()
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            bom = bom.filter(product_id__in=product_ids)
+            routing = routing.filter(product_id__in=product_ids)
+            materials = materials.filter(productmaterial__product_id__in=product_ids).distinct()
+            workstations = workstations.filter(productworkstationsequence__product_id__in=product_ids).distinct()
+
+        return cls(
+            products.values_list('id', 'name', 'sell_cost', 'labor_cost'),
+            bom.values_list('product_id', 'material_id', 'quantity'),
+            routing.values_list('product_id', 'workstation_id', 'estimated_time'),
+            materials.values_list('id', 'name', 'cost_per_unit'),
+            workstations.values_list('id', 'name', 'hourly_operating_cost')
+        )
+
+    def product_costs(self):
+        """
+        Profitability of every loaded product, in product id order
+        """
+        material_rates = self.material_rates
+        bom_costs = [
+            rate * quantity if rate is not None else None
+            for rate, quantity in zip(
+                (material_rates[m] for m in self.bom_materials), self.bom_quantities
+            )
+        ]
+        workstation_rates = self.workstation_rates
+        # Multiply before dividing so whole-cent results stay exact
+        route_costs = [
+            workstation_rates[w] * microseconds / MICROSECONDS_PER_HOUR
+            for w, microseconds in zip(self.route_workstations, self.route_microseconds)
+        ]
+
+        results = []
+        for i, product_id in enumerate(self.product_ids):
+            bom_start, bom_end = self.bom_offsets[i], self.bom_offsets[i + 1]
+            route_start, route_end = self.route_offsets[i], self.route_offsets[i + 1]
+
+            results.append(profitability(
+                product_id,
+                self.product_names[i],
+                self.sell_costs[i],
+                self.labor_costs[i],
+                sum((cost for cost in bom_costs[bom_start:bom_end] if cost is not None), ZERO),
+                [
+                    {
+                        'material__name': self.material_names[self.bom_materials[line]],
+                        'material_total_cost': bom_costs[line]
+                    }
+                    for line in range(bom_start, bom_end)
+                ],
+                sum(route_costs[route_start:route_end], ZERO),
+                [
+                    {
+                        'workstation_name': self.workstation_names[self.route_workstations[step]],
+                        'hourly_rate': float(workstation_rates[self.route_workstations[step]]),
+                        'estimated_time_hours': self.route_microseconds[step] / 3600e6,
+                        'cost': float(route_costs[step])
+                    }
+                    for step in range(route_start, route_end)
+                ]
+            ))
+        return results
+
+    def summary(self):
+        """
+        Catalogue-wide totals with the per-product figures
+        """
+        return profitability_summary(self.product_costs())
+
+
+class ProductCostCache:
+    """
+    Per-product unit costs kept in ProductCostSummary
+
+    Summaries are dropped, in the writer's transaction, for exactly the
+    products whose inputs changed: a material price reaches only products
+    whose BOM holds that material, a workstation rate only products routed
+    through it. Missing summaries are recomputed in one batch on the next
+    read. Queryset updates and bulk_create bypass the receivers, so callers
+    doing those invalidate explicitly.
+    """
+    batch_size = 500
+
+    @classmethod
+    def invalidate(cls, product_ids):
+        ProductCostSummary.objects.filter(product_id__in=product_ids).delete()
+
+    @classmethod
+    def invalidate_material(cls, material_id):
+        cls.invalidate(ProductMaterial.objects.filter(material_id=material_id).values('product_id'))
+
+    @classmethod
+    def invalidate_workstation(cls, workstation_id):
+        cls.invalidate(
+            ProductWorkstationSequence.objects.filter(workstation_id=workstation_id).values('product_id')
+        )
+
+    @staticmethod
+    def _summary(costs):
+        return ProductCostSummary(
+            product_id=costs['product_id'],
+            material_cost=costs['material_costs'],
+            workstation_cost=costs['workstation_costs'],
+            material_breakdown=[
+                {
+                    'material__name': line['material__name'],
+                    'material_total_cost': (
+                        float(line['material_total_cost'])
+                        if line['material_total_cost'] is not None else None
+                    )
+                }
+                for line in costs['material_breakdown']
+            ],
+            workstation_breakdown=costs['workstation_breakdown']
+        )
+
+    @classmethod
+    def refresh(cls):
+        """
+        Compute the summaries that are missing
+
+        Returns:
+            int: Number of products recomputed
+        """
+        missing = list(
+            Product.objects.filter(cost_summary__isnull=True).order_by('id').values_list('id', flat=True)
+        )
+        for start in range(0, len(missing), cls.batch_size):
+            engine = CostingEngine.from_database(missing[start:start + cls.batch_size])
+            ProductCostSummary.objects.bulk_create(
+                [cls._summary(costs) for costs in engine.product_costs()],
+                ignore_conflicts=True
+            )
+        return len(missing)
+
+    @classmethod
+    def summaries(cls):
+        """
+        Current summaries of every product, keyed by product id
+        """
+        cls.refresh()
+        return ProductCostSummary.objects.in_bulk()
+
+    @classmethod
+    def profitability(cls):
+        """
+        Profitability summary of the catalogue from the cached unit costs
+        """
+        summaries = cls.summaries()
+        products = []
+        for product_id, name, sell_cost, labor_cost in Product.objects.order_by('id').values_list(
+            'id', 'name', 'sell_cost', 'labor_cost'
+        ):
+            summary = summaries.get(product_id)
+            if summary is None:
+                # Created after the refresh, picked up on the next read
+                continue
+            products.append(profitability(
+                product_id,
+                name,
+                sell_cost or ZERO,
+                labor_cost or ZERO,
+                summary.material_cost,
+                summary.material_breakdown,
+                summary.workstation_cost,
+                summary.workstation_breakdown
+            ))
+        return profitability_summary(products)
+
+
+def work_order_costs(start_date=None, end_date=None, product_ids=None):
+    """
+    Work orders with their estimated material cost
+
+    The per-product unit cost is pre-aggregated in ProductCostSummary, so it
+    is a single one-to-one join multiplied by the work order quantity rather
+    than a fan-out over the BOM.
+
+    Args:
+        start_date (date): Created on or after this day
+        end_date (date): Created on or before this day
+        product_ids (list): Only work orders for these products
+    """
+    ProductCostCache.refresh()
+
+    queryset = WorkOrder.objects.all()
+    if start_date is not None:
+        queryset = queryset.filter(created_at__gte=start_of_day(start_date))
+    if end_date is not None:
+        queryset = queryset.filter(created_at__lt=start_of_day(end_date + timedelta(days=1)))
+    if product_ids:
+        queryset = queryset.filter(product_id__in=product_ids)
+
+    return queryset.annotate(
+        unit_material_cost=Coalesce(
+            F('product__cost_summary__material_cost'), Value(ZERO), output_field=COST_FIELD
+        ),
+        estimated_material_cost=ExpressionWrapper(
+            F('quantity') * F('unit_material_cost'), output_field=COST_FIELD
+        )
+    )
+
+
+@receiver(post_save, sender=Material)
+def invalidate_material_costs(sender, instance, created, **kwargs):
+    if not created and (instance.has_changed('cost_per_unit') or instance.has_changed('name')):
+        ProductCostCache.invalidate_material(instance.pk)
+
+
+@receiver(post_save, sender=WorkStation)
+def invalidate_workstation_costs(sender, instance, created, **kwargs):
+    if not created and (instance.has_changed('hourly_operating_cost') or instance.has_changed('name')):
+        ProductCostCache.invalidate_workstation(instance.pk)
+
+
+@receiver(post_save, sender=ProductMaterial)
+@receiver(post_save, sender=ProductWorkstationSequence)
+def invalidate_product_costs(sender, instance, **kwargs):
+    product_ids = {instance.product_id, instance.previous('product')} - {None}
+    ProductCostCache.invalidate(product_ids)
+
+
+@receiver(post_delete, sender=ProductMaterial)
+@receiver(post_delete, sender=ProductWorkstationSequence)
+def invalidate_removed_product_costs(sender, instance, **kwargs):
+    ProductCostCache.invalidate([instance.product_id])
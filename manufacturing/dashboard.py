@@ -0,0 +1,138 @@
+"""
+Work order dashboard statistics
+
+All counters come from a single conditional aggregation over WorkOrder, and
+the result is cached per day in the shared cache. The cached copy is dropped
+once a change commits when:
+
+- a work order is created or deleted, or a save changes a field the counters
+  read (status, priority, start or end date)
+- dependencies are added or removed
+- the batch start and completion paths finish their queryset updates
+
+Other queryset updates and product renames in the upcoming list are not
+tracked. They show once the timeout expires, at most 30 seconds later.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import WorkOrder
+
+
+class WorkOrderDashboardStats:
+    """
+    Cached work order counters for the dashboard
+    """
+    cache_key_prefix = 'manufacturing:dashboard_stats'
+    timeout = 30
+    # Work orders listed as waiting on pending dependencies
+    upcoming_limit = 20
+
+    @classmethod
+    def cache_key(cls, day):
+        return f'{cls.cache_key_prefix}:{day.isoformat()}'
+
+    @classmethod
+    def get(cls):
+        """
+        Statistics for today, computed only when not cached
+        """
+        today = timezone.now().date()
+        stats = cache.get(cls.cache_key(today))
+        if stats is None:
+            stats = cls.build(today)
+            cache.set(cls.cache_key(today), stats, cls.timeout)
+        return stats
+
+    @classmethod
+    def invalidate(cls):
+        cache.delete(cls.cache_key(timezone.now().date()))
+
+    @classmethod
+    def build(cls, today):
+        """
+        Compute the statistics with one aggregate and one bounded query
+        """
+        statuses = [status for status, _ in WorkOrder.WORK_ORDER_STATUS_CHOICES]
+        priorities = [priority for priority, _ in WorkOrder.PRIORITY_CHOICES]
+        started_today = Q(start_date__date=today)
+
+        counts = WorkOrder.objects.aggregate(
+            total=Count('id'),
+            today_total=Count('id', filter=started_today),
+            today_completed=Count('id', filter=started_today & Q(status='COMPLETED')),
+            today_in_progress=Count('id', filter=started_today & Q(status='IN_PROGRESS')),
+            overdue=Count('id', filter=Q(
+                end_date__lt=today,
+                status__in=['PENDING', 'IN_PROGRESS']
+            )),
+            **{
+                f'status_{status}': Count('id', filter=Q(status=status))
+                for status in statuses
+            },
+            **{
+                f'priority_{priority}': Count('id', filter=Q(priority=priority))
+                for priority in priorities
+            }
+        )
+
+        return {
+            'total_work_orders': counts['total'],
+            'status_breakdown': {
+                status: counts[f'status_{status}'] for status in statuses
+            },
+            'priority_breakdown': {
+                priority: counts[f'priority_{priority}'] for priority in priorities
+            },
+            'today_work_orders': {
+                'total': counts['today_total'],
+                'completed': counts['today_completed'],
+                'in_progress': counts['today_in_progress']
+            },
+            'overdue_work_orders': counts['overdue'],
+            'blocked_work_orders': counts['status_BLOCKED'],
+            'upcoming_dependencies': cls.upcoming_dependencies()
+        }
+
+    @classmethod
+    def upcoming_dependencies(cls):
+        """
+        Most recent work orders waiting on a pending dependency
+
+        A semi-join on the dependency table replaces the DISTINCT over the
+        M2M join, and the (-created_at, id) index serves the limited scan.
+        """
+        pending_dependency = WorkOrder.dependencies.through.objects.filter(
+            from_workorder=OuterRef('pk'),
+            to_workorder__status='PENDING'
+        )
+        return list(
+            WorkOrder.objects.filter(
+                Exists(pending_dependency)
+            ).order_by('-created_at', 'id').values(
+                'id', 'product__name', 'status'
+            )[:cls.upcoming_limit]
+        )
+
+
+@receiver(post_save, sender=WorkOrder)
+def invalidate_saved_work_order(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or any(instance.has_changed(field) for field in WorkOrder.tracked_fields):
+        transaction.on_commit(WorkOrderDashboardStats.invalidate)
+
+
+@receiver(post_delete, sender=WorkOrder)
+def invalidate_deleted_work_order(sender, instance, **kwargs):
+    transaction.on_commit(WorkOrderDashboardStats.invalidate)
+
+
+@receiver(m2m_changed, sender=WorkOrder.dependencies.through)
+def invalidate_work_order_dependencies(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(WorkOrderDashboardStats.invalidate)
@@ -0,0 +1,187 @@
+"""
+Work order dependency index
+
+WorkOrder.unfinished_dependencies counts the dependencies of an order that
+are not COMPLETED, so readiness is a column check instead of a join over the
+dependencies table. The count follows every change made through the
+dependencies relation (either side), dependencies reaching or leaving
+COMPLETED, and dependencies being deleted.
+
+Adding a dependency that would close a cycle raises DependencyCycleError
+before anything is written. Rows written straight to the through table, like
+queryset status updates, bypass the signals; run the rebuild_dependency_index
+command after such bulk edits.
+"""
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .exceptions import DependencyCycleError
+from .models import WorkOrder
+
+Dependency = WorkOrder.dependencies.through
+
+
+class DependencyIndex:
+    """
+    Maintain and query the unfinished dependency counts
+    """
+    # Orders not started yet, released once nothing they depend on is open
+    RELEASABLE_STATUSES = ('PENDING', 'QUEUED', 'READY')
+
+    @staticmethod
+    def find_path(sources, targets):
+        """
+        Walk from the sources through what they depend on, one query per level
+
+        Returns:
+            int: The first target reached, None when none is
+        """
+        targets = set(targets)
+        seen = set(sources)
+        frontier = set(sources)
+        while frontier:
+            reached = frontier & targets
+            if reached:
+                return min(reached)
+            frontier = set(
+                Dependency.objects.filter(
+                    from_workorder_id__in=frontier
+                ).values_list('to_workorder_id', flat=True)
+            ) - seen
+            seen |= frontier
+        return None
+
+    @classmethod
+    def check_acyclic(cls, work_order_id, dependency_ids):
+        """
+        Raise DependencyCycleError if work_order_id depending on
+        dependency_ids would close a cycle
+        """
+        if cls.find_path(dependency_ids, [work_order_id]) is not None:
+            raise DependencyCycleError(work_order_id, sorted(dependency_ids))
+
+    @staticmethod
+    def unfinished_count():
+        """
+        Subquery counting the open dependencies of the outer work order
+        """
+        unfinished = Dependency.objects.filter(
+            from_workorder=OuterRef('pk')
+        ).exclude(
+            to_workorder__status='COMPLETED'
+        ).order_by().values('from_workorder').annotate(count=Count('id')).values('count')
+        return Coalesce(Subquery(unfinished, output_field=IntegerField()), 0)
+
+    @classmethod
+    def recount(cls, work_order):
+        """
+        Recount the open dependencies of one order and keep the instance in step
+        """
+        work_order.unfinished_dependencies = Dependency.objects.filter(
+            from_workorder_id=work_order.pk
+        ).exclude(to_workorder__status='COMPLETED').count()
+        WorkOrder.objects.filter(pk=work_order.pk).update(
+            unfinished_dependencies=work_order.unfinished_dependencies
+        )
+
+    @staticmethod
+    def shift_dependents(work_order_id, delta, dependent_ids=None):
+        """
+        Add delta to the count of every order depending on work_order_id
+        """
+        if dependent_ids is None:
+            dependent_ids = Dependency.objects.filter(
+                to_workorder_id=work_order_id
+            ).values('from_workorder_id')
+        WorkOrder.objects.filter(pk__in=dependent_ids).update(
+            unfinished_dependencies=F('unfinished_dependencies') + delta
+        )
+
+    @staticmethod
+    def completed(work_order_ids):
+        """
+        Release the dependents of orders completed by a queryset update, one
+        UPDATE for the whole batch
+        """
+        completed_dependencies = Dependency.objects.filter(
+            from_workorder=OuterRef('pk'),
+            to_workorder_id__in=work_order_ids
+        ).order_by().values('from_workorder').annotate(count=Count('id')).values('count')
+        WorkOrder.objects.filter(
+            pk__in=Dependency.objects.filter(to_workorder_id__in=work_order_ids).values('from_workorder_id')
+        ).update(
+            unfinished_dependencies=F('unfinished_dependencies') - Subquery(
+                completed_dependencies, output_field=IntegerField()
+            )
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute every count from the dependencies table
+
+        Returns:
+            int: Number of work orders updated
+        """
+        return WorkOrder.objects.update(unfinished_dependencies=cls.unfinished_count())
+
+    @staticmethod
+    def priority_rank():
+        return Case(
+            *[When(priority=priority, then=Value(rank)) for priority, rank in WorkOrder.PRIORITY_RANK.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+
+    @classmethod
+    def ready(cls, queryset=None):
+        """
+        Releasable orders with nothing left to wait on, most urgent and oldest
+        first
+        """
+        queryset = WorkOrder.objects.all() if queryset is None else queryset
+        return queryset.filter(
+            status__in=cls.RELEASABLE_STATUSES,
+            unfinished_dependencies=0
+        ).annotate(
+            priority_rank=cls.priority_rank()
+        ).order_by('-priority_rank', 'created_at', 'id')
+
+
+@receiver(m2m_changed, sender=Dependency)
+def maintain_dependency_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_add':
+        if reverse:
+            # instance becomes a dependency of every order in pk_set
+            work_order_id = DependencyIndex.find_path([instance.pk], pk_set)
+            if work_order_id is not None:
+                raise DependencyCycleError(work_order_id, [instance.pk])
+        else:
+            DependencyIndex.check_acyclic(instance.pk, pk_set)
+    elif action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        DependencyIndex.recount(instance)
+    elif action == 'pre_clear' and reverse:
+        instance._cleared_dependent_ids = list(
+            Dependency.objects.filter(to_workorder_id=instance.pk).values_list('from_workorder_id', flat=True)
+        )
+    elif action in ('post_add', 'post_remove', 'post_clear') and instance.status != 'COMPLETED':
+        dependent_ids = instance.__dict__.pop('_cleared_dependent_ids', None) if action == 'post_clear' else pk_set
+        DependencyIndex.shift_dependents(instance.pk, 1 if action == 'post_add' else -1, dependent_ids)
+
+
+@receiver(post_save, sender=WorkOrder)
+def update_dependent_counts(sender, instance, created, raw=False, **kwargs):
+    if raw or created or not instance.has_changed('status'):
+        return
+    was_completed = instance.previous('status') == 'COMPLETED'
+    if (instance.status == 'COMPLETED') != was_completed:
+        DependencyIndex.shift_dependents(instance.pk, 1 if was_completed else -1)
+
+
+@receiver(pre_delete, sender=WorkOrder)
+def release_dependents_of_deleted(sender, instance, **kwargs):
+    # The dependency rows go with the order, so it stops blocking anyone
+    if instance.previous('status') != 'COMPLETED':
+        DependencyIndex.shift_dependents(instance.pk, -1)
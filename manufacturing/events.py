@@ -1,22 +1,27 @@
+import logging
+import re
+from decimal import Decimal
+
 from django.dispatch import receiver
 from django.db.models.signals import post_save, pre_save
 from django.contrib.auth import get_user_model
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from django.utils import timezone
 
 from .models import WorkOrder, Material, Product, ProductionLog, WorkStation
 
 User = get_user_model()
-channel_layer = get_channel_layer()
+logger = logging.getLogger(__name__)
 
 class EventType:
     """Standardized event types for consistent messaging"""
     WORK_ORDER_CREATED = 'work_order.created'
     WORK_ORDER_STARTED = 'work_order.started'
+    WORK_ORDERS_BULK_STARTED = 'work_order.bulk_started'
     WORK_ORDER_COMPLETED = 'work_order.completed'
+    WORK_ORDERS_BULK_COMPLETED = 'work_order.bulk_completed'
     MATERIAL_LOW_STOCK = 'material.low_stock'
+    MATERIAL_RESTOCKED = 'material.restocked'
     PRODUCT_STATUS_CHANGED = 'product.status_changed'
+    WORKSTATION_STATUS_CHANGED = 'workstation.status_changed'
     WORKSTATION_PROCESSING_STARTED = 'workstation.processing_started'
     WORKSTATION_PROCESSING_COMPLETED = 'workstation.processing_completed'
     WORKSTATION_EFFICIENCY_UPDATE = 'workstation.efficiency_update'
@@ -27,6 +32,61 @@ class EventType:
     PRODUCT_QUALITY_CHECK = 'product.quality_check'
     PACKAGING_STARTED = 'packaging.started'
     PACKAGING_COMPLETED = 'packaging.completed'
+    SCHEDULE_REPAIRED = 'schedule.repaired'
+
+class Topic:
+    """
+    Channel groups clients subscribe to, so each socket only receives the
+    events it displays
+    """
+    ORDERS = 'orders'
+    PRODUCTS = 'products'
+    PRODUCTION = 'production'
+    WORKSTATIONS = 'workstations'
+    MATERIAL_LOW_STOCK = 'material.low_stock'
+
+    PATTERN = re.compile(
+        r'^(orders|products|production|workstations|material\.low_stock|workstation\.\d+|work_order\.\d+)$'
+    )
+
+    @staticmethod
+    def workstation(workstation_id):
+        return f'workstation.{workstation_id}'
+
+    @staticmethod
+    def work_order(work_order_id):
+        return f'work_order.{work_order_id}'
+
+    @classmethod
+    def is_valid(cls, topic):
+        return isinstance(topic, str) and bool(cls.PATTERN.match(topic))
+
+    @classmethod
+    def for_event(cls, event_type, data):
+        """
+        Topic groups an event is routed to, based on its type and the
+        entities referenced in its payload
+        """
+        topics = []
+        if event_type in (EventType.MATERIAL_LOW_STOCK, EventType.MATERIAL_RESTOCKED):
+            topics.append(cls.MATERIAL_LOW_STOCK)
+        if event_type == EventType.WORKSTATION_STATUS_CHANGED:
+            topics.append(cls.WORKSTATIONS)
+        if event_type.startswith('work_order.'):
+            topics.append(cls.ORDERS)
+        if event_type.startswith('product.'):
+            topics.append(cls.PRODUCTS)
+        if event_type.startswith('schedule.'):
+            topics.append(cls.PRODUCTION)
+
+        if data.get('work_order_id') is not None:
+            topics.append(cls.work_order(data['work_order_id']))
+        for work_order_id in data.get('work_order_ids', []):
+            topics.append(cls.work_order(work_order_id))
+        if data.get('workstation_id') is not None:
+            topics.append(cls.workstation(data['workstation_id']))
+
+        return topics or [cls.PRODUCTION]
 
 class WorkflowEvent:
     """
@@ -34,25 +94,42 @@ class WorkflowEvent:
     Handles event creation, logging, and notification dispatch
     """
     @staticmethod
-    async def dispatch_event(event_type, data, group_name='manufacturing'):
+    async def dispatch_event(event_type, data, groups=None):
         """
-        Dispatch an event to WebSocket channel
+        Dispatch an event to WebSocket channel from async code
+        
+        The event goes through the outbox like published ones, so it is
+        numbered and can be replayed to resuming clients.
         
         Args:
             event_type (str): Type of event from EventType
             data (dict): Event payload
-            group_name (str): Channel group to send event
+            groups (list, optional): Channel groups to send event,
+                routed by Topic.for_event by default
         """
+        from channels.db import database_sync_to_async  # Import here, only async callers need it
+
         try:
-            await channel_layer.group_send(group_name, {
-                'type': 'event_message',
-                'event_type': event_type,
-                'data': data,
-                'timestamp': timezone.now().isoformat()  # Add timestamp to all events
-            })
-        except Exception as e:
-            # Log event dispatch errors
-            print(f"Event Dispatch Error: {e}")
+            await database_sync_to_async(WorkflowEvent.publish)(event_type, data, groups)
+        except Exception:
+            logger.exception("Event dispatch failed for %s", event_type)
+    
+    @staticmethod
+    def publish(event_type, data, groups=None):
+        """
+        Queue an event in the transactional outbox
+        
+        The event is relayed to the WebSocket channel only if the current
+        transaction commits, without blocking the caller on the channel layer.
+        
+        Args:
+            event_type (str): Type of event from EventType
+            data (dict): Event payload
+            groups (list, optional): Channel groups to send event,
+                routed by Topic.for_event by default
+        """
+        from .outbox import OutboxRelay  # Import here to avoid circular import
+        return OutboxRelay.enqueue(event_type, data, groups or Topic.for_event(event_type, data))
     
     @staticmethod
     def create_production_log(event_type, work_order, product, workstation=None, details=None):
@@ -120,12 +197,14 @@ class WorkOrderEventHandler:
         material_status = cls._check_material_availability(work_order)
         
         # Dispatch creation event
-        async_to_sync(WorkflowEvent.dispatch_event)(
+        WorkflowEvent.publish(
             EventType.WORK_ORDER_CREATED, 
             {
                 'work_order_id': work_order.id,
+                'workstation_id': work_order.workstation_id,
                 'product_name': work_order.product.name,
                 'quantity': work_order.quantity,
+                'status': work_order.status,
                 'material_status': material_status
             }
         )
@@ -139,14 +218,17 @@ class WorkOrderEventHandler:
             dict: Status of material availability
         """
         material_status = {}
-        for product_material in work_order.product.productmaterial_set.all():
+        for product_material in work_order.product.productmaterial_set.select_related(
+            'material__stock_summary'
+        ):
             material = product_material.material
             required_quantity = product_material.quantity * work_order.quantity
+            available = material.stock_summary.available if hasattr(material, 'stock_summary') else 0
             
             material_status[material.name] = {
                 'required': required_quantity,
-                'available': material.quantity,
-                'sufficient': material.quantity >= required_quantity
+                'available': available,
+                'sufficient': available >= required_quantity
             }
         
         return material_status
@@ -154,39 +236,51 @@ class WorkOrderEventHandler:
     @classmethod
     def handle_work_order_start(cls, work_order):
         """
-        Handle material reservation when work order starts
+        Report the material reservations made when a work order starts
         
         Args:
             work_order (WorkOrder): Work order being started
         """
-        # Reserve materials
-        material_reservations = []
-        for product_material in work_order.product.productmaterial_set.all():
-            material = product_material.material
-            required_quantity = product_material.quantity * work_order.quantity
-            
-            # Reduce material quantity
-            material.quantity -= required_quantity
-            material.save()
-            
-            # Track reservation
-            material_reservations.append({
-                'material_name': material.name,
-                'quantity_reserved': required_quantity,
-                'remaining_quantity': material.quantity
-            })
+        # Materials are reserved through the stock ledger, only report them here
+        material_reservations = [
+            {
+                'material_name': material_name,
+                'quantity_reserved': quantity_reserved,
+                'remaining_quantity': available
+            }
+            for material_name, quantity_reserved, available in work_order.material_reservations.values_list(
+                'material__name', 'quantity_reserved', 'material__stock_summary__available'
+            )
+        ]
         
         # Dispatch start event
-        async_to_sync(WorkflowEvent.dispatch_event)(
+        WorkflowEvent.publish(
             EventType.WORK_ORDER_STARTED,
             {
                 'work_order_id': work_order.id,
+                'workstation_id': work_order.workstation_id,
                 'product_name': work_order.product.name,
                 'quantity': work_order.quantity,
                 'material_reservations': material_reservations
             }
         )
     
+    @classmethod
+    def handle_bulk_start(cls, work_order_ids):
+        """
+        Dispatch a single event for a batch of work orders started together
+        
+        Args:
+            work_order_ids (list): IDs of the work orders that were started
+        """
+        WorkflowEvent.publish(
+            EventType.WORK_ORDERS_BULK_STARTED,
+            {
+                'work_order_ids': list(work_order_ids),
+                'count': len(work_order_ids)
+            }
+        )
+    
     @classmethod
     def handle_work_order_completion(cls, work_order):
         """
@@ -210,10 +304,11 @@ class WorkOrderEventHandler:
         )
         
         # Dispatch completion event
-        async_to_sync(WorkflowEvent.dispatch_event)(
+        WorkflowEvent.publish(
             EventType.WORK_ORDER_COMPLETED,
             {
                 'work_order_id': work_order.id,
+                'workstation_id': work_order.workstation_id,
                 'product_name': product.name,
                 'quantity_produced': work_order.quantity,
                 'new_product_quantity': product.current_quantity,
@@ -221,38 +316,90 @@ class WorkOrderEventHandler:
             }
         )
     
+    @classmethod
+    def handle_bulk_completion(cls, work_order_ids, products):
+        """
+        Dispatch a single event for a batch of work orders completed together
+
+        Args:
+            work_order_ids (list): IDs of the work orders that were completed
+            products (list): Dicts with product_id, quantity_produced and
+                new_product_quantity for every product restocked
+        """
+        WorkflowEvent.publish(
+            EventType.WORK_ORDERS_BULK_COMPLETED,
+            {
+                'work_order_ids': list(work_order_ids),
+                'count': len(work_order_ids),
+                'products': [
+                    {
+                        'product_id': product['product_id'],
+                        'quantity_produced': float(product['quantity_produced']),
+                        'new_product_quantity': float(product['new_product_quantity'])
+                    }
+                    for product in products
+                ]
+            }
+        )
+
     @classmethod
     def handle_work_order_cancellation(cls, work_order):
         """
-        Handle material restoration on work order cancellation
+        Handle work order cancellation
+        Reserved materials are released through the stock ledger by the model
         
         Args:
             work_order (WorkOrder): Cancelled work order
         """
-        # Restore reserved materials
-        material_restorations = []
-        for product_material in work_order.product.productmaterial_set.all():
-            material = product_material.material
-            reserved_quantity = product_material.quantity * work_order.quantity
-            
-            # Restore material quantity
-            material.quantity += reserved_quantity
-            material.save()
-            
-            # Track restoration
-            material_restorations.append({
-                'material_name': material.name,
-                'quantity_restored': reserved_quantity,
-                'new_quantity': material.quantity
-            })
-        
         # Dispatch cancellation event
-        async_to_sync(WorkflowEvent.dispatch_event)(
+        WorkflowEvent.publish(
             'work_order.cancelled',
             {
                 'work_order_id': work_order.id,
-                'product_name': work_order.product.name,
-                'material_restorations': material_restorations
+                'workstation_id': work_order.workstation_id,
+                'product_name': work_order.product.name
+            }
+        )
+
+class MaterialEventHandler:
+    """Specialized handler for material stock events"""
+
+    @classmethod
+    def handle_low_stock(cls, materials):
+        """
+        Dispatch one low stock event covering every material in the batch
+
+        Args:
+            materials (list): Dicts with material_id, material_name,
+                current_quantity and reorder_level
+        """
+        WorkflowEvent.publish(
+            EventType.MATERIAL_LOW_STOCK,
+            {
+                'materials': [
+                    {
+                        'material_id': material['material_id'],
+                        'material_name': material['material_name'],
+                        'current_quantity': float(material['current_quantity']),
+                        'reorder_level': float(material['reorder_level'])
+                    }
+                    for material in materials
+                ]
+            }
+        )
+
+    @classmethod
+    def handle_restocked(cls, material_ids):
+        """
+        Dispatch one event for materials back above their reorder level
+
+        Args:
+            material_ids (list): IDs of the restocked materials
+        """
+        WorkflowEvent.publish(
+            EventType.MATERIAL_RESTOCKED,
+            {
+                'material_ids': list(material_ids)
             }
         )
 
@@ -270,57 +417,93 @@ def work_order_status_changed(sender, instance, **kwargs):
     """
     Handle work order status transitions
     """
-    if instance.pk:  # Existing work order
-        original = WorkOrder.objects.get(pk=instance.pk)
+    if instance.pk and instance.has_changed('status'):  # Existing work order
+        old_status = instance.previous('status')
         
-        # Detect status change
-        if original.status != instance.status:
-            if instance.status == 'IN_PROGRESS':
-                WorkOrderEventHandler.handle_work_order_start(instance)
-            elif instance.status == 'COMPLETED':
-                WorkOrderEventHandler.handle_work_order_completion(instance)
-            elif instance.status == 'CANCELLED':
-                WorkOrderEventHandler.handle_work_order_cancellation(instance)
-            
-            # Dispatch generic status change event
-            async_to_sync(WorkflowEvent.dispatch_event)(
-                'work_order.status_changed',
-                {
-                    'work_order_id': instance.id,
-                    'old_status': original.status,
-                    'new_status': instance.status
-                }
-            )
+        if instance.status == 'IN_PROGRESS':
+            WorkOrderEventHandler.handle_work_order_start(instance)
+        elif instance.status == 'COMPLETED':
+            WorkOrderEventHandler.handle_work_order_completion(instance)
+        elif instance.status == 'CANCELLED':
+            WorkOrderEventHandler.handle_work_order_cancellation(instance)
+        
+        # Dispatch generic status change event
+        WorkflowEvent.publish(
+            'work_order.status_changed',
+            {
+                'work_order_id': instance.id,
+                'workstation_id': instance.workstation_id,
+                'old_status': old_status,
+                'new_status': instance.status
+            }
+        )
 
-@receiver(post_save, sender=Material)
-def material_stock_changed(sender, instance, **kwargs):
+@receiver(post_save, sender=WorkStation)
+def workstation_status_changed(sender, instance, created, **kwargs):
     """
-    Monitor material stock levels and trigger low stock alerts
+    Announce new workstations and workstation status transitions
     """
-    if instance.quantity <= instance.reorder_level:
-        async_to_sync(WorkflowEvent.dispatch_event)(
-            EventType.MATERIAL_LOW_STOCK,
+    if created or instance.has_changed('status'):
+        WorkflowEvent.publish(
+            EventType.WORKSTATION_STATUS_CHANGED,
             {
-                'material_id': instance.id,
-                'material_name': instance.name,
-                'current_quantity': instance.quantity,
-                'reorder_level': instance.reorder_level
+                'workstation_id': instance.id,
+                'name': instance.name,
+                'old_status': instance.previous('status'),
+                'status': instance.status
             }
         )
 
+@receiver(post_save, sender=Material)
+def material_stock_changed(sender, instance, created, raw=False, **kwargs):
+    """
+    Queue a low stock alert when a save takes the available stock of a
+    material to or below its reorder level
+
+    Only the crossing is announced, like the reservation engine and the
+    low stock scanner do, so saving a material that is already low stays
+    quiet. Material.save books a quantity edit in the ledger after this
+    receiver runs, so the pending adjustment is applied here.
+    """
+    from .models import MaterialStockSummary  # Import here to avoid circular import
+
+    if raw:
+        return
+    quantity = Decimal(str(instance.quantity))
+    summary = None if created else MaterialStockSummary.objects.filter(
+        material_id=instance.pk
+    ).values_list('on_hand', 'available').first()
+    if created:
+        # The ledger opens a new material with all of it available
+        before, after = None, quantity
+    elif summary is None:
+        before, after = Decimal(str(instance.previous('quantity'))), quantity
+    else:
+        on_hand, before = summary
+        after = before + (quantity - on_hand if instance.has_changed('quantity') else 0)
+
+    previous_level = instance.reorder_level if created else instance.previous('reorder_level')
+    was_low = before is not None and before <= previous_level
+    if after <= instance.reorder_level and not was_low:
+        MaterialEventHandler.handle_low_stock([{
+            'material_id': instance.id,
+            'material_name': instance.name,
+            'current_quantity': after,
+            'reorder_level': instance.reorder_level
+        }])
+
 @receiver(post_save, sender=Product)
-def product_status_changed(sender, instance, **kwargs):
+def product_status_changed(sender, instance, created, **kwargs):
     """
     Monitor product stock status changes
     """
-    if hasattr(instance, '_previous_stock_status'):
-        if instance._previous_stock_status != instance.stock_status:
-            async_to_sync(WorkflowEvent.dispatch_event)(
-                EventType.PRODUCT_STATUS_CHANGED,
-                {
-                    'product_id': instance.id,
-                    'product_name': instance.name,
-                    'old_status': instance._previous_stock_status,
-                    'new_status': instance.stock_status
-                }
-            )
+    if not created and instance.has_changed('stock_status'):
+        WorkflowEvent.publish(
+            EventType.PRODUCT_STATUS_CHANGED,
+            {
+                'product_id': instance.id,
+                'product_name': instance.name,
+                'old_status': instance.previous('stock_status'),
+                'new_status': instance.stock_status
+            }
+        )
@@ -88,3 +88,15 @@ class WorkOrderStatusTransitionError(Exception):
             f"Cannot transition work order status from {self.current_status} "
             f"to {self.target_status}. Please check the allowed status transitions."
         )
+
+class DependencyCycleError(ValueError):
+    """
+    Raised when a work order dependency would close a cycle
+    """
+    def __init__(self, work_order_id, dependency_ids):
+        self.work_order_id = work_order_id
+        self.dependency_ids = list(dependency_ids)
+        super().__init__(
+            f"Work order {work_order_id} cannot depend on {', '.join(map(str, self.dependency_ids))}: "
+            f"it would create a dependency cycle"
+        )
@@ -0,0 +1,262 @@
+"""
+Available-to-promise stock ledger
+
+Every stock change is appended to StockMovement and applied incrementally to
+MaterialStockSummary inside the same transaction:
+
+- on_hand: physical stock, mirrored on Material.quantity
+- reserved: stock held by work order reservations
+- available: on_hand - reserved, what can still be promised
+- reorder_level: mirrored from Material, for the low stock index
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .exceptions import MaterialShortageError
+from .models import Material, MaterialStockSummary, StockMovement
+
+
+class StockLedger:
+    """
+    Record stock movements and keep the per-material summaries current
+    """
+    # (on_hand sign, reserved sign) applied to the movement quantity
+    EFFECTS = {
+        'RECEIPT': (1, 0),
+        'ADJUSTMENT': (1, 0),
+        'RESERVE': (0, 1),
+        'RELEASE': (0, -1),
+        'CONSUME': (-1, -1),
+    }
+
+    @classmethod
+    def record(cls, movements, require_available=False, update_material=True):
+        """
+        Append movements and apply their net effect to the stock summaries
+
+        Args:
+            movements (list): Unsaved StockMovement instances
+            require_available (bool): Fail unless every material keeps a
+                non-negative available quantity
+            update_material (bool): Mirror on-hand changes on Material.quantity
+
+        Raises:
+            MaterialShortageError: if require_available is set and a material
+                would be over-promised
+        """
+        movements = [movement for movement in movements if movement.quantity]
+        if not movements:
+            return []
+        for movement in movements:
+            movement.quantity = Decimal(str(movement.quantity))
+
+        on_hand = defaultdict(Decimal)
+        reserved = defaultdict(Decimal)
+        for movement in movements:
+            on_hand_sign, reserved_sign = cls.EFFECTS[movement.movement_type]
+            on_hand[movement.material_id] += on_hand_sign * movement.quantity
+            reserved[movement.material_id] += reserved_sign * movement.quantity
+        available = {
+            material_id: on_hand[material_id] - reserved[material_id]
+            for material_id in on_hand
+        }
+
+        with transaction.atomic():
+            summaries = MaterialStockSummary.objects.filter(material_id__in=on_hand.keys())
+            if require_available:
+                condition = Q()
+                for material_id, delta in available.items():
+                    condition |= Q(material_id=material_id, available__gte=-delta)
+                summaries = summaries.filter(condition)
+
+            now = timezone.now()
+            changes = {
+                'on_hand': F('on_hand') + cls._delta_case('material_id', on_hand),
+                'reserved': F('reserved') + cls._delta_case('material_id', reserved),
+                'available': F('available') + cls._delta_case('material_id', available),
+                'updated_at': now
+            }
+            updated = summaries.update(**changes)
+            if updated != len(on_hand):
+                missing = cls.create_missing_summaries(on_hand.keys())
+                if missing:
+                    updated += summaries.filter(material_id__in=missing).update(**changes)
+                if updated != len(on_hand):
+                    raise MaterialShortageError(
+                        "Insufficient available stock for requested movement",
+                        material_details=[]
+                    )
+
+            on_hand_changes = {
+                material_id: delta for material_id, delta in on_hand.items() if delta
+            }
+            if update_material and on_hand_changes:
+                Material.objects.filter(pk__in=on_hand_changes.keys()).update(
+                    quantity=F('quantity') + cls._delta_case('pk', on_hand_changes),
+                    updated_at=now
+                )
+
+            freed = {material_id: delta for material_id, delta in available.items() if delta > 0}
+            if freed:
+                cls._announce_restocked(freed)
+
+            return StockMovement.objects.bulk_create(movements)
+
+    @staticmethod
+    def _announce_restocked(freed):
+        """
+        Queue a restocked event for materials whose available stock just rose
+        above their reorder level
+        """
+        restocked = [
+            material_id
+            for material_id, available, reorder_level in MaterialStockSummary.objects.filter(
+                material_id__in=freed.keys()
+            ).values_list('material_id', 'available', 'material__reorder_level')
+            if available - freed[material_id] <= reorder_level < available
+        ]
+        if restocked:
+            from .events import MaterialEventHandler  # Import here to avoid circular import
+            MaterialEventHandler.handle_restocked(restocked)
+
+    @staticmethod
+    def _delta_case(key, deltas):
+        return Case(
+            *[
+                When(**{key: material_id}, then=Value(delta))
+                for material_id, delta in deltas.items() if delta
+            ],
+            default=Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        )
+
+    @staticmethod
+    def create_missing_summaries(material_ids):
+        """
+        Create summaries for materials that have none yet, seeded from
+        Material.quantity. Returns the IDs of the materials that were missing.
+        """
+        existing = set(MaterialStockSummary.objects.filter(
+            material_id__in=material_ids
+        ).values_list('material_id', flat=True))
+        missing = Material.objects.filter(pk__in=material_ids).exclude(
+            pk__in=existing
+        ).values_list('pk', 'quantity', 'reorder_level')
+        created = MaterialStockSummary.objects.bulk_create([
+            MaterialStockSummary(
+                material_id=material_id,
+                on_hand=quantity,
+                available=quantity,
+                reorder_level=reorder_level
+            )
+            for material_id, quantity, reorder_level in missing
+        ], ignore_conflicts=True)
+        return [summary.material_id for summary in created]
+
+    @classmethod
+    def lock_summaries(cls, material_ids):
+        """
+        Lock the summaries of the given materials, keyed by material ID
+        """
+        summaries = cls._select_summaries(material_ids)
+        if len(summaries) != len(set(material_ids)):
+            cls.create_missing_summaries(material_ids)
+            summaries = cls._select_summaries(material_ids)
+        return summaries
+
+    @staticmethod
+    def _select_summaries(material_ids):
+        return {
+            summary.material_id: summary
+            for summary in MaterialStockSummary.objects.select_for_update(
+                of=('self',)
+            ).select_related('material').filter(material_id__in=material_ids)
+        }
+
+    @classmethod
+    def sync_on_hand(cls, material, reference='Manual adjustment'):
+        """
+        Record an adjustment bringing the ledger in line with a directly
+        edited Material.quantity
+        """
+        with transaction.atomic():
+            summary, created = MaterialStockSummary.objects.select_for_update().get_or_create(
+                material_id=material.pk,
+                defaults={
+                    'on_hand': material.quantity,
+                    'available': material.quantity,
+                    'reorder_level': material.reorder_level
+                }
+            )
+            if created:
+                # The summary is seeded with the opening balance, only log it
+                if material.quantity:
+                    StockMovement.objects.create(
+                        material_id=material.pk,
+                        movement_type='ADJUSTMENT',
+                        quantity=material.quantity,
+                        reference='Opening balance'
+                    )
+                return
+
+            delta = Decimal(str(material.quantity)) - summary.on_hand
+            if delta:
+                cls.record([
+                    StockMovement(
+                        material_id=material.pk,
+                        movement_type='ADJUSTMENT',
+                        quantity=delta,
+                        reference=reference
+                    )
+                ], update_material=False)
+
+    @classmethod
+    def receive(cls, material_id, quantity, reference=''):
+        """
+        Add received stock to on-hand
+        """
+        return cls.record([
+            StockMovement(
+                material_id=material_id,
+                movement_type='RECEIPT',
+                quantity=quantity,
+                reference=reference
+            )
+        ])
+
+    @classmethod
+    def release_work_order(cls, work_order):
+        """
+        Return the reserved stock of a work order to available and drop its reservations
+        """
+        return cls._settle_reservations(work_order, 'RELEASE')
+
+    @classmethod
+    def consume_work_order(cls, work_order):
+        """
+        Consume the reserved stock of a work order and drop its reservations
+        """
+        return cls._settle_reservations(work_order, 'CONSUME')
+
+    @classmethod
+    def _settle_reservations(cls, work_order, movement_type):
+        with transaction.atomic():
+            reservations = work_order.material_reservations.all()
+            movements = cls.record([
+                StockMovement(
+                    material_id=material_id,
+                    movement_type=movement_type,
+                    quantity=quantity,
+                    work_order_id=work_order.pk,
+                    reference=f"WO-{work_order.pk}"
+                )
+                for material_id, quantity in reservations.values_list(
+                    'material_id', 'quantity_reserved'
+                )
+            ])
+            reservations.delete()
+        return movements
@@ -0,0 +1,70 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from manufacturing.costing import CostingEngine
+
+
+class Command(BaseCommand):
+    help = 'Time the batch costing engine on synthetic catalogues of growing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='100,1000,10000',
+            help='Comma separated product counts to cost'
+        )
+        parser.add_argument('--materials', type=int, default=500, help='Materials in the rate table')
+        parser.add_argument('--workstations', type=int, default=50, help='Workstations in the rate table')
+        parser.add_argument('--bom-lines', type=int, default=8, help='BOM lines per product')
+        parser.add_argument('--steps', type=int, default=5, help='Routing steps per product')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def tables(self, size, options, rng):
+        materials = [
+            (m, f'Material {m}', Decimal(rng.randint(100, 10000)) / 100)
+            for m in range(options['materials'])
+        ]
+        workstations = [
+            (w, f'Workstation {w}', Decimal(rng.randint(1000, 20000)) / 100)
+            for w in range(options['workstations'])
+        ]
+        products = [
+            (p, f'Product {p}', Decimal(rng.randint(10000, 500000)) / 100, Decimal(rng.randint(100, 5000)) / 100)
+            for p in range(size)
+        ]
+        bom = [
+            (p, m, Decimal(rng.randint(1, 2000)) / 100)
+            for p in range(size)
+            for m in rng.sample(range(options['materials']), options['bom_lines'])
+        ]
+        routing = [
+            (p, rng.randrange(options['workstations']), timedelta(minutes=rng.randint(5, 240)))
+            for p in range(size)
+            for _ in range(options['steps'])
+        ]
+        return products, bom, routing, materials, workstations
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        baseline = None
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            tables = self.tables(size, options, rng)
+
+            started = time.perf_counter()
+            engine = CostingEngine(*tables)
+            loaded = time.perf_counter()
+            summary = engine.summary()
+            finished = time.perf_counter()
+
+            per_product = (finished - started) / size * 10 ** 6
+            baseline = baseline or per_product
+            self.stdout.write(
+                f'{size:>7} products: load {loaded - started:.3f}s, '
+                f'cost {finished - loaded:.3f}s, '
+                f'{per_product:.1f}us/product ({per_product / baseline:.2f}x), '
+                f'total profit {summary["total_profit"]:.2f}'
+            )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from manufacturing.reorder import ReorderPointCalculator
+
+
+class Command(BaseCommand):
+    help = 'Suggest reorder points and safety stock from material consumption history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, default=ReorderPointCalculator.window_days)
+        parser.add_argument('--service-level', type=float, default=ReorderPointCalculator.service_level)
+
+    def handle(self, *args, **options):
+        written = ReorderPointCalculator.compute(
+            window_days=options['window_days'],
+            service_level=options['service_level']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Wrote reorder suggestions for {written} materials'))
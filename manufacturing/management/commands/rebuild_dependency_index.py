@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from manufacturing.dependencies import DependencyIndex
+
+
+class Command(BaseCommand):
+    help = 'Recount the unfinished dependencies of every work order'
+
+    def handle(self, *args, **options):
+        updated = DependencyIndex.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Recounted dependencies of {updated} work orders'))
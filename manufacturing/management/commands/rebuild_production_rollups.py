@@ -0,0 +1,26 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from manufacturing.rollups import ProductionRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily production rollups from the production logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only rebuild this day (YYYY-MM-DD) and later, defaults to the full history'
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid --since date: {options['since']}")
+
+        written = ProductionRollup.rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} production rollup rows'))
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from manufacturing.outbox import OutboxRelay
+
+
+class Command(BaseCommand):
+    help = 'Relay pending outbox events to the WebSocket channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain pending events and exit')
+        parser.add_argument('--batch-size', type=int, default=OutboxRelay.batch_size)
+        parser.add_argument('--interval', type=float, default=0.5, help='Seconds between polls')
+        parser.add_argument(
+            '--retention-hours',
+            type=int,
+            default=24,
+            help='Delete dispatched events older than this'
+        )
+
+    def handle(self, *args, **options):
+        retention = timedelta(hours=options['retention_hours'])
+        next_purge = timezone.now()
+        while True:
+            sent = OutboxRelay.drain_all(options['batch_size'])
+            if sent:
+                self.stdout.write(f'Relayed {sent} events')
+
+            if options['once'] or timezone.now() >= next_purge:
+                purged = OutboxRelay.purge(timezone.now() - retention)
+                next_purge = timezone.now() + timedelta(hours=1)
+                if options['once']:
+                    self.stdout.write(self.style.SUCCESS(f'Relayed {sent} events, purged {purged}'))
+                    return
+
+            time.sleep(options['interval'])
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-16 20:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0016_supplier_suppliermaterial_supplier_materials'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialStockSummary',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_summary', serialize=False, to='manufacturing.material')),
+                ('on_hand', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('reserved', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('available', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Material Stock Summary',
+                'verbose_name_plural': 'Material Stock Summaries',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('RECEIPT', 'Receipt'), ('ADJUSTMENT', 'Adjustment'), ('RESERVE', 'Reserve'), ('RELEASE', 'Release'), ('CONSUME', 'Consume')], max_length=20)),
+                ('quantity', models.DecimalField(decimal_places=2, help_text='Movement quantity, signed for adjustments', max_digits=12)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='manufacturing.material')),
+                ('work_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='manufacturing.workorder')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['material', 'created_at'], name='manufacturi_materia_1613bb_idx')],
+            },
+        ),
+    ]
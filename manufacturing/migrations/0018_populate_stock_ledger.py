@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+# Work orders that still hold their reserved materials
+OPEN_STATUSES = ('READY', 'IN_PROGRESS', 'PAUSED')
+
+
+def populate_stock_ledger(apps, schema_editor):
+    """
+    Seed the stock summaries and ledger from current quantities
+
+    Material.quantity used to be decremented when materials were reserved, so
+    it currently holds the available figure. On-hand stock is restored by
+    adding the outstanding reservations of open work orders back.
+
+    Reservations of completed orders were consumed and those of cancelled
+    orders were already returned to Material.quantity, but the rows were
+    never deleted. They hold no stock and are dropped.
+    """
+    Material = apps.get_model('manufacturing', 'Material')
+    MaterialReservation = apps.get_model('manufacturing', 'MaterialReservation')
+    MaterialStockSummary = apps.get_model('manufacturing', 'MaterialStockSummary')
+    StockMovement = apps.get_model('manufacturing', 'StockMovement')
+
+    MaterialReservation.objects.exclude(work_order__status__in=OPEN_STATUSES).delete()
+
+    reserved = defaultdict(int)
+    reservations = list(MaterialReservation.objects.all())
+    for reservation in reservations:
+        reserved[reservation.material_id] += reservation.quantity_reserved
+
+    summaries = []
+    movements = []
+    for material in Material.objects.all():
+        available = material.quantity
+        on_hand = available + reserved[material.id]
+        if on_hand != material.quantity:
+            Material.objects.filter(pk=material.pk).update(quantity=on_hand)
+
+        summaries.append(MaterialStockSummary(
+            material_id=material.id,
+            on_hand=on_hand,
+            reserved=reserved[material.id],
+            available=available
+        ))
+        if on_hand:
+            movements.append(StockMovement(
+                material_id=material.id,
+                movement_type='ADJUSTMENT',
+                quantity=on_hand,
+                reference='Opening balance'
+            ))
+
+    movements.extend(
+        StockMovement(
+            material_id=reservation.material_id,
+            movement_type='RESERVE',
+            quantity=reservation.quantity_reserved,
+            work_order_id=reservation.work_order_id,
+            reference=f"WO-{reservation.work_order_id}"
+        )
+        for reservation in reservations
+    )
+
+    MaterialStockSummary.objects.bulk_create(summaries)
+    StockMovement.objects.bulk_create(movements)
+
+
+def clear_stock_ledger(apps, schema_editor):
+    """
+    Drop the ledger and put the available figure back on Material.quantity
+    """
+    Material = apps.get_model('manufacturing', 'Material')
+    MaterialStockSummary = apps.get_model('manufacturing', 'MaterialStockSummary')
+
+    for material_id, on_hand, reserved in MaterialStockSummary.objects.values_list(
+        'material_id', 'on_hand', 'reserved'
+    ):
+        if reserved:
+            Material.objects.filter(pk=material_id).update(quantity=on_hand - reserved)
+
+    apps.get_model('manufacturing', 'StockMovement').objects.all().delete()
+    MaterialStockSummary.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0017_materialstocksummary_stockmovement'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_stock_ledger, clear_stock_ledger),
+    ]
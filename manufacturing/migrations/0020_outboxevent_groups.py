@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0019_outboxevent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='outboxevent',
+            name='group_name',
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='groups',
+            field=models.JSONField(default=list, help_text='Topic groups the event is sent to'),
+        ),
+    ]
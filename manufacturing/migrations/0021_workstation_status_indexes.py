@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0020_outboxevent_groups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productionlog',
+            index=models.Index(fields=['workstation', 'created_at'], name='manufacturi_worksta_489569_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workorder',
+            index=models.Index(fields=['workstation', 'status'], name='manufacturi_worksta_7800b0_idx'),
+        ),
+    ]
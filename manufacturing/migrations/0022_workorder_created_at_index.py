@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0021_workstation_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workorder',
+            index=models.Index(fields=['-created_at', 'id'], name='manufacturi_created_452623_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0022_workorder_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductionDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('log_count', models.IntegerField(default=0)),
+                ('quantity_produced', models.BigIntegerField(default=0)),
+                ('wastage', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('efficiency_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('efficiency_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productionlog',
+            index=models.Index(fields=['created_at'], name='manufacturi_created_28d2c4_idx'),
+        ),
+        migrations.AddField(
+            model_name='productiondailyrollup',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='production_rollups', to='manufacturing.product'),
+        ),
+        migrations.AddField(
+            model_name='productiondailyrollup',
+            name='workstation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='production_rollups', to='manufacturing.workstation'),
+        ),
+        migrations.AddIndex(
+            model_name='productiondailyrollup',
+            index=models.Index(fields=['day', 'workstation', 'product'], name='manufacturi_day_2b7f2b_idx'),
+        ),
+    ]
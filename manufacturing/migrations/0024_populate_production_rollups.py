@@ -0,0 +1,55 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_production_rollups(apps, schema_editor):
+    """
+    Seed the daily rollups from the existing production logs
+    """
+    ProductionLog = apps.get_model('manufacturing', 'ProductionLog')
+    ProductionDailyRollup = apps.get_model('manufacturing', 'ProductionDailyRollup')
+
+    totals = ProductionLog.objects.annotate(
+        day=TruncDate('created_at')
+    ).values(
+        'day', 'workstation_id', 'work_order__product_id'
+    ).annotate(
+        log_count=Count('id'),
+        quantity=Sum('quantity_produced', default=0),
+        wastage_total=Sum('wastage', default=0),
+        efficiency_total=Sum('efficiency_rate', default=0),
+        efficiency_count=Count('efficiency_rate')
+    ).order_by()
+
+    ProductionDailyRollup.objects.bulk_create(
+        [
+            ProductionDailyRollup(
+                day=row['day'],
+                workstation_id=row['workstation_id'],
+                product_id=row['work_order__product_id'],
+                log_count=row['log_count'],
+                quantity_produced=row['quantity'],
+                wastage=row['wastage_total'],
+                efficiency_total=row['efficiency_total'],
+                efficiency_count=row['efficiency_count']
+            )
+            for row in totals
+        ],
+        batch_size=1000
+    )
+
+
+def clear_production_rollups(apps, schema_editor):
+    apps.get_model('manufacturing', 'ProductionDailyRollup').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0023_productiondailyrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_production_rollups, clear_production_rollups),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0024_populate_production_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCostSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cost_summary', serialize=False, to='manufacturing.product')),
+                ('material_cost', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('workstation_cost', models.DecimalField(decimal_places=4, default=0, max_digits=16)),
+                ('material_breakdown', models.JSONField(default=list)),
+                ('workstation_breakdown', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Product Cost Summary',
+                'verbose_name_plural': 'Product Cost Summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0025_productcostsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workorder',
+            index=models.Index(fields=['product', 'created_at'], name='manufacturi_product_1ce723_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0026_workorder_product_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence_order', models.PositiveIntegerField()),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('planned_at', models.DateTimeField()),
+                ('work_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_operations', to='manufacturing.workorder')),
+                ('workstation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_operations', to='manufacturing.workstation')),
+            ],
+            options={
+                'ordering': ['start_time', 'id'],
+                'indexes': [models.Index(fields=['workstation', 'start_time'], name='manufacturi_worksta_f58952_idx'), models.Index(fields=['work_order', 'sequence_order'], name='manufacturi_work_or_73bb8e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0027_scheduledoperation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workorder',
+            name='unfinished_dependencies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='workorder',
+            index=models.Index(fields=['unfinished_dependencies', 'status'], name='manufacturi_unfinis_674361_idx'),
+        ),
+    ]
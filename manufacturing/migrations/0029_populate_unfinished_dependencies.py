@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_unfinished_dependencies(apps, schema_editor):
+    """
+    Count the dependencies of every work order that are not completed yet
+    """
+    WorkOrder = apps.get_model('manufacturing', 'WorkOrder')
+    Dependency = WorkOrder.dependencies.through
+
+    unfinished = Dependency.objects.filter(
+        from_workorder=OuterRef('pk')
+    ).exclude(
+        to_workorder__status='COMPLETED'
+    ).order_by().values('from_workorder').annotate(count=Count('id')).values('count')
+    WorkOrder.objects.update(
+        unfinished_dependencies=Coalesce(Subquery(unfinished, output_field=IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0028_workorder_unfinished_dependencies'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_unfinished_dependencies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0029_populate_unfinished_dependencies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkOrderCompletion',
+            fields=[
+                ('work_order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='completion', serialize=False, to='manufacturing.workorder')),
+                ('quantity_produced', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('completed_at', models.DateTimeField()),
+            ],
+        ),
+    ]
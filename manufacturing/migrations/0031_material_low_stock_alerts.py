@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0030_workordercompletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='low_stock_alerted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(condition=models.Q(('quantity__lte', models.F('reorder_level'))), fields=['low_stock_alerted_at'], name='material_low_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0031_material_low_stock_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReorderSuggestion',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reorder_suggestion', serialize=False, to='manufacturing.material')),
+                ('demand_rate', models.DecimalField(decimal_places=4, help_text='Mean daily demand', max_digits=14)),
+                ('demand_deviation', models.DecimalField(decimal_places=4, help_text='Standard deviation of daily demand', max_digits=14)),
+                ('lead_time_days', models.PositiveIntegerField()),
+                ('safety_stock', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('reorder_point', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('explain', models.JSONField(default=dict, help_text='Inputs and formula behind the suggestion')),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Reorder Suggestion',
+                'verbose_name_plural': 'Reorder Suggestions',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0032_reordersuggestion'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='material',
+            name='material_low_stock_idx',
+        ),
+    ]
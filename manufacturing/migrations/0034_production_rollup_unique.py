@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:22
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    """
+    Fold rows that concurrent writers created for the same key into one
+    """
+    ProductionDailyRollup = apps.get_model('manufacturing', 'ProductionDailyRollup')
+
+    duplicates = ProductionDailyRollup.objects.values(
+        'day', 'workstation_id', 'product_id'
+    ).annotate(
+        rows=Count('id'),
+        keep_id=Min('id'),
+        total_logs=Sum('log_count'),
+        total_quantity=Sum('quantity_produced'),
+        total_wastage=Sum('wastage'),
+        total_efficiency=Sum('efficiency_total'),
+        total_efficiency_count=Sum('efficiency_count')
+    ).filter(rows__gt=1).order_by()
+
+    for row in duplicates:
+        ProductionDailyRollup.objects.filter(
+            day=row['day'], workstation_id=row['workstation_id'], product_id=row['product_id']
+        ).exclude(pk=row['keep_id']).delete()
+        ProductionDailyRollup.objects.filter(pk=row['keep_id']).update(
+            log_count=row['total_logs'],
+            quantity_produced=row['total_quantity'],
+            wastage=row['total_wastage'],
+            efficiency_total=row['total_efficiency'],
+            efficiency_count=row['total_efficiency_count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0033_remove_material_low_stock_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productiondailyrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'workstation', 'product'), name='unique_production_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='productiondailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('workstation__isnull', True)), fields=('day', 'product'), name='unique_production_rollup_without_workstation'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:24
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_reorder_levels(apps, schema_editor):
+    """
+    Mirror each material's reorder level on its stock summary
+    """
+    Material = apps.get_model('manufacturing', 'Material')
+    MaterialStockSummary = apps.get_model('manufacturing', 'MaterialStockSummary')
+
+    MaterialStockSummary.objects.update(
+        reorder_level=Subquery(
+            Material.objects.filter(pk=OuterRef('material_id')).values('reorder_level')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manufacturing', '0034_production_rollup_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materialstocksummary',
+            name='reorder_level',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(copy_reorder_levels, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(condition=models.Q(('quantity__lte', models.F('reorder_level'))), fields=['low_stock_alerted_at'], name='material_low_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materialstocksummary',
+            index=models.Index(condition=models.Q(('available__lte', models.F('reorder_level'))), fields=['material'], name='stock_summary_low_stock_idx'),
+        ),
+    ]
@@ -1,14 +1,21 @@
+from datetime import timedelta
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.functions import Greatest, Least
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.db import transaction
 
+from .tracking import FieldTrackerMixin
+
 # Create your models here.
 
 # Get the current user model
 User = get_user_model()
 
-class WorkStation(models.Model):
+class WorkStation(FieldTrackerMixin, models.Model):
     PROCESS_TYPE_CHOICES = [
         ('AUTOMATIC', 'Automatic'),
         ('MANUAL', 'Manual'),
@@ -55,24 +62,73 @@ class WorkStation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # hourly_operating_cost and name feed the product cost summaries
+    tracked_fields = ('status', 'name', 'hourly_operating_cost')
+
     def save(self, *args, **kwargs):
-        # Track last maintenance when status changes from MAINTENANCE to ACTIVE
-        original = None
-        if self.pk:
-            original = WorkStation.objects.get(pk=self.pk)
-        
         # If status was MAINTENANCE and is now ACTIVE, update last_maintenance
-        if (original and 
-            original.status == 'MAINTENANCE' and 
+        if (self.has_changed('status') and
+            self.previous('status') == 'MAINTENANCE' and
             self.status == 'ACTIVE'):
             self.last_maintenance = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'last_maintenance'}
         
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def with_runtime(queryset, window=timedelta(hours=24)):
+        """
+        Annotate workstations with the time spent running work orders during
+        the trailing window, as a single correlated subquery
+
+        Completed work orders count from start to end date, in-progress ones
+        until now, both clipped to the window.
+        """
+        now = timezone.now()
+        window_start = now - window
+        runtime = WorkOrder.objects.filter(
+            models.Q(status='IN_PROGRESS') | models.Q(status='COMPLETED', end_date__gt=window_start),
+            workstation=models.OuterRef('pk'),
+            start_date__lt=now
+        ).annotate(
+            overlap=models.ExpressionWrapper(
+                models.Case(
+                    models.When(status='IN_PROGRESS', then=models.Value(now)),
+                    default=Least(models.F('end_date'), models.Value(now))
+                ) - Greatest(models.F('start_date'), models.Value(window_start)),
+                output_field=models.DurationField()
+            )
+        ).order_by().values('workstation').annotate(
+            total=models.Sum('overlap')
+        ).values('total')
+
+        return queryset.annotate(
+            runtime=models.Subquery(runtime, output_field=models.DurationField())
+        )
+
+    @staticmethod
+    def utilization_from_runtime(runtime, window=timedelta(hours=24)):
+        """
+        Percentage of the window covered by runtime, capped at 100
+        """
+        if not runtime:
+            return 0.0
+        return round(min(runtime / window * 100, 100.0), 2)
+
+    def calculate_utilization_rate(self, window=timedelta(hours=24)):
+        """
+        Share of the trailing window this workstation spent running work orders
+        """
+        runtime = WorkStation.with_runtime(
+            WorkStation.objects.filter(pk=self.pk), window
+        ).values_list('runtime', flat=True).first()
+        return WorkStation.utilization_from_runtime(runtime, window)
+
     def __str__(self):
         return self.name
 
-class Material(models.Model):
+class Material(FieldTrackerMixin, models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     unit = models.CharField(max_length=20)
@@ -87,11 +143,122 @@ class Material(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Last low stock alert, for the scanner's cooldown
+    low_stock_alerted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Fields cached in product cost summaries, the ledger-mirrored quantity
+    # and the low stock threshold
+    tracked_fields = ('name', 'cost_per_unit', 'quantity', 'reorder_level')
+
+    class Meta:
+        indexes = [
+            # Low stock materials the ledger has not summarized yet
+            models.Index(
+                fields=['low_stock_alerted_at'],
+                condition=models.Q(quantity__lte=models.F('reorder_level')),
+                name='material_low_stock_idx'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        quantity_changed = adding or self.has_changed('quantity')
+        reorder_level_changed = not adding and self.has_changed('reorder_level')
+
+        # The ledger keeps quantity current and the scanner stamps
+        # low_stock_alerted_at, a stale copy saved for another edit must not
+        # overwrite either
+        if not adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            excluded = {'low_stock_alerted_at'} if quantity_changed else {'low_stock_alerted_at', 'quantity'}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in excluded
+            ]
+
+        super().save(*args, **kwargs)
+
+        # Direct edits of quantity are recorded as ledger adjustments
+        if quantity_changed:
+            from .ledger import StockLedger  # Import here to avoid circular import
+            StockLedger.sync_on_hand(self)
+        if reorder_level_changed:
+            MaterialStockSummary.objects.filter(material_id=self.pk).update(reorder_level=self.reorder_level)
+
+    @property
+    def reserved_quantity(self):
+        """Stock held by work order reservations"""
+        summary = getattr(self, 'stock_summary', None)
+        return summary.reserved if summary else 0
+
+    @property
+    def available_quantity(self):
+        """Stock that can still be promised to new work orders"""
+        summary = getattr(self, 'stock_summary', None)
+        return summary.available if summary else self.quantity
 
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+class MaterialStockSummary(models.Model):
+    """
+    Materialized available-to-promise figures for a material
+    Maintained incrementally by the stock ledger, never edited directly
+    """
+    material = models.OneToOneField(
+        Material,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stock_summary'
+    )
+    on_hand = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    reserved = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    available = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Mirrors Material.reorder_level so the low stock rows can be indexed
+    reorder_level = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Material Stock Summary'
+        verbose_name_plural = 'Material Stock Summaries'
+        indexes = [
+            models.Index(
+                fields=['material'],
+                condition=models.Q(available__lte=models.F('reorder_level')),
+                name='stock_summary_low_stock_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.material_id}: on hand {self.on_hand}, reserved {self.reserved}, available {self.available}"
+
+class ReorderSuggestion(models.Model):
+    """
+    Reorder level suggested for a material from its consumption history
+    Recomputed by the nightly reorder point job, Material.reorder_level is
+    left for a person to update
+    """
+    material = models.OneToOneField(
+        Material,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='reorder_suggestion'
+    )
+    demand_rate = models.DecimalField(max_digits=14, decimal_places=4, help_text='Mean daily demand')
+    demand_deviation = models.DecimalField(max_digits=14, decimal_places=4, help_text='Standard deviation of daily demand')
+    lead_time_days = models.PositiveIntegerField()
+    safety_stock = models.DecimalField(max_digits=12, decimal_places=2)
+    reorder_point = models.DecimalField(max_digits=12, decimal_places=2)
+    explain = models.JSONField(default=dict, help_text='Inputs and formula behind the suggestion')
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Reorder Suggestion'
+        verbose_name_plural = 'Reorder Suggestions'
+
+    def __str__(self):
+        return f"{self.material_id}: reorder at {self.reorder_point}, safety stock {self.safety_stock}"
+
+class Product(FieldTrackerMixin, models.Model):
     STOCK_STATUS_CHOICES = [
         ('IN_STOCK', 'In Stock'),
         ('LOW_STOCK', 'Low Stock'),
@@ -135,6 +302,8 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    tracked_fields = ('stock_status',)
+
     def update_stock_status(self, save_instance=True):
         """
         Compute stock status based on current quantity and restock level
@@ -162,15 +331,45 @@ class Product(models.Model):
     def __str__(self):
         return f"{self.name} (Stock: {self.current_quantity})"
 
-class ProductMaterial(models.Model):
+class ProductMaterial(FieldTrackerMixin, models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     material = models.ForeignKey(Material, on_delete=models.CASCADE)
     quantity = models.DecimalField(max_digits=10, decimal_places=2)
 
+    tracked_fields = ('product',)
+
     class Meta:
         unique_together = ('product', 'material')
 
-class WorkOrder(models.Model):
+class ProductCostSummary(models.Model):
+    """
+    Cached material and workstation cost of one unit of a product
+    Deleted when a cost input of the product changes, recomputed on next read
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='cost_summary'
+    )
+    material_cost = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    workstation_cost = models.DecimalField(max_digits=16, decimal_places=4, default=0)
+    material_breakdown = models.JSONField(default=list)
+    workstation_breakdown = models.JSONField(default=list)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Product Cost Summary'
+        verbose_name_plural = 'Product Cost Summaries'
+
+    @property
+    def unit_cost(self):
+        return self.material_cost + self.workstation_cost
+
+    def __str__(self):
+        return f"{self.product_id}: material {self.material_cost}, workstation {self.workstation_cost}"
+
+class WorkOrder(FieldTrackerMixin, models.Model):
     WORK_ORDER_STATUS_CHOICES = [
         ('PENDING', 'Pending'),
         ('QUEUED', 'Queued'),
@@ -189,6 +388,14 @@ class WorkOrder(models.Model):
         ('CRITICAL', 'Critical Priority')
     ]
 
+    # Numeric rank of each priority, higher is more urgent
+    PRIORITY_RANK = {
+        'LOW': 1,
+        'MEDIUM': 2,
+        'HIGH': 3,
+        'CRITICAL': 4
+    }
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='work_orders')
     quantity = models.DecimalField(max_digits=10, decimal_places=2)
     start_date = models.DateTimeField(null=True, blank=True)
@@ -226,6 +433,11 @@ class WorkOrder(models.Model):
     # Workflow tracking
     dependencies = models.ManyToManyField('self', symmetrical=False, blank=True, related_name='dependent_orders')
     blocking_reason = models.TextField(null=True, blank=True)
+    # Dependencies not COMPLETED yet, maintained by the dependency index
+    unfinished_dependencies = models.PositiveIntegerField(default=0, editable=False)
+
+    # Status for the workflow receivers, all of them for the dashboard counters
+    tracked_fields = ('status', 'priority', 'start_date', 'end_date')
     
     def validate_status_transition(self, new_status):
         """
@@ -257,8 +469,10 @@ class WorkOrder(models.Model):
         - total_available: Total materials in stock
         """
         # Get materials required for the product
-        product_materials = ProductMaterial.objects.filter(product=self.product)
-        
+        product_materials = ProductMaterial.objects.filter(
+            product_id=self.product_id
+        ).select_related('material', 'material__stock_summary')
+
         material_status = {
             'available': True,
             'materials': [],
@@ -269,18 +483,20 @@ class WorkOrder(models.Model):
         for product_material in product_materials:
             material = product_material.material
             required_quantity = product_material.quantity * self.quantity
+            # Stock already reserved by other work orders cannot be promised again
+            available_quantity = material.available_quantity
             
             material_status['total_required'] += required_quantity
-            material_status['total_available'] += material.quantity
+            material_status['total_available'] += available_quantity
             
-            if material.quantity < required_quantity:
+            if available_quantity < required_quantity:
                 material_status['available'] = False
                 material_status['materials'].append({
                     'material_id': material.id,
                     'material_name': material.name,
                     'required_quantity': required_quantity,
-                    'available_quantity': material.quantity,
-                    'shortage_percentage': (required_quantity - material.quantity) / required_quantity * 100
+                    'available_quantity': available_quantity,
+                    'shortage_percentage': (required_quantity - available_quantity) / required_quantity * 100
                 })
         
         return material_status
@@ -289,48 +505,20 @@ class WorkOrder(models.Model):
         """
         Advanced material reservation with comprehensive checks and logging
         """
+        from .exceptions import MaterialShortageError
+        from .reservations import MaterialReservationEngine  # Import here to avoid circular import
+
         # Validate work order before reservation
         if self.status not in ['PENDING', 'DRAFT', 'READY', 'PAUSED', 'IN_PROGRESS']:
             raise ValueError(f"Cannot reserve materials for work order with status {self.status}")
-        
-        # Perform material availability check
-        material_status = self.check_material_availability()
-        
-        if not material_status['available']:
-            # Construct detailed error message
-            error_message = "Insufficient materials to start work order:\n"
-            for material in material_status['materials']:
-                error_message += (
-                    f"Material: {material['material_name']} (ID: {material['material_id']})\n"
-                    f"Required: {material['required_quantity']} \n"
-                    f"Available: {material['available_quantity']} \n"
-                    f"Shortage: {material['required_quantity'] - material['available_quantity']} "
-                    f"({material['shortage_percentage']:.2f}%)\n\n"
-                )
-            
-            raise ValueError(error_message)
-        
-        # Get materials required for the product
-        product_materials = ProductMaterial.objects.filter(product=self.product)
-        
-        # Create material reservations with atomic transaction
+
+        # Lock, check and decrement the whole BOM with atomic transaction
         with transaction.atomic():
-            # Create material reservations
-            for product_material in product_materials:
-                material = product_material.material
-                required_quantity = product_material.quantity * self.quantity
-                
-                # Reduce material quantity
-                material.quantity -= required_quantity
-                material.save()
-                
-                # Create material reservation record
-                MaterialReservation.objects.create(
-                    work_order=self,
-                    material=material,
-                    quantity_reserved=required_quantity
-                )
-            
+            try:
+                MaterialReservationEngine([self]).reserve()
+            except MaterialShortageError as e:
+                raise ValueError(str(e))
+
             # Update work order status if needed
             if self.status in ['READY', 'PENDING', 'DRAFT', 'PAUSED']:
                 self.status = 'IN_PROGRESS'
@@ -343,32 +531,28 @@ class WorkOrder(models.Model):
         """
         Release reserved materials when work order is cancelled
         """
-        # Retrieve material reservations
-        material_reservations = self.material_reservations.all()
-        
-        # Delete material reservations
-        material_reservations.delete()
-        
-        # Update work order status
-        self.status = 'CANCELLED'
-        self.save()
+        from .ledger import StockLedger  # Import here to avoid circular import
+
+        with transaction.atomic():
+            # Return reserved stock to available and drop the reservations
+            StockLedger.release_work_order(self)
+
+            # Update work order status
+            self.status = 'CANCELLED'
+            self.save()
 
     def complete_work_order(self):
         """
         Complete work order workflow
         Updates product quantity, logs production, releases materials
         """
+        from .ledger import StockLedger  # Import here to avoid circular import
+
         # Validate current status
         self.validate_status_transition('COMPLETED')
 
-        # Retrieve material reservations
-        material_reservations = self.material_reservations.all()
-
-        # Deduct materials from inventory
-        for reservation in material_reservations:
-            material = reservation.material
-            material.quantity -= reservation.quantity_reserved
-            material.save()
+        # Consume reserved materials from inventory and drop the reservations
+        StockLedger.consume_work_order(self)
 
         # Update product quantity
         self.product.current_quantity += self.quantity
@@ -393,17 +577,23 @@ class WorkOrder(models.Model):
         self.end_date = timezone.now()
         self.save()
 
-        # Delete material reservations after completion
-        material_reservations.delete()
-
     def save(self, *args, **kwargs):
         """
         Override save method to handle workflow logic
         """
-        # Perform stock status update before saving
-        if hasattr(self, 'product'):
+        # Refresh the stock status of an already loaded product, without
+        # fetching it just for this
+        if WorkOrder.product.is_cached(self):
             self.product.update_stock_status(save_instance=False)
-        
+
+        # Leave the dependency count to the dependency index, a stale copy
+        # loaded before a dependency completed must not overwrite it
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'unfinished_dependencies'
+            ]
+
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -411,12 +601,24 @@ class WorkOrder(models.Model):
 
     def calculate_estimated_completion(self):
         """
-        Estimate completion time based on product and quantity
-        This is a placeholder and should be replaced with more sophisticated logic
+        Estimate completion time from the production schedule
+
+        Falls back to the routing's estimated times from start_date when the
+        order is not in the current schedule.
         """
-        # Assume 1 hour per unit as a basic estimation
-        estimated_hours = float(self.quantity)
-        return self.start_date + timezone.timedelta(hours=estimated_hours) if self.start_date else None
+        scheduled_end = self.scheduled_operations.aggregate(end=models.Max('end_time'))['end']
+        if scheduled_end or not self.start_date:
+            return scheduled_end
+
+        from .scheduling import DEFAULT_UNIT_TIME  # Import here to avoid circular import
+        unit_time = sum(
+            (
+                estimated_time or DEFAULT_UNIT_TIME
+                for estimated_time in self.product.workstation_sequences.values_list('estimated_time', flat=True)
+            ),
+            timedelta()
+        ) or DEFAULT_UNIT_TIME
+        return self.start_date + unit_time * float(self.quantity)
     
     def is_overdue(self):
         """
@@ -432,7 +634,7 @@ class WorkOrder(models.Model):
         """
         Check if all dependencies are completed
         """
-        return all(dep.status == 'COMPLETED' for dep in self.dependencies.all())
+        return self.unfinished_dependencies == 0
     
     def update_status(self, new_status):
         """
@@ -463,6 +665,15 @@ class WorkOrder(models.Model):
         ordering = ['-priority', '-created_at']
         verbose_name = 'Work Order'
         verbose_name_plural = 'Work Orders'
+        indexes = [
+            models.Index(fields=['workstation', 'status']),
+            # Cursor pagination of the work order list
+            models.Index(fields=['-created_at', 'id']),
+            # Cost analytics filtered by product and date range
+            models.Index(fields=['product', 'created_at']),
+            # Ready queue of orders with no open dependencies
+            models.Index(fields=['unfinished_dependencies', 'status']),
+        ]
 
 class MaterialReservation(models.Model):
     """
@@ -488,7 +699,50 @@ class MaterialReservation(models.Model):
     def __str__(self):
         return f"{self.material.name} - {self.quantity_reserved} (WO: {self.work_order_id})"
 
-class ProductionLog(models.Model):
+class StockMovement(models.Model):
+    """
+    Append-only ledger of material stock movements
+    Every change to on-hand or reserved stock is recorded here
+    """
+    MOVEMENT_TYPE_CHOICES = [
+        ('RECEIPT', 'Receipt'),
+        ('ADJUSTMENT', 'Adjustment'),
+        ('RESERVE', 'Reserve'),
+        ('RELEASE', 'Release'),
+        ('CONSUME', 'Consume'),
+    ]
+
+    material = models.ForeignKey(
+        Material,
+        on_delete=models.CASCADE,
+        related_name='stock_movements'
+    )
+    movement_type = models.CharField(max_length=20, choices=MOVEMENT_TYPE_CHOICES)
+    quantity = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        help_text='Movement quantity, signed for adjustments'
+    )
+    work_order = models.ForeignKey(
+        WorkOrder,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['material', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.movement_type} {self.quantity} of material {self.material_id}"
+
+class ProductionLog(FieldTrackerMixin, models.Model):
     work_order = models.ForeignKey(WorkOrder, on_delete=models.CASCADE)
     workstation = models.ForeignKey(WorkStation, on_delete=models.CASCADE, null=True)
     quantity_produced = models.IntegerField()
@@ -507,30 +761,141 @@ class ProductionLog(models.Model):
         help_text="Calculated efficiency rate (0-100%)"
     )
 
-    def calculate_efficiency(self):
+    # Fields that feed the daily production rollups
+    tracked_fields = ('work_order', 'workstation', 'quantity_produced', 'wastage', 'efficiency_rate')
+
+    def calculate_efficiency(self, save_instance=True):
         """
         Calculate efficiency based on quantity produced vs expected quantity
         This is a placeholder method and should be customized based on specific business logic
         """
-        try:
-            expected_quantity = self.work_order.quantity
-            efficiency = (self.quantity_produced / float(expected_quantity)) * 100 if expected_quantity > 0 else 0
-            self.efficiency_rate = min(max(efficiency, 0), 100)  # Clamp between 0 and 100
+        expected_quantity = self.work_order.quantity
+        if expected_quantity > 0:
+            efficiency = Decimal(str(self.quantity_produced)) / expected_quantity * 100
+        else:
+            efficiency = Decimal('0')
+        # Clamp between 0 and 100, rounded as stored
+        self.efficiency_rate = min(max(efficiency, Decimal('0')), Decimal('100')).quantize(Decimal('0.01'))
+        if save_instance:
             self.save()
-        except Exception as e:
-            print(f"Error calculating efficiency: {e}")
-        
+
         return self.efficiency_rate
 
     def save(self, *args, **kwargs):
         # Automatically calculate efficiency before saving
         if not self.efficiency_rate:
-            self.calculate_efficiency()
+            self.calculate_efficiency(save_instance=False)
         super().save(*args, **kwargs)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['workstation', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
     def __str__(self):
         return f"Log-{self.id} - WO-{self.work_order.id}"
 
+class WorkOrderCompletion(models.Model):
+    """
+    Idempotency record of a work order completed by the completion pipeline
+    The work order is the key: a second completion finds the row and is skipped
+    """
+    work_order = models.OneToOneField(
+        WorkOrder,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='completion'
+    )
+    quantity_produced = models.DecimalField(max_digits=10, decimal_places=2)
+    completed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"WO-{self.work_order_id} completed at {self.completed_at}"
+
+class ScheduledOperation(models.Model):
+    """
+    One routing step of a work order slotted on a workstation
+    Written by the production scheduler, replaced on every full re-plan
+    """
+    work_order = models.ForeignKey(
+        WorkOrder,
+        on_delete=models.CASCADE,
+        related_name='scheduled_operations'
+    )
+    workstation = models.ForeignKey(
+        WorkStation,
+        on_delete=models.CASCADE,
+        related_name='scheduled_operations'
+    )
+    sequence_order = models.PositiveIntegerField()
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    planned_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['start_time', 'id']
+        indexes = [
+            models.Index(fields=['workstation', 'start_time']),
+            models.Index(fields=['work_order', 'sequence_order']),
+        ]
+
+    def __str__(self):
+        return f"WO-{self.work_order_id} step {self.sequence_order} on WS-{self.workstation_id}: {self.start_time} - {self.end_time}"
+
+class ProductionDailyRollup(models.Model):
+    """
+    Production totals per day, workstation and product
+    Maintained incrementally from ProductionLog writes, rebuilt with the
+    rebuild_production_rollups command
+    """
+    day = models.DateField()
+    workstation = models.ForeignKey(
+        WorkStation,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='production_rollups'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='production_rollups'
+    )
+    log_count = models.IntegerField(default=0)
+    quantity_produced = models.BigIntegerField(default=0)
+    wastage = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Sum and count of the logs that have an efficiency rate, for averaging
+    efficiency_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    efficiency_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        indexes = [
+            models.Index(fields=['day', 'workstation', 'product']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'workstation', 'product'],
+                name='unique_production_rollup'
+            ),
+            # NULLs never conflict, so rows without a workstation need their own
+            models.UniqueConstraint(
+                fields=['day', 'product'],
+                condition=models.Q(workstation__isnull=True),
+                name='unique_production_rollup_without_workstation'
+            ),
+        ]
+
+    @property
+    def avg_efficiency(self):
+        return self.efficiency_total / self.efficiency_count if self.efficiency_count else 0
+
+    def __str__(self):
+        return f"{self.day} WS-{self.workstation_id} P-{self.product_id}: {self.quantity_produced}"
+
 class WorkstationProcess(models.Model):
     """
     Defines a specific manufacturing process for a product at a workstation
@@ -687,7 +1052,27 @@ class ProductionEvent(models.Model):
     def __str__(self):
         return f"{self.event_type} - {self.product.name} - {self.created_at}"
 
-class ProductWorkstationSequence(models.Model):
+class OutboxEvent(models.Model):
+    """
+    WebSocket event written in the same transaction as the change it describes
+    Relayed to the channel layer in batches once committed
+    """
+    event_type = models.CharField(max_length=100)
+    groups = models.JSONField(default=list, help_text='Topic groups the event is sent to')
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['dispatched_at', 'id'])
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} -> {', '.join(self.groups)} ({'sent' if self.dispatched_at else 'pending'})"
+
+class ProductWorkstationSequence(FieldTrackerMixin, models.Model):
     """
     Defines the sequence of workstations for a specific product's manufacturing process
     """
@@ -723,6 +1108,8 @@ class ProductWorkstationSequence(models.Model):
         help_text='Specific instructions for this workstation in the product process'
     )
 
+    tracked_fields = ('product',)
+
     class Meta:
         unique_together = ('product', 'workstation', 'sequence_order')
         ordering = ['sequence_order']
@@ -0,0 +1,212 @@
+"""
+Material requirements planning
+
+Confirmed product order items are exploded through the bills of materials
+into gross material requirements, one bucket per production start date. The
+explosion is a sparse matrix-vector product. The BOM is stored as rows
+item -> {component: quantity per unit}, and each level multiplies the demand
+vector by those rows. Components with a BOM of their own go on to the next
+level, so sub-assemblies are exploded as soon as they get BOM rows.
+Purchased materials are the leaves.
+
+Requirements are then netted bucket by bucket against a projected balance
+per material:
+
+    balance = available (on hand - reserved) + receipts due so far - requirements so far
+
+A shortage is recorded wherever the balance would go negative. The planned
+replenishment is assumed to arrive in time, so the balance restarts at zero.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Material, ProductMaterial
+
+PRODUCT = 'product'
+MATERIAL = 'material'
+# Deepest BOM explored, guards against a BOM that contains itself
+MAX_BOM_LEVELS = 25
+
+
+class MaterialRequirementsPlanner:
+    """
+    Explode demand through the BOM and net it against supply
+    """
+
+    def __init__(self, bom, available, receipts=None):
+        """
+        Args:
+            bom (dict): Item to {component: quantity per unit}, items being
+                (PRODUCT, id) or (MATERIAL, id) keys
+            available (dict): Material id to stock free to use today
+            receipts (dict): Material id to {date: quantity due}, None dates
+                being due already
+        """
+        self.bom = bom
+        self.available = available
+        self.receipts = receipts or {}
+
+    @classmethod
+    def from_database(cls):
+        """
+        Load the BOM, available stock and open purchase order receipts
+        """
+        bom = defaultdict(dict)
+        for product_id, material_id, quantity in ProductMaterial.objects.values_list(
+            'product_id', 'material_id', 'quantity'
+        ):
+            bom[PRODUCT, product_id][MATERIAL, material_id] = quantity
+
+        # Materials the ledger has not summarized yet have nothing reserved
+        available = {
+            material_id: quantity if on_hand is None else on_hand - reserved
+            for material_id, quantity, on_hand, reserved in Material.objects.values_list(
+                'id', 'quantity', 'stock_summary__on_hand', 'stock_summary__reserved'
+            )
+        }
+        return cls(dict(bom), available, cls.open_receipts())
+
+    @staticmethod
+    def open_receipts():
+        """
+        Quantity ordered but not received per material and expected delivery date,
+        none without the inventory app
+        """
+        if not apps.is_installed('inventory'):
+            return {}
+        from inventory.models import MaterialOrderItem  # Import here, the inventory app is optional
+        from inventory.replenishment import OPEN_ORDER_STATUSES  # Import here, the inventory app is optional
+
+        receipts = defaultdict(dict)
+        for row in MaterialOrderItem.objects.filter(
+            order__status__in=OPEN_ORDER_STATUSES
+        ).values('material_id', 'order__expected_delivery_date').annotate(
+            outstanding=Sum(F('quantity_ordered') - F('quantity_received'))
+        ).order_by():
+            if row['outstanding'] > 0:
+                receipts[row['material_id']][row['order__expected_delivery_date']] = row['outstanding']
+        return dict(receipts)
+
+    @staticmethod
+    def confirmed_demand():
+        """
+        Unfinished items of confirmed customer orders
+
+        Orders already in production hold their stock through work order
+        reservations, which the available balance accounts for
+
+        Returns:
+            dict: Production start date to {product id: quantity}, empty
+            without the orders app
+        """
+        if not apps.is_installed('orders'):
+            return {}
+        from orders.models import ProductOrderItem  # Import here, the orders app is optional
+
+        demand = defaultdict(lambda: defaultdict(Decimal))
+        for product_id, start, quantity in ProductOrderItem.objects.filter(
+            order__status='CONFIRMED'
+        ).exclude(
+            production_status='COMPLETED'
+        ).values_list('product_id', 'order__expected_production_start', 'quantity').iterator():
+            demand[start.date() if start else None][product_id] += quantity
+        return demand
+
+    def explode(self, demand):
+        """
+        Gross material requirement of a demand vector
+
+        Args:
+            demand (dict): Product id to quantity
+
+        Returns:
+            dict: Material id to quantity
+        """
+        requirements = defaultdict(Decimal)
+        level = {(PRODUCT, product_id): Decimal(quantity) for product_id, quantity in demand.items()}
+        for _ in range(MAX_BOM_LEVELS):
+            if not level:
+                break
+            next_level = defaultdict(Decimal)
+            for item, quantity in level.items():
+                for component, per_unit in self.bom.get(item, {}).items():
+                    if component in self.bom:
+                        next_level[component] += quantity * per_unit
+                    elif component[0] == MATERIAL:
+                        requirements[component[1]] += quantity * per_unit
+            level = next_level
+        return requirements
+
+    def plan(self, demand, today=None):
+        """
+        Time-phased material shortages of the demand
+
+        Args:
+            demand (dict): Date to {product id: quantity}; undated demand is
+                needed today
+
+        Returns:
+            dict: materials, per material totals and first shortage date;
+            shortages, one row per material and date that runs short
+        """
+        today = today or timezone.localdate()
+        buckets = defaultdict(lambda: defaultdict(Decimal))
+        for day, products in demand.items():
+            for product_id, quantity in products.items():
+                buckets[max(day or today, today)][product_id] += quantity
+
+        gross = defaultdict(dict)
+        for day, products in buckets.items():
+            for material_id, quantity in self.explode(products).items():
+                gross[material_id][day] = quantity
+
+        materials = {}
+        shortages = []
+        for material_id, requirements in gross.items():
+            receipts = self.receipts.get(material_id, {})
+            due = sorted(
+                (max(day or today, today), quantity) for day, quantity in receipts.items()
+            )
+            balance = self.available.get(material_id, Decimal('0'))
+            summary = {
+                'material_id': material_id,
+                'available': balance,
+                'on_order': sum((quantity for _, quantity in due), Decimal('0')),
+                'gross_requirement': Decimal('0'),
+                'net_requirement': Decimal('0'),
+                'first_shortage_date': None
+            }
+            index = 0
+            for day in sorted(requirements):
+                while index < len(due) and due[index][0] <= day:
+                    balance += due[index][1]
+                    index += 1
+                balance -= requirements[day]
+                summary['gross_requirement'] += requirements[day]
+                if balance < 0:
+                    shortages.append({'material_id': material_id, 'date': day, 'quantity': -balance})
+                    summary['net_requirement'] -= balance
+                    summary['first_shortage_date'] = summary['first_shortage_date'] or day
+                    balance = Decimal('0')
+            materials[material_id] = summary
+
+        shortages.sort(key=lambda shortage: (shortage['date'], shortage['material_id']))
+        return {'materials': materials, 'shortages': shortages}
+
+
+def plan_material_requirements(today=None):
+    """
+    Material shortages of all confirmed customer orders
+
+    Returns:
+        dict: The plan with the date it was computed for
+    """
+    today = today or timezone.localdate()
+    planner = MaterialRequirementsPlanner.from_database()
+    plan = planner.plan(planner.confirmed_demand(), today)
+    plan['planned_for'] = today
+    return plan
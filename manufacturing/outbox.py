@@ -0,0 +1,169 @@
+"""
+Transactional outbox for WebSocket events
+
+Events are written to OutboxEvent inside the caller's transaction, so an event
+exists only if the change it describes was committed. A relay drains pending
+rows after commit and sends them to the channel layer, one group_send per
+topic group and batch, keeping the Redis round trip off the request thread.
+
+The relay runs in a daemon thread of the web process, woken on every commit
+that wrote events. Set OUTBOX_RELAY_IN_PROCESS = False to leave draining to
+the relay_outbox management command instead.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+from .replay import EventReplayBuffer
+from .snapshot import InitialStateSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """
+    Write events to the outbox and relay committed ones to the channel layer
+    """
+    batch_size = 500
+    # Seconds before the in-process relay retries a failed batch
+    retry_delay = 1
+
+    _wakeup = threading.Event()
+    _thread = None
+    _thread_lock = threading.Lock()
+
+    @classmethod
+    def enqueue(cls, event_type, data, groups):
+        """
+        Store an event in the current transaction and relay it to the given
+        topic groups once committed
+        """
+        event = OutboxEvent.objects.create(
+            event_type=event_type,
+            groups=list(groups),
+            payload=data
+        )
+        transaction.on_commit(cls.wake)
+        return event
+
+    @classmethod
+    def wake(cls):
+        """
+        Signal the in-process relay that committed events are waiting
+        """
+        if not getattr(settings, 'OUTBOX_RELAY_IN_PROCESS', True):
+            return
+        cls._ensure_thread()
+        cls._wakeup.set()
+
+    @classmethod
+    def _ensure_thread(cls):
+        with cls._thread_lock:
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = threading.Thread(
+                    target=cls._run,
+                    name='outbox-relay',
+                    daemon=True
+                )
+                cls._thread.start()
+
+    @classmethod
+    def _run(cls):
+        while True:
+            cls._wakeup.wait()
+            cls._wakeup.clear()
+            try:
+                cls.drain_all()
+            except Exception:
+                logger.exception("Outbox relay failed, retrying shortly")
+                time.sleep(cls.retry_delay)
+                cls._wakeup.set()
+            finally:
+                close_old_connections()
+
+    @classmethod
+    def drain_all(cls, batch_size=None):
+        """
+        Relay batches until no pending events remain, returns the number sent
+        """
+        total = 0
+        while True:
+            sent = cls.drain(batch_size)
+            total += sent
+            if sent < (batch_size or cls.batch_size):
+                return total
+
+    @classmethod
+    def drain(cls, batch_size=None):
+        """
+        Relay one batch of pending events, oldest first
+
+        Rows are locked while they are sent and only marked dispatched if the
+        channel layer accepted them, so a failed send is retried later. The
+        replay buffer and the initial state snapshot are updated after the
+        send, so a failed batch leaves neither behind.
+
+        Returns:
+            int: Number of events relayed
+        """
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True).filter(
+                    dispatched_at__isnull=True
+                ).order_by('id')[:batch_size or cls.batch_size]
+            )
+            if not events:
+                return 0
+
+            # The row ID numbers the event, a resent event keeps its number
+            entries = [
+                (event.groups, {
+                    'seq': event.id,
+                    'event_type': event.event_type,
+                    'data': event.payload,
+                    'timestamp': event.created_at.isoformat()
+                })
+                for event in events
+            ]
+
+            batches = defaultdict(list)
+            for groups, message in entries:
+                for group_name in groups:
+                    batches[group_name].append(message)
+
+            channel_layer = get_channel_layer()
+            for group_name, group_events in batches.items():
+                async_to_sync(channel_layer.group_send)(group_name, {
+                    'type': 'event_batch',
+                    'events': group_events
+                })
+
+            OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+                dispatched_at=timezone.now()
+            )
+
+            # Only events the channel layer accepted are kept for resuming
+            # clients and patched into the shared initial state
+            EventReplayBuffer.append(entries)
+            InitialStateSnapshot.apply_events(
+                (event.event_type, event.payload) for event in events
+            )
+        return len(events)
+
+    @staticmethod
+    def purge(older_than):
+        """
+        Delete events dispatched before the given time
+        """
+        deleted, _ = OutboxEvent.objects.filter(
+            dispatched_at__lt=older_than
+        ).delete()
+        return deleted
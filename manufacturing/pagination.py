@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination
+
+
+class WorkOrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the work order list, newest first
+
+    Pages are fetched by position instead of offset and no COUNT(*) is run,
+    so the cost of a page does not grow with the table.
+    """
+    ordering = ('-created_at', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class ScheduleCursorPagination(CursorPagination):
+    """
+    Keyset pagination for scheduled operations, earliest start first
+    """
+    ordering = ('start_time', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,104 @@
+"""
+Replay buffer for WebSocket events
+
+Every relayed event is numbered with the ID of its outbox row, so a batch the
+relay sends again after a failure keeps its sequence numbers and clients can
+drop what they already have. The most recent events are kept in a bounded
+buffer in the shared cache. A client that reconnects with the last sequence
+number it saw is sent only the events it missed on its topics, instead of
+refetching everything.
+"""
+import time
+
+from django.core.cache import cache
+
+
+class EventReplayBuffer:
+    """
+    Keep the most recent numbered events for resuming clients
+    """
+    # Highest sequence number relayed
+    sequence_key = 'manufacturing:events:sequence'
+    # Sequence numbers up to this one are no longer buffered
+    floor_key = 'manufacturing:events:floor'
+    buffer_key = 'manufacturing:events:buffer'
+    lock_key = 'manufacturing:events:buffer:lock'
+    size = 1000
+
+    @classmethod
+    def append(cls, entries):
+        """
+        Add relayed messages to the buffer
+
+        Args:
+            entries (list): (groups, message) pairs, each message carrying its
+                'seq'; messages already buffered are replaced, not repeated
+        """
+        if not entries:
+            return
+
+        with cls._lock():
+            buffer = cache.get(cls.buffer_key)
+            if buffer is None:
+                # Nothing before the first event buffered since a cache reset
+                # can be replayed
+                buffer = []
+                cache.set(cls.floor_key, min(message['seq'] for _, message in entries) - 1, None)
+            by_seq = {entry['seq']: entry for entry in buffer}
+            by_seq.update(
+                (message['seq'], {'seq': message['seq'], 'groups': list(groups), 'message': message})
+                for groups, message in entries
+            )
+            buffer = sorted(by_seq.values(), key=lambda entry: entry['seq'])
+            evicted, buffer = buffer[:-cls.size], buffer[-cls.size:]
+            if evicted:
+                cache.set(cls.floor_key, evicted[-1]['seq'], None)
+            cache.set(cls.buffer_key, buffer, None)
+            cache.set(cls.sequence_key, max(cache.get(cls.sequence_key, 0), buffer[-1]['seq']), None)
+
+    @classmethod
+    def since(cls, seq, topics):
+        """
+        Events after seq on any of the given topics, oldest first
+
+        Returns None when events after seq were already evicted, in which
+        case the client has to reload its state instead.
+        """
+        buffer = cache.get(cls.buffer_key) or []
+        latest = cache.get(cls.sequence_key, 0)
+        if seq == latest:
+            return []
+        # A client ahead of the buffer saw events from before a cache reset
+        if seq > latest or not buffer or seq < cache.get(cls.floor_key, 0):
+            return None
+        return [
+            entry['message'] for entry in buffer
+            if entry['seq'] > seq and not topics.isdisjoint(entry['groups'])
+        ]
+
+    @classmethod
+    def _lock(cls):
+        return _CacheLock(cls.lock_key)
+
+
+class _CacheLock:
+    """
+    Short-lived mutual exclusion across processes through cache.add
+    """
+    def __init__(self, key, timeout=5, wait=1.0):
+        self.key = key
+        self.timeout = timeout
+        self.wait = wait
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.wait
+        # Proceed without the lock rather than stall the relay
+        self.acquired = cache.add(self.key, True, self.timeout)
+        while not self.acquired and time.monotonic() < deadline:
+            time.sleep(0.01)
+            self.acquired = cache.add(self.key, True, self.timeout)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.acquired:
+            cache.delete(self.key)
@@ -0,0 +1,296 @@
+"""
+Set-based material reservation for work orders
+
+Reserves the complete bill of materials for one or more work orders using a
+fixed number of statements, regardless of how many materials are involved:
+
+1. One query to load the BOM rows of every product involved
+2. One SELECT ... FOR UPDATE to lock the affected stock summaries
+3. One conditional UPDATE to move the demand from available to reserved
+4. Two bulk INSERTs for the ledger movements and the reservation records
+
+Reservations only touch MaterialStockSummary rows, never Material rows.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .exceptions import MaterialShortageError
+from .ledger import StockLedger
+from .models import MaterialReservation, ProductMaterial, StockMovement, WorkOrder
+
+
+class MaterialReservationEngine:
+    """
+    Reserve materials for a batch of work orders in a single transaction
+    """
+    def __init__(self, work_orders):
+        self.work_orders = list(work_orders)
+        self.requirements = self._load_requirements()
+
+    def _load_requirements(self):
+        """
+        Build {work_order_id: {material_id: required_quantity}} from one BOM query
+        """
+        product_ids = {work_order.product_id for work_order in self.work_orders}
+        bom = defaultdict(list)
+        for row in ProductMaterial.objects.filter(
+            product_id__in=product_ids
+        ).values('product_id', 'material_id', 'quantity'):
+            bom[row['product_id']].append((row['material_id'], row['quantity']))
+
+        requirements = {}
+        for work_order in self.work_orders:
+            required = defaultdict(Decimal)
+            for material_id, quantity in bom[work_order.product_id]:
+                required[material_id] += quantity * work_order.quantity
+            requirements[work_order.id] = dict(required)
+        return requirements
+
+    def total_demand(self, work_order_ids=None):
+        """
+        Combined material demand for the given work orders (all by default)
+        """
+        demand = defaultdict(Decimal)
+        for work_order_id, required in self.requirements.items():
+            if work_order_ids is not None and work_order_id not in work_order_ids:
+                continue
+            for material_id, quantity in required.items():
+                demand[material_id] += quantity
+        return dict(demand)
+
+    def lock_materials(self, material_ids):
+        """
+        Lock the stock summaries of the affected materials for the rest of
+        the transaction, keyed by material ID
+        """
+        return StockLedger.lock_summaries(material_ids)
+
+    @staticmethod
+    def find_shortages(demand, materials):
+        """
+        Compare demand against locked available stock, using the same detail
+        format as WorkOrder.check_material_availability
+        """
+        shortages = []
+        for material_id, required_quantity in demand.items():
+            summary = materials[material_id]
+            if summary.available < required_quantity:
+                shortages.append({
+                    'material_id': material_id,
+                    'material_name': summary.material.name,
+                    'required_quantity': required_quantity,
+                    'available_quantity': summary.available,
+                    'shortage_percentage': (required_quantity - summary.available) / required_quantity * 100
+                })
+        return shortages
+
+    def allocate(self, ordered_work_order_ids, materials):
+        """
+        Admit work orders in the given order while locked stock still covers them
+
+        Args:
+            ordered_work_order_ids (list): Work order IDs, highest priority first
+            materials (dict): Locked stock summaries keyed by material ID
+
+        Returns:
+            tuple: (admitted work order IDs, {rejected work order ID: shortages})
+        """
+        remaining = {material_id: summary.available for material_id, summary in materials.items()}
+        admitted = []
+        rejected = {}
+        for work_order_id in ordered_work_order_ids:
+            required = self.requirements[work_order_id]
+            shortages = [
+                {
+                    'material_id': material_id,
+                    'material_name': materials[material_id].material.name,
+                    'required_quantity': quantity,
+                    'available_quantity': remaining[material_id],
+                    'shortage_percentage': (quantity - remaining[material_id]) / quantity * 100
+                }
+                for material_id, quantity in required.items()
+                if remaining[material_id] < quantity
+            ]
+            if shortages:
+                rejected[work_order_id] = shortages
+                continue
+            for material_id, quantity in required.items():
+                remaining[material_id] -= quantity
+            admitted.append(work_order_id)
+        return admitted, rejected
+
+    def reserve(self, work_order_ids=None, materials=None):
+        """
+        Reserve materials for the given work orders (all by default)
+
+        Args:
+            work_order_ids (iterable, optional): Work orders to reserve for
+            materials (dict, optional): Stock summaries already locked by the caller
+
+        Raises:
+            MaterialShortageError: if any material cannot cover the combined demand
+        """
+        if work_order_ids is None:
+            work_order_ids = set(self.requirements)
+        demand = self.total_demand(work_order_ids)
+        if not demand:
+            return []
+
+        with transaction.atomic():
+            if materials is None:
+                materials = self.lock_materials(demand.keys())
+            shortages = self.find_shortages(demand, materials)
+            if shortages:
+                raise MaterialShortageError(
+                    "Insufficient materials to start work order",
+                    material_details=shortages
+                )
+
+            # Conditional move from available to reserved, recorded in the ledger
+            StockLedger.record([
+                StockMovement(
+                    material_id=material_id,
+                    movement_type='RESERVE',
+                    quantity=quantity,
+                    work_order_id=work_order_id,
+                    reference=f"WO-{work_order_id}"
+                )
+                for work_order_id in work_order_ids
+                for material_id, quantity in self.requirements[work_order_id].items()
+            ], require_available=True)
+
+            reservations = MaterialReservation.objects.bulk_create([
+                MaterialReservation(
+                    work_order_id=work_order_id,
+                    material_id=material_id,
+                    quantity_reserved=quantity
+                )
+                for work_order_id in work_order_ids
+                for material_id, quantity in self.requirements[work_order_id].items()
+            ])
+
+            for material_id, quantity in demand.items():
+                materials[material_id].reserved += quantity
+                materials[material_id].available -= quantity
+            self._evaluate_low_stock(materials[material_id] for material_id in demand)
+
+        return reservations
+
+    @staticmethod
+    def _evaluate_low_stock(summaries):
+        """
+        Queue a single low stock event for the whole batch in the outbox
+        """
+        low_stock = [
+            {
+                'material_id': summary.material_id,
+                'material_name': summary.material.name,
+                'current_quantity': summary.available,
+                'reorder_level': summary.material.reorder_level
+            }
+            for summary in summaries
+            if summary.available <= summary.material.reorder_level
+        ]
+        if not low_stock:
+            return
+
+        from .events import MaterialEventHandler  # Import here to avoid circular import
+        MaterialEventHandler.handle_low_stock(low_stock)
+
+
+# Ordering applied to a batch before scarce material is allocated
+ADMISSION_POLICIES = {
+    'priority': lambda work_order, demand: (
+        -WorkOrder.PRIORITY_RANK.get(work_order.priority, 0), work_order.created_at, work_order.id
+    ),
+    'fifo': lambda work_order, demand: (work_order.created_at, work_order.id),
+    'smallest_demand': lambda work_order, demand: (sum(demand.values()), work_order.created_at, work_order.id),
+}
+
+
+def bulk_start_work_orders(work_order_ids, policy='priority'):
+    """
+    Start a batch of work orders, reserving materials for all of them at once
+
+    The work orders are locked first. Combined BOM demand is computed once,
+    scarce material is allocated to the work orders in policy order, and every
+    admitted work order is reserved and moved to IN_PROGRESS in the same
+    transaction. Work orders still waiting on unfinished dependencies are
+    rejected.
+
+    Args:
+        work_order_ids (list): IDs of the work orders to start
+        policy (str): Key of ADMISSION_POLICIES used to rank the batch
+
+    Returns:
+        list: One result dict per requested work order
+    """
+    results = {}
+    with transaction.atomic():
+        # Locked so a concurrent bulk start cannot admit the same orders
+        work_orders = WorkOrder.objects.select_for_update().filter(pk__in=work_order_ids).only(
+            'id', 'product_id', 'quantity', 'status', 'priority', 'created_at', 'unfinished_dependencies'
+        ).in_bulk()
+
+        candidates = []
+        for work_order_id in dict.fromkeys(work_order_ids):
+            work_order = work_orders.get(work_order_id)
+            if work_order is None:
+                results[work_order_id] = {'status': 'rejected', 'reason': 'Work order not found'}
+                continue
+            try:
+                work_order.validate_status_transition('IN_PROGRESS')
+            except ValueError as e:
+                results[work_order_id] = {'status': 'rejected', 'reason': str(e)}
+                continue
+            if not work_order.can_start():
+                results[work_order_id] = {
+                    'status': 'rejected',
+                    'reason': f'Waiting on {work_order.unfinished_dependencies} unfinished dependencies'
+                }
+                continue
+            candidates.append(work_order)
+
+        if candidates:
+            engine = MaterialReservationEngine(candidates)
+            sort_key = ADMISSION_POLICIES[policy]
+            ordered_ids = [
+                work_order.id for work_order in sorted(
+                    candidates,
+                    key=lambda work_order: sort_key(work_order, engine.requirements[work_order.id])
+                )
+            ]
+
+            materials = engine.lock_materials(engine.total_demand().keys())
+            admitted, rejected = engine.allocate(ordered_ids, materials)
+            engine.reserve(admitted, materials=materials)
+
+            now = timezone.now()
+            WorkOrder.objects.filter(pk__in=admitted).update(
+                status='IN_PROGRESS',
+                start_date=now,
+                updated_at=now
+            )
+
+            if admitted:
+                from .dashboard import WorkOrderDashboardStats  # Import here to avoid circular import
+                from .events import WorkOrderEventHandler  # Import here to avoid circular import
+                WorkOrderEventHandler.handle_bulk_start(admitted)
+                transaction.on_commit(WorkOrderDashboardStats.invalidate)
+
+            for work_order_id in admitted:
+                results[work_order_id] = {'status': 'admitted'}
+            for work_order_id, shortages in rejected.items():
+                results[work_order_id] = {
+                    'status': 'rejected',
+                    'reason': 'Insufficient materials',
+                    'material_details': shortages
+                }
+
+    return [
+        {'work_order_id': work_order_id, **results[work_order_id]}
+        for work_order_id in dict.fromkeys(work_order_ids)
+    ]
@@ -0,0 +1,303 @@
+"""
+Daily production rollups
+
+ProductionLog writes are folded into ProductionDailyRollup, one row per day,
+workstation and product, so the analytics views never group the full log
+history. Only today's raw logs are scanned on read; earlier days come from the
+rollups.
+
+Each key has exactly one row. Missing rows are inserted empty, skipping keys
+another writer created first, and then adjusted with F() increments.
+Queryset updates bypass the signals; run the rebuild_production_rollups
+command after bulk edits.
+"""
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ProductionDailyRollup, ProductionLog, WorkOrder
+
+
+class ProductionRollup:
+    """
+    Maintain and read the daily production rollups
+    """
+    batch_size = 1000
+
+    @staticmethod
+    def _decimal(value):
+        # Rounded like the two-decimal fields it was stored in
+        return Decimal(str(value)).quantize(Decimal('0.01')) if value is not None else None
+
+    @staticmethod
+    def _start_of(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    @classmethod
+    def _apply(cls, day, workstation_id, product_id, sign, quantity, wastage, efficiency):
+        """
+        Add (sign=1) or remove (sign=-1) one log's contribution
+        """
+        efficiency = cls._decimal(efficiency)
+        cls._add({
+            (day, workstation_id, product_id): [
+                sign,
+                sign * (quantity or 0),
+                sign * (cls._decimal(wastage) or Decimal('0')),
+                sign * (efficiency or Decimal('0')),
+                sign if efficiency is not None else 0
+            ]
+        })
+
+    @classmethod
+    def _add(cls, totals):
+        """
+        Add totals to rollup rows, creating the rows for a positive log count
+
+        Args:
+            totals (dict): (day, workstation_id, product_id) to a list of log
+                count, quantity, wastage, efficiency total and count
+        """
+        # A missing row on removal means the rollups were already dropped,
+        # by a cascade or a rebuild, so there is nothing to take out
+        ProductionDailyRollup.objects.bulk_create(
+            [
+                ProductionDailyRollup(day=day, workstation_id=workstation_id, product_id=product_id)
+                for (day, workstation_id, product_id), total in totals.items()
+                if total[0] > 0
+            ],
+            batch_size=cls.batch_size,
+            ignore_conflicts=True
+        )
+        for (day, workstation_id, product_id), total in totals.items():
+            log_count, quantity, wastage, efficiency_total, efficiency_count = total
+            ProductionDailyRollup.objects.filter(
+                day=day,
+                workstation_id=workstation_id,
+                product_id=product_id
+            ).update(
+                log_count=F('log_count') + log_count,
+                quantity_produced=F('quantity_produced') + quantity,
+                wastage=F('wastage') + wastage,
+                efficiency_total=F('efficiency_total') + efficiency_total,
+                efficiency_count=F('efficiency_count') + efficiency_count
+            )
+
+    @classmethod
+    def record(cls, log, created):
+        """
+        Fold a saved log into the rollups
+
+        Updates move the stored contribution to the new values; saves that
+        leave the tracked fields alone cost nothing.
+        """
+        day = timezone.localdate(log.created_at)
+        product_id = log.work_order.product_id
+
+        with transaction.atomic():
+            if not created:
+                changed = log.changed_fields
+                if not changed:
+                    return
+                previous_product_id = product_id
+                if 'work_order' in changed:
+                    previous_product_id = WorkOrder.objects.filter(
+                        pk=changed['work_order']
+                    ).values_list('product_id', flat=True).first()
+                cls._apply(
+                    day,
+                    log.previous('workstation'),
+                    previous_product_id,
+                    -1,
+                    log.previous('quantity_produced'),
+                    log.previous('wastage'),
+                    log.previous('efficiency_rate')
+                )
+
+            cls._apply(
+                day,
+                log.workstation_id,
+                product_id,
+                1,
+                log.quantity_produced,
+                log.wastage,
+                log.efficiency_rate
+            )
+
+    @classmethod
+    def record_many(cls, logs, product_ids):
+        """
+        Fold bulk created logs into the rollups, one insert for the missing
+        rows and one update per rollup row
+
+        Args:
+            logs (list): Saved logs, which bulk_create does not signal
+            product_ids (dict): Work order id to its product id
+        """
+        totals = {}
+        for log in logs:
+            key = (timezone.localdate(log.created_at), log.workstation_id, product_ids[log.work_order_id])
+            total = totals.setdefault(key, [0, 0, Decimal('0'), Decimal('0'), 0])
+            efficiency = cls._decimal(log.efficiency_rate)
+            total[0] += 1
+            total[1] += log.quantity_produced or 0
+            total[2] += cls._decimal(log.wastage) or Decimal('0')
+            total[3] += efficiency or Decimal('0')
+            total[4] += efficiency is not None
+
+        with transaction.atomic():
+            cls._add(totals)
+
+    @classmethod
+    def remove(cls, log):
+        """
+        Take a deleted log's stored contribution out of the rollups
+        """
+        product_id = WorkOrder.objects.filter(
+            pk=log.previous('work_order')
+        ).values_list('product_id', flat=True).first()
+        cls._apply(
+            timezone.localdate(log.created_at),
+            log.previous('workstation'),
+            product_id,
+            -1,
+            log.previous('quantity_produced'),
+            log.previous('wastage'),
+            log.previous('efficiency_rate')
+        )
+
+    @classmethod
+    def rebuild(cls, since=None):
+        """
+        Recompute the rollups from the raw logs
+
+        Args:
+            since (date): Only rebuild this day and later, all days if None
+
+        Returns:
+            int: Number of rollup rows written
+        """
+        logs = ProductionLog.objects.all()
+        rollups = ProductionDailyRollup.objects.all()
+        if since is not None:
+            logs = logs.filter(created_at__gte=cls._start_of(since))
+            rollups = rollups.filter(day__gte=since)
+
+        totals = logs.annotate(
+            day=TruncDate('created_at')
+        ).values(
+            'day', 'workstation_id', 'work_order__product_id'
+        ).annotate(
+            log_count=Count('id'),
+            quantity=Sum('quantity_produced', default=0),
+            wastage_total=Sum('wastage', default=0),
+            efficiency_total=Sum('efficiency_rate', default=0),
+            efficiency_count=Count('efficiency_rate')
+        ).order_by()
+
+        with transaction.atomic():
+            rollups.delete()
+            created = ProductionDailyRollup.objects.bulk_create(
+                [
+                    ProductionDailyRollup(
+                        day=row['day'],
+                        workstation_id=row['workstation_id'],
+                        product_id=row['work_order__product_id'],
+                        log_count=row['log_count'],
+                        quantity_produced=row['quantity'],
+                        wastage=row['wastage_total'],
+                        efficiency_total=row['efficiency_total'],
+                        efficiency_count=row['efficiency_count']
+                    )
+                    for row in totals
+                ],
+                batch_size=cls.batch_size
+            )
+        return len(created)
+
+    @classmethod
+    def _today_totals(cls, today):
+        return ProductionLog.objects.filter(
+            created_at__gte=cls._start_of(today)
+        ).aggregate(
+            log_count=Count('id'),
+            quantity=Sum('quantity_produced', default=0),
+            efficiency_total=Sum('efficiency_rate', default=0),
+            efficiency_count=Count('efficiency_rate')
+        )
+
+    @classmethod
+    def daily_production(cls):
+        """
+        Quantity produced per day, oldest first
+        """
+        today = timezone.localdate()
+        history = ProductionDailyRollup.objects.filter(
+            day__lt=today
+        ).values('day').annotate(
+            logs=Sum('log_count'),
+            total_quantity=Sum('quantity_produced')
+        ).filter(logs__gt=0).order_by('day')
+
+        daily = [
+            {'day': cls._start_of(row['day']), 'total_quantity': row['total_quantity']}
+            for row in history
+        ]
+        current = cls._today_totals(today)
+        if current['log_count']:
+            daily.append({'day': cls._start_of(today), 'total_quantity': current['quantity']})
+        return daily
+
+    @classmethod
+    def monthly_efficiency(cls):
+        """
+        Average efficiency and total production per month, oldest first
+        """
+        today = timezone.localdate()
+        history = ProductionDailyRollup.objects.filter(
+            day__lt=today
+        ).annotate(
+            month=TruncMonth('day')
+        ).values('month').annotate(
+            logs=Sum('log_count'),
+            total_production=Sum('quantity_produced'),
+            efficiency_total=Sum('efficiency_total'),
+            efficiency_count=Sum('efficiency_count')
+        ).filter(logs__gt=0).order_by('month')
+
+        months = {
+            row['month']: [row['total_production'], row['efficiency_total'], row['efficiency_count']]
+            for row in history
+        }
+        current = cls._today_totals(today)
+        if current['log_count']:
+            month = months.setdefault(today.replace(day=1), [0, Decimal('0'), 0])
+            month[0] += current['quantity']
+            month[1] += current['efficiency_total']
+            month[2] += current['efficiency_count']
+
+        return [
+            {
+                'month': cls._start_of(month),
+                'avg_efficiency': efficiency_total / efficiency_count if efficiency_count else 0,
+                'total_production': total_production
+            }
+            for month, (total_production, efficiency_total, efficiency_count) in sorted(months.items())
+        ]
+
+
+@receiver(post_save, sender=ProductionLog)
+def update_production_rollups(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        ProductionRollup.record(instance, created)
+
+
+@receiver(post_delete, sender=ProductionLog)
+def remove_from_production_rollups(sender, instance, **kwargs):
+    ProductionRollup.remove(instance)
@@ -0,0 +1,581 @@
+"""
+Finite-capacity production scheduling
+
+Every open work order is expanded into operations, one per step of its
+product's routing (ProductWorkstationSequence), lasting the step's estimated
+time per unit times the order quantity. Each workstation runs one operation at
+a time; stations in MAINTENANCE or INACTIVE take no work.
+
+Operations are placed by list scheduling. Stations are visited in order of
+the time they can next start work; a free station takes the most urgent
+operation already waiting for it (priority, then age), or else the first to
+become ready. An order is released once all work orders it depends on have
+finished, so the dependencies DAG is honoured and cycles are reported rather
+than scheduled.
+
+Between full replans the stored schedule is repaired in place: when a station
+goes down or an order is cancelled, the orders that lose their slots (and the
+orders depending on them) are dropped, and only the operations after them on
+the same station, in the same order or in dependent orders are pulled
+forward. Each repair publishes the moved operations as a schedule.repaired
+event. Repairs run in a Celery worker, off the request that triggered them.
+"""
+import bisect
+import heapq
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ProductWorkstationSequence, ScheduledOperation, WorkOrder, WorkStation
+
+try:
+    from kombu.exceptions import OperationalError as BrokerUnavailable
+except ImportError:  # Celery is only needed by workers
+    BrokerUnavailable = ImportError
+
+logger = logging.getLogger(__name__)
+
+# Routing steps without an estimate keep the old one hour per unit assumption
+DEFAULT_UNIT_TIME = timedelta(hours=1)
+UNAVAILABLE_STATION_STATUSES = ('MAINTENANCE', 'INACTIVE')
+CLOSED_ORDER_STATUSES = ('COMPLETED', 'CANCELLED')
+
+# Reasons an order is left out of the schedule
+NO_ROUTING = 'NO_ROUTING'
+STATION_UNAVAILABLE = 'STATION_UNAVAILABLE'
+DEPENDENCY_CANCELLED = 'DEPENDENCY_CANCELLED'
+DEPENDENCY_UNSCHEDULED = 'DEPENDENCY_UNSCHEDULED'
+DEPENDENCY_CYCLE = 'DEPENDENCY_CYCLE'
+ORDER_CANCELLED = 'ORDER_CANCELLED'
+
+
+class ProductionScheduler:
+    """
+    List scheduler over open work orders, routings and station availability
+
+    Times are handled internally as seconds after ``origin``.
+
+    Args:
+        orders (iterable): (id, product_id, quantity, priority, created_at) rows
+        routings (iterable): (product_id, sequence_order, workstation_id,
+            estimated_time) rows
+        stations (iterable): (id, status) rows
+        dependencies (iterable): (work_order_id, dependency_id,
+            dependency_status) rows
+        origin (datetime): Earliest start of any operation, now by default
+    """
+
+    def __init__(self, orders, routings, stations, dependencies, origin=None):
+        self.origin = origin or timezone.now()
+        self.station_status = dict(stations)
+
+        steps = {}
+        for product_id, sequence_order, workstation_id, estimated_time in routings:
+            steps.setdefault(product_id, []).append((sequence_order, workstation_id, estimated_time))
+
+        self.operations = {}
+        self.rank = {}
+        self.unscheduled = {}
+        for order_id, product_id, quantity, priority, created_at in orders:
+            self.rank[order_id] = (-WorkOrder.PRIORITY_RANK.get(priority, 0), created_at, order_id)
+            routing = sorted(steps.get(product_id, ()), key=lambda step: step[0])
+            if not routing:
+                self.unscheduled[order_id] = NO_ROUTING
+                continue
+            if any(self.station_status.get(workstation_id) in UNAVAILABLE_STATION_STATUSES or
+                   workstation_id not in self.station_status
+                   for _, workstation_id, _ in routing):
+                self.unscheduled[order_id] = STATION_UNAVAILABLE
+            self.operations[order_id] = [
+                (
+                    sequence_order,
+                    workstation_id,
+                    ((estimated_time or DEFAULT_UNIT_TIME) * float(quantity)).total_seconds()
+                )
+                for sequence_order, workstation_id, estimated_time in routing
+            ]
+
+        self.depends_on = {order_id: set() for order_id in self.rank}
+        self.dependents = {order_id: [] for order_id in self.rank}
+        for order_id, dependency_id, dependency_status in dependencies:
+            if order_id not in self.rank or dependency_status == 'COMPLETED':
+                continue
+            if dependency_id in self.rank:
+                self.depends_on[order_id].add(dependency_id)
+                self.dependents[dependency_id].append(order_id)
+            elif order_id not in self.unscheduled:
+                self.unscheduled[order_id] = DEPENDENCY_CANCELLED
+
+    @classmethod
+    def from_database(cls, origin=None):
+        """
+        Load open work orders, routings, stations and dependencies
+        """
+        open_orders = WorkOrder.objects.exclude(status__in=CLOSED_ORDER_STATUSES)
+        return cls(
+            open_orders.values_list('id', 'product_id', 'quantity', 'priority', 'created_at'),
+            ProductWorkstationSequence.objects.filter(
+                product_id__in=open_orders.values('product_id')
+            ).values_list('product_id', 'sequence_order', 'workstation_id', 'estimated_time'),
+            WorkStation.objects.values_list('id', 'status'),
+            WorkOrder.dependencies.through.objects.filter(
+                from_workorder__in=open_orders
+            ).values_list('from_workorder_id', 'to_workorder_id', 'to_workorder__status'),
+            origin
+        )
+
+    def seconds(self, moment):
+        return (moment - self.origin).total_seconds()
+
+    def moment(self, seconds):
+        return self.origin + timedelta(seconds=seconds)
+
+    def dispatch(self, order_ids, station_free=None, release=None, first_step=None):
+        """
+        Slot the remaining operations of a set of orders
+
+        Args:
+            order_ids (set): Orders to place; their dependencies outside the
+                set are taken as already satisfied by ``release``
+            station_free (dict): Workstation id to the second it becomes free
+            release (dict): Order id to the earliest start of its next step
+            first_step (dict): Order id to the index of its next step
+
+        Returns:
+            tuple: (operations, finish) where operations are
+            (order_id, sequence_order, workstation_id, start, end) in seconds
+            and finish maps every fully placed order to its end
+        """
+        station_free = dict(station_free or {})
+        release = dict(release or {})
+        first_step = first_step or {}
+
+        # Per station: operations not yet ready when it frees up, keyed by
+        # ready time, and operations it could start now, keyed by priority
+        waiting = {}
+        startable = {}
+        # Stations keyed by the time they can start their next operation
+        events = []
+        next_start = {}
+
+        def refresh(workstation_id):
+            free = station_free.get(workstation_id, 0.0)
+            queue = waiting.get(workstation_id)
+            if startable.get(workstation_id) or (queue and queue[0][0] <= free):
+                start = free
+            elif queue:
+                start = queue[0][0]
+            else:
+                next_start.pop(workstation_id, None)
+                return
+            if next_start.get(workstation_id) != start:
+                next_start[workstation_id] = start
+                heapq.heappush(events, (start, workstation_id))
+
+        def push(order_id, step, ready):
+            workstation_id = self.operations[order_id][step][1]
+            heapq.heappush(waiting.setdefault(workstation_id, []), (ready, self.rank[order_id], step))
+            refresh(workstation_id)
+
+        pending = {
+            order_id: sum(1 for dependency_id in self.depends_on[order_id] if dependency_id in order_ids)
+            for order_id in order_ids
+        }
+        for order_id, count in pending.items():
+            if not count:
+                push(order_id, first_step.get(order_id, 0), release.get(order_id, 0.0))
+
+        operations = []
+        finish = {}
+        while events:
+            start, workstation_id = heapq.heappop(events)
+            # Superseded by a later refresh of the station
+            if next_start.get(workstation_id) != start:
+                continue
+            del next_start[workstation_id]
+
+            queue = waiting.get(workstation_id, [])
+            ready_now = startable.setdefault(workstation_id, [])
+            while queue and queue[0][0] <= start:
+                _, rank, step = heapq.heappop(queue)
+                heapq.heappush(ready_now, (rank, step))
+            if not ready_now:
+                refresh(workstation_id)
+                continue
+
+            rank, step = heapq.heappop(ready_now)
+            order_id = rank[2]
+            sequence_order, _, duration = self.operations[order_id][step]
+            end = start + duration
+            station_free[workstation_id] = end
+            operations.append((order_id, sequence_order, workstation_id, start, end))
+
+            if step + 1 < len(self.operations[order_id]):
+                push(order_id, step + 1, end)
+            else:
+                finish[order_id] = end
+                for dependent_id in self.dependents[order_id]:
+                    if dependent_id not in pending:
+                        continue
+                    release[dependent_id] = max(release.get(dependent_id, 0.0), end)
+                    pending[dependent_id] -= 1
+                    if not pending[dependent_id]:
+                        push(dependent_id, first_step.get(dependent_id, 0), release[dependent_id])
+            refresh(workstation_id)
+
+        return operations, finish
+
+    def _block_dependents(self):
+        """
+        Leave out every order that waits, directly or not, on one left out
+        """
+        blocked = list(self.unscheduled)
+        while blocked:
+            for dependent_id in self.dependents.get(blocked.pop(), ()):
+                if dependent_id not in self.unscheduled:
+                    self.unscheduled[dependent_id] = DEPENDENCY_UNSCHEDULED
+                    blocked.append(dependent_id)
+
+    def plan(self):
+        """
+        Schedule every schedulable open order from the origin
+
+        Returns:
+            list: (order_id, sequence_order, workstation_id, start, end)
+            operations in seconds, in placement order
+        """
+        self._block_dependents()
+        order_ids = set(self.operations) - set(self.unscheduled)
+        operations, finish = self.dispatch(order_ids)
+
+        # Orders still waiting on each other form a cycle
+        for order_id in order_ids - set(finish):
+            self.unscheduled[order_id] = DEPENDENCY_CYCLE
+        return operations
+
+
+def replan(origin=None):
+    """
+    Build a fresh schedule for all open work orders and store it
+
+    Returns:
+        dict: Summary of the plan and the orders left out with their reason
+    """
+    scheduler = ProductionScheduler.from_database(origin)
+    operations = scheduler.plan()
+    planned_at = timezone.now()
+
+    with transaction.atomic():
+        ScheduledOperation.objects.all().delete()
+        ScheduledOperation.objects.bulk_create(
+            [
+                ScheduledOperation(
+                    work_order_id=order_id,
+                    workstation_id=workstation_id,
+                    sequence_order=sequence_order,
+                    start_time=scheduler.moment(start),
+                    end_time=scheduler.moment(end),
+                    planned_at=planned_at
+                )
+                for order_id, sequence_order, workstation_id, start, end in operations
+            ],
+            batch_size=1000
+        )
+
+    return {
+        'planned_at': planned_at,
+        'origin': scheduler.origin,
+        'operations': len(operations),
+        'work_orders': len({operation[0] for operation in operations}),
+        'completion': scheduler.moment(max((operation[4] for operation in operations), default=0)),
+        'unscheduled': [
+            {'work_order_id': order_id, 'reason': reason}
+            for order_id, reason in sorted(scheduler.unscheduled.items())
+        ]
+    }
+
+
+class ScheduleRepair:
+    """
+    Left-shift repair of the stored schedule
+
+    Works on the operations still running after ``since``, the start of the
+    earliest dropped operation. Station sequences are kept; an operation only
+    moves earlier, to the latest end of the operation before it on its
+    station, its previous routing step and, for a first step, the orders it
+    depends on, and never before ``since``. Operations starting by then stay
+    put.
+
+    Args:
+        rows (iterable): (id, work_order_id, workstation_id, sequence_order,
+            start_time, end_time) rows
+        dependencies (iterable): (work_order_id, dependency_id) rows
+        since (datetime): Nothing is moved before this moment
+    """
+
+    def __init__(self, rows, dependencies, since):
+        self.since = since
+        self.operations = {}
+        self.by_order = {}
+        for operation_id, order_id, workstation_id, sequence_order, start, end in rows:
+            self.operations[operation_id] = [order_id, workstation_id, sequence_order, start, end]
+            self.by_order.setdefault(order_id, []).append(operation_id)
+        for operation_ids in self.by_order.values():
+            operation_ids.sort(key=lambda operation_id: self.operations[operation_id][2])
+
+        self.depends_on = {}
+        self.dependents = {}
+        for order_id, dependency_id in dependencies:
+            self.depends_on.setdefault(order_id, []).append(dependency_id)
+            self.dependents.setdefault(dependency_id, []).append(order_id)
+
+    @classmethod
+    def from_database(cls, since):
+        """
+        Load the scheduled operations ending after ``since`` and the
+        dependencies between their orders
+        """
+        pending = ScheduledOperation.objects.filter(end_time__gt=since)
+        return cls(
+            pending.values_list(
+                'id', 'work_order_id', 'workstation_id', 'sequence_order', 'start_time', 'end_time'
+            ),
+            WorkOrder.dependencies.through.objects.filter(
+                from_workorder__in=pending.values('work_order_id')
+            ).values_list('from_workorder_id', 'to_workorder_id'),
+            since
+        )
+
+    def _drop(self, removed):
+        """
+        Extend the dropped orders with everything that depends on them
+
+        Args:
+            removed (dict): Order id to the reason it leaves the schedule
+        """
+        blocked = list(removed)
+        while blocked:
+            order_id = blocked.pop()
+            reason = DEPENDENCY_CANCELLED if removed[order_id] == ORDER_CANCELLED else DEPENDENCY_UNSCHEDULED
+            for dependent_id in self.dependents.get(order_id, ()):
+                if dependent_id not in removed:
+                    removed[dependent_id] = reason
+                    blocked.append(dependent_id)
+        return removed
+
+    def repair(self, removed):
+        """
+        Drop orders from the schedule and pull the operations after them forward
+
+        Args:
+            removed (dict): Order id to the reason it leaves the schedule
+
+        Returns:
+            tuple: (removed, moved) where removed is the full dict of dropped
+            orders and moved lists (operation_id, old_start) for every shifted
+            operation, whose new times are in ``operations``
+        """
+        removed = self._drop(dict(removed))
+        dropped = {
+            operation_id for order_id in removed for operation_id in self.by_order.get(order_id, ())
+        }
+
+        # Station sequences without the dropped operations
+        stations = {}
+        for operation_id in self.operations:
+            if operation_id not in dropped:
+                stations.setdefault(self.operations[operation_id][1], []).append(operation_id)
+        station_previous = {}
+        station_next = {}
+        station_starts = {}
+        for workstation_id, operation_ids in stations.items():
+            operation_ids.sort(key=lambda operation_id: self.operations[operation_id][3])
+            station_starts[workstation_id] = [self.operations[operation_id][3] for operation_id in operation_ids]
+            for previous_id, operation_id in zip(operation_ids, operation_ids[1:]):
+                station_previous[operation_id] = previous_id
+                station_next[previous_id] = operation_id
+
+        # Start from what followed each dropped operation on its station
+        queue = []
+        for operation_id in dropped:
+            _, workstation_id, _, start, _ = self.operations[operation_id]
+            index = bisect.bisect_left(station_starts.get(workstation_id, ()), start)
+            if index < len(station_starts.get(workstation_id, ())):
+                following_id = stations[workstation_id][index]
+                heapq.heappush(queue, (self.operations[following_id][3], following_id))
+
+        original_start = {}
+        while queue:
+            _, operation_id = heapq.heappop(queue)
+            order_id, workstation_id, _, start, end = self.operations[operation_id]
+            if start <= self.since:
+                continue
+
+            earliest = self.since
+            if operation_id in station_previous:
+                earliest = max(earliest, self.operations[station_previous[operation_id]][4])
+            steps = self.by_order[order_id]
+            position = steps.index(operation_id)
+            if position:
+                earliest = max(earliest, self.operations[steps[position - 1]][4])
+            else:
+                for dependency_id in self.depends_on.get(order_id, ()):
+                    if dependency_id in self.by_order:
+                        earliest = max(earliest, self.operations[self.by_order[dependency_id][-1]][4])
+            if earliest >= start:
+                continue
+
+            original_start.setdefault(operation_id, start)
+            self.operations[operation_id][3:] = [earliest, earliest + (end - start)]
+
+            successors = []
+            if operation_id in station_next:
+                successors.append(station_next[operation_id])
+            if position + 1 < len(steps):
+                successors.append(steps[position + 1])
+            else:
+                successors.extend(
+                    self.by_order[dependent_id][0]
+                    for dependent_id in self.dependents.get(order_id, ())
+                    if dependent_id in self.by_order and dependent_id not in removed
+                )
+            for successor_id in successors:
+                heapq.heappush(queue, (self.operations[successor_id][3], successor_id))
+
+        return removed, sorted(original_start.items(), key=lambda item: self.operations[item[0]][3])
+
+
+def repair_schedule(removed, trigger, now=None):
+    """
+    Repair the stored schedule after orders lose their slots and publish the
+    difference
+
+    Args:
+        removed (dict): Order id to the reason it leaves the schedule
+        trigger (dict): What caused the repair, included in the event
+
+    Returns:
+        dict: The published diff, None when the schedule had nothing to change
+    """
+    from .events import EventType, WorkflowEvent  # Import here to avoid circular import
+
+    now = now or timezone.now()
+    # Nothing ahead of the first freed slot can move
+    first_start = ScheduledOperation.objects.filter(
+        work_order_id__in=list(removed),
+        end_time__gt=now
+    ).order_by('start_time').values_list('start_time', flat=True).first()
+    if first_start is None:
+        return None
+
+    repair = ScheduleRepair.from_database(max(now, first_start))
+    removed, moved = repair.repair(removed)
+
+    with transaction.atomic():
+        ScheduledOperation.objects.filter(work_order_id__in=list(removed)).delete()
+        # Rewriting the moved rows under their ids is far cheaper than a
+        # CASE per row in bulk_update
+        ScheduledOperation.objects.filter(id__in=[operation_id for operation_id, _ in moved]).delete()
+        ScheduledOperation.objects.bulk_create(
+            [
+                ScheduledOperation(
+                    id=operation_id,
+                    work_order_id=repair.operations[operation_id][0],
+                    workstation_id=repair.operations[operation_id][1],
+                    sequence_order=repair.operations[operation_id][2],
+                    start_time=repair.operations[operation_id][3],
+                    end_time=repair.operations[operation_id][4],
+                    planned_at=now
+                )
+                for operation_id, _ in moved
+            ],
+            batch_size=1000
+        )
+
+        diff = dict(
+            trigger,
+            repaired_at=now.isoformat(),
+            removed=[
+                {'work_order_id': order_id, 'reason': removed[order_id]}
+                for order_id in sorted(removed)
+            ],
+            moved=[
+                {
+                    'id': operation_id,
+                    'work_order_id': repair.operations[operation_id][0],
+                    'workstation_id': repair.operations[operation_id][1],
+                    'sequence_order': repair.operations[operation_id][2],
+                    'previous_start_time': previous_start.isoformat(),
+                    'start_time': repair.operations[operation_id][3].isoformat(),
+                    'end_time': repair.operations[operation_id][4].isoformat()
+                }
+                for operation_id, previous_start in moved
+            ]
+        )
+        WorkflowEvent.publish(EventType.SCHEDULE_REPAIRED, diff)
+    return diff
+
+
+def queue_schedule_repair(removed, trigger):
+    """
+    Hand a repair to a Celery worker, or run it here when the task queue is
+    unavailable
+
+    Args:
+        removed (dict): Order id to the reason it leaves the schedule
+        trigger (dict): What caused the repair, included in the event
+    """
+    if not removed:
+        return
+    try:
+        from .tasks import repair_production_schedule  # Import here, Celery is only needed by workers
+        # JSON would turn the order ids into strings as dict keys
+        repair_production_schedule.delay(list(removed.items()), trigger)
+    except (ImportError, BrokerUnavailable) as e:
+        logger.warning(f"Could not queue the schedule repair, repairing in process: {e}")
+        repair_schedule(removed, trigger)
+
+
+@receiver(post_save, sender=WorkStation)
+def repair_schedule_for_workstation(sender, instance, created, raw=False, **kwargs):
+    """
+    Drop the orders routed through a station that stops taking work
+    """
+    if raw or created or not instance.has_changed('status'):
+        return
+    if instance.status not in UNAVAILABLE_STATION_STATUSES:
+        return
+
+    def repair():
+        order_ids = ScheduledOperation.objects.filter(
+            workstation_id=instance.pk,
+            end_time__gt=timezone.now()
+        ).values_list('work_order_id', flat=True).distinct()
+        queue_schedule_repair(
+            {order_id: STATION_UNAVAILABLE for order_id in order_ids},
+            {'workstation_id': instance.pk, 'status': instance.status}
+        )
+
+    transaction.on_commit(repair)
+
+
+@receiver(post_save, sender=WorkOrder)
+def repair_schedule_for_work_order(sender, instance, created, raw=False, **kwargs):
+    """
+    Release the slots of a cancelled order
+    """
+    if raw or created or not instance.has_changed('status') or instance.status != 'CANCELLED':
+        return
+
+    def repair():
+        if ScheduledOperation.objects.filter(work_order_id=instance.pk, end_time__gt=timezone.now()).exists():
+            queue_schedule_repair(
+                {instance.pk: ORDER_CANCELLED},
+                {'work_order_id': instance.pk, 'status': instance.status}
+            )
+
+    transaction.on_commit(repair)
@@ -1,15 +1,17 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
 import logging
 from django.utils import timezone
 from .models import (
     WorkStation, Material, Product, ProductMaterial, WorkOrder, 
     ProductionLog, MaterialReservation, WorkstationProcess, 
     WorkstationEfficiencyMetric, ProductionDesign, ProductionEvent, 
-    ProductWorkstationSequence, Supplier, SupplierMaterial
+    ProductWorkstationSequence, Supplier, SupplierMaterial, ScheduledOperation
 )
-from .exceptions import MaterialShortageError, WorkOrderStatusTransitionError
+from .dependencies import DependencyIndex
+from .exceptions import DependencyCycleError, MaterialShortageError, WorkOrderStatusTransitionError
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -192,10 +194,15 @@ class WorkStationSerializer(serializers.ModelSerializer):
 
 class MaterialSerializer(serializers.ModelSerializer):
     status = serializers.SerializerMethodField()
+    reserved_quantity = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    available_quantity = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Material
-        fields = ['id', 'name', 'description', 'quantity', 'unit', 'reorder_level', 'cost_per_unit', 'created_at', 'status']
+        fields = [
+            'id', 'name', 'description', 'quantity', 'reserved_quantity', 'available_quantity',
+            'unit', 'reorder_level', 'cost_per_unit', 'created_at', 'status'
+        ]
         read_only_fields = ['id', 'created_at', 'status']
 
     def get_status(self, obj):
@@ -428,6 +435,25 @@ class ProductWorkstationSequenceSerializer(serializers.ModelSerializer):
             'instruction_set'
         ]
 
+class ScheduledOperationSerializer(serializers.ModelSerializer):
+    """
+    A routing step of a work order as placed by the production scheduler
+    """
+    workstation_name = serializers.CharField(source='workstation.name', read_only=True)
+
+    class Meta:
+        model = ScheduledOperation
+        fields = [
+            'id',
+            'work_order',
+            'workstation',
+            'workstation_name',
+            'sequence_order',
+            'start_time',
+            'end_time',
+            'planned_at'
+        ]
+
 class MaterialReservationSerializer(serializers.ModelSerializer):
     material_name = serializers.CharField(source='material.name', read_only=True)
     
@@ -441,7 +467,43 @@ class MaterialReservationSerializer(serializers.ModelSerializer):
             'reserved_at'
         ]
 
-class WorkOrderSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Trim serializer output with the fields= and expand= query parameters
+
+    fields=id,status limits the output to the listed fields. Fields named in
+    expandable_fields are left out of list responses unless requested through
+    expand= (or fields=), so list views skip nested payloads by default.
+    Only reads are trimmed, writes validate and return the full representation.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+
+        requested = self._split_param(request.query_params.get('fields'))
+        expanded = self._split_param(request.query_params.get('expand'))
+        view = self.context.get('view')
+        is_list = getattr(view, 'action', None) == 'list'
+
+        for field_name in list(self.fields):
+            if requested and field_name not in requested:
+                self.fields.pop(field_name)
+            elif (is_list and field_name in self.expandable_fields
+                    and field_name not in expanded and field_name not in requested):
+                self.fields.pop(field_name)
+
+    @staticmethod
+    def _split_param(value):
+        return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+
+class WorkOrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = ('material_reservations',)
+
     product_name = serializers.SerializerMethodField()
     workstation_name = serializers.CharField(source='workstation.name', read_only=True, allow_null=True)
     assigned_to_username = serializers.CharField(source='assigned_to.username', read_only=True, allow_null=True)
@@ -520,6 +582,14 @@ class WorkOrderSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({
                 "start_date": "Start date cannot be later than end date"
             })
+
+        # Reject dependency cycles before anything is written
+        dependencies = data.get('dependencies')
+        if self.instance is not None and dependencies:
+            try:
+                DependencyIndex.check_acyclic(self.instance.pk, [dependency.pk for dependency in dependencies])
+            except DependencyCycleError as e:
+                raise serializers.ValidationError({"dependencies": str(e)})
         
         return data
 
@@ -539,17 +609,18 @@ class WorkOrderSerializer(serializers.ModelSerializer):
         
         # Validate if there are enough materials to create the work order
         insufficient_materials = []
-        for product_material in product.productmaterial_set.all():
+        for product_material in product.productmaterial_set.select_related('material__stock_summary'):
             material = product_material.material
             required_quantity = product_material.quantity * quantity
+            available_quantity = material.available_quantity
             
-            if material.quantity < required_quantity:
+            if available_quantity < required_quantity:
                 insufficient_materials.append({
                     'material_name': material.name,
                     'material_id': material.id,
                     'required_quantity': required_quantity,
-                    'available_quantity': material.quantity,
-                    'shortage_percentage': (required_quantity - material.quantity) / required_quantity * 100
+                    'available_quantity': available_quantity,
+                    'shortage_percentage': (required_quantity - available_quantity) / required_quantity * 100
                 })
         
         # If there are insufficient materials, raise a detailed error
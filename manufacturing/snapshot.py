@@ -0,0 +1,206 @@
+"""
+Shared initial state for WebSocket clients
+
+The state sent to a dashboard on connect (workstations, low stock materials,
+pending work orders) is built once, kept in the cache and patched by the
+outbox relay with the same events that are broadcast to clients. Every patch
+bumps a version number and is kept as a delta, so a reconnecting client that
+remembers its last version receives only what changed since. Versions are
+only consistent across web processes on a shared cache, which the
+manufacturing.W001 check warns about.
+"""
+from django.core.cache import cache
+
+from .events import EventType
+from .models import WorkOrder, WorkStation
+from .stock_alerts import LowStockScanner
+
+SECTIONS = ('workstations', 'low_stock_materials', 'pending_work_orders')
+
+
+class InitialStateSnapshot:
+    """
+    Versioned initial state kept in the cache and maintained incrementally
+    """
+    cache_key = 'manufacturing:initial_state'
+    version_key = 'manufacturing:initial_state:version'
+    lock_key = 'manufacturing:initial_state:lock'
+    # Rebuild periodically to pick up changes that emit no event
+    timeout = 300
+    # Deltas kept for clients catching up
+    max_deltas = 500
+
+    @classmethod
+    def get(cls):
+        """
+        Cached snapshot, built from the database only when missing
+        """
+        snapshot = cache.get(cls.cache_key)
+        if snapshot is None:
+            snapshot = cls.build()
+        return snapshot
+
+    @classmethod
+    def build(cls):
+        """
+        Load the state from the database and store it under a new version
+        """
+        state = {
+            'workstations': {
+                row['id']: row
+                for row in WorkStation.objects.values('id', 'name', 'status')
+            },
+            'low_stock_materials': {
+                material_id: {
+                    'id': material_id,
+                    'name': name,
+                    'quantity': available,
+                    'reorder_level': reorder_level
+                }
+                # Includes materials the ledger has not summarized yet
+                for material_id, name, available, reorder_level in LowStockScanner.low_stock().values_list(
+                    'id', 'name', 'available_stock', 'reorder_level'
+                )
+            },
+            'pending_work_orders': {
+                row['id']: row
+                for row in WorkOrder.objects.filter(
+                    status='PENDING'
+                ).values('id', 'product__name', 'quantity')
+            },
+        }
+        snapshot = {'version': cls._next_version(), 'state': state, 'deltas': []}
+        cache.set(cls.cache_key, snapshot, cls.timeout)
+        return snapshot
+
+    @classmethod
+    def _next_version(cls):
+        # Versions keep increasing across rebuilds so old deltas never match
+        cache.add(cls.version_key, 0, None)
+        try:
+            return cache.incr(cls.version_key)
+        except ValueError:
+            cache.set(cls.version_key, 1, None)
+            return 1
+
+    @classmethod
+    def as_message(cls, since_version=None):
+        """
+        Payload for a client: deltas after since_version when they are still
+        retained, the full state otherwise
+        """
+        snapshot = cls.get()
+        deltas = snapshot['deltas']
+        oldest = deltas[0]['version'] if deltas else snapshot['version'] + 1
+        if since_version is not None and oldest - 1 <= since_version <= snapshot['version']:
+            return {
+                'type': 'initial_state_delta',
+                'version': snapshot['version'],
+                'changes': [delta for delta in deltas if delta['version'] > since_version]
+            }
+        return {
+            'type': 'initial_state',
+            'version': snapshot['version'],
+            'data': {
+                section: list(snapshot['state'][section].values())
+                for section in SECTIONS
+            }
+        }
+
+    @classmethod
+    def apply_events(cls, events):
+        """
+        Patch the cached snapshot with relayed (event_type, data) pairs
+
+        Only one process patches at a time; when another holds the lock the
+        snapshot is dropped and rebuilt on the next read instead.
+        """
+        snapshot = cache.get(cls.cache_key)
+        if snapshot is None:
+            return
+        if not cache.add(cls.lock_key, True, 5):
+            cache.delete(cls.cache_key)
+            return
+
+        try:
+            changes = []
+            for event_type, data in events:
+                changes.extend(cls._changes_for(event_type, data))
+            if not changes:
+                return
+
+            state = snapshot['state']
+            version = snapshot['version']
+            for section, op, item_id, item in changes:
+                # Skip no-op changes, a retried relay batch is applied twice
+                if op == 'upsert':
+                    current = state[section].get(item_id, {})
+                    updated = {**current, **item}
+                    if updated == current:
+                        continue
+                    state[section][item_id] = updated
+                elif state[section].pop(item_id, None) is None:
+                    continue
+                version += 1
+                snapshot['deltas'].append({
+                    'version': version,
+                    'section': section,
+                    'op': op,
+                    'id': item_id,
+                    'item': item
+                })
+
+            snapshot['deltas'] = snapshot['deltas'][-cls.max_deltas:]
+            snapshot['version'] = version
+            cache.set(cls.version_key, version, None)
+            cache.set(cls.cache_key, snapshot, cls.timeout)
+        finally:
+            cache.delete(cls.lock_key)
+
+    @staticmethod
+    def _changes_for(event_type, data):
+        """
+        Translate an event into (section, op, id, item) changes
+        """
+        if event_type == EventType.WORKSTATION_STATUS_CHANGED:
+            workstation_id = data['workstation_id']
+            return [('workstations', 'upsert', workstation_id, {
+                'id': workstation_id,
+                'name': data['name'],
+                'status': data['status']
+            })]
+
+        if event_type == EventType.MATERIAL_LOW_STOCK:
+            return [
+                ('low_stock_materials', 'upsert', material['material_id'], {
+                    'id': material['material_id'],
+                    'name': material['material_name'],
+                    'quantity': material['current_quantity'],
+                    'reorder_level': material['reorder_level']
+                })
+                for material in data.get('materials', [data])
+            ]
+
+        if event_type == EventType.MATERIAL_RESTOCKED:
+            return [
+                ('low_stock_materials', 'remove', material_id, None)
+                for material_id in data['material_ids']
+            ]
+
+        if event_type == EventType.WORK_ORDER_CREATED and data.get('status') == 'PENDING':
+            return [('pending_work_orders', 'upsert', data['work_order_id'], {
+                'id': data['work_order_id'],
+                'product__name': data['product_name'],
+                'quantity': data['quantity']
+            })]
+
+        if event_type == 'work_order.status_changed' and data['new_status'] != 'PENDING':
+            return [('pending_work_orders', 'remove', data['work_order_id'], None)]
+
+        if event_type == EventType.WORK_ORDERS_BULK_STARTED:
+            return [
+                ('pending_work_orders', 'remove', work_order_id, None)
+                for work_order_id in data['work_order_ids']
+            ]
+
+        return []
@@ -0,0 +1,104 @@
+"""
+Low stock scanner
+
+One query finds every material whose available stock (on hand less what work
+orders have reserved) is at or below its reorder level and that has not been
+alerted within the cooldown. The whole batch is announced with a single low stock event and a single
+notification payload of IDs and computed figures, and the alerted materials
+are stamped so the next scans inside the cooldown skip them.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Material, MaterialStockSummary
+
+
+class LowStockScanner:
+    """
+    Find low stock materials and alert on them at most once per cooldown
+    """
+    cooldown = timedelta(hours=24)
+    # Shortage, as a percentage of the reorder level, that makes an alert critical
+    critical_shortage = 75
+
+    @staticmethod
+    def low_stock(queryset=None):
+        """
+        Materials whose available stock is at or below their reorder level,
+        annotated with it as available_stock
+
+        Materials the ledger has not summarized yet have nothing reserved.
+        Each case is looked up through its partial index,
+        stock_summary_low_stock_idx and material_low_stock_idx.
+        """
+        queryset = Material.objects.all() if queryset is None else queryset
+        summarized = MaterialStockSummary.objects.filter(
+            available__lte=F('reorder_level')
+        ).values('material_id')
+        unsummarized = Material.objects.filter(
+            quantity__lte=F('reorder_level'), stock_summary__isnull=True
+        ).values('pk')
+        return queryset.annotate(
+            available_stock=Coalesce('stock_summary__available', 'quantity')
+        ).filter(Q(pk__in=summarized) | Q(pk__in=unsummarized))
+
+    @staticmethod
+    def refill_quantity(quantity, reorder_level):
+        """
+        Quantity that refills a material to twice its reorder level
+        """
+        return max(2 * reorder_level - quantity, Decimal('0'))
+
+    @classmethod
+    def figures(cls, material_id, name, available, reorder_level):
+        """
+        Alert figures of one material, all JSON serializable
+        """
+        shortage = reorder_level - available
+        shortage_percentage = float(shortage * 100 / reorder_level) if reorder_level > 0 else 100.0
+        return {
+            'material_id': material_id,
+            'material_name': name,
+            'current_quantity': float(available),
+            'reorder_level': float(reorder_level),
+            'shortage_percentage': round(shortage_percentage, 2),
+            'recommended_reorder_quantity': float(cls.refill_quantity(available, reorder_level))
+        }
+
+    @classmethod
+    def scan(cls, now=None):
+        """
+        Alert on low stock materials outside the cooldown
+
+        Returns:
+            dict: critical and warning lists of material figures, most short
+            first; both empty when there is nothing new to alert on
+        """
+        from .events import MaterialEventHandler  # Import here to avoid circular import
+
+        now = now or timezone.now()
+        with transaction.atomic():
+            rows = list(
+                cls.low_stock().filter(
+                    Q(low_stock_alerted_at__isnull=True) | Q(low_stock_alerted_at__lte=now - cls.cooldown)
+                ).select_for_update(skip_locked=True, of=('self',)).values_list(
+                    'id', 'name', 'available_stock', 'reorder_level'
+                )
+            )
+            materials = sorted(
+                (cls.figures(*row) for row in rows),
+                key=lambda material: (-material['shortage_percentage'], material['material_id'])
+            )
+            if materials:
+                Material.objects.filter(pk__in=[row[0] for row in rows]).update(low_stock_alerted_at=now)
+                MaterialEventHandler.handle_low_stock(materials)
+
+        return {
+            'critical': [m for m in materials if m['shortage_percentage'] >= cls.critical_shortage],
+            'warning': [m for m in materials if m['shortage_percentage'] < cls.critical_shortage]
+        }
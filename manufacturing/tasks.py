@@ -1,129 +1,73 @@
 from celery import shared_task
+from django.db import OperationalError
 from django.utils import timezone
-from .models import WorkOrder, Material, Product, ProductionLog, InventoryHealthReport
+from .models import WorkOrder, Material, Product, ProductionLog
 from .events import WorkflowEvent, EventType
-from django.db.models import F, ExpressionWrapper, FloatField, Sum, Count
-from django.db.models.functions import Max
+from django.db.models import F, Sum, Count
 from datetime import timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
-@shared_task(bind=True)
-def process_work_order_completion(self, work_order_id):
+# Work orders completed per task invocation by the batch mode
+COMPLETION_BATCH_SIZE = 100
+
+@shared_task(autoretry_for=(OperationalError,), max_retries=3, default_retry_delay=60)
+def process_work_order_completion(work_order_id):
     """
     Asynchronous task to process work order completion
     Handles:
-    - Material updates
+    - Material consumption of the reserved stock
     - Product inventory updates
     - Production logging
     - Event notifications
+
+    Safe to retry: an order that already completed is reported as a duplicate
     """
-    try:
-        work_order = WorkOrder.objects.get(id=work_order_id)
-        
-        # 1. Update Product Inventory
-        product = work_order.product
-        product.current_quantity += work_order.quantity
-        product.save()
-        
-        # 2. Update Material Consumption
-        for product_material in product.productmaterial_set.all():
-            material = product_material.material
-            consumed_quantity = product_material.quantity * work_order.quantity
-            material.quantity -= consumed_quantity
-            material.save()
-        
-        # 3. Create Production Log
-        production_log = ProductionLog.objects.create(
-            work_order=work_order,
-            workstation=work_order.workstation,
-            quantity_produced=work_order.quantity,
-            created_by=work_order.assigned_to
-        )
-        
-        # 4. Update Work Order Status
-        work_order.status = 'COMPLETED'
-        work_order.end_date = timezone.now()
-        work_order.save()
-        
-        # 5. Trigger Event Notifications
-        WorkflowEvent.dispatch_event(
-            EventType.WORK_ORDER_COMPLETED,
-            {
-                'work_order_id': work_order.id,
-                'product_name': product.name,
-                'quantity_produced': work_order.quantity,
-                'total_product_inventory': product.current_quantity
-            }
-        )
-        
-        return {
-            'status': 'success',
-            'work_order_id': work_order_id,
-            'product_name': product.name
-        }
-    
-    except WorkOrder.DoesNotExist:
-        return {
-            'status': 'error',
-            'message': f'Work Order {work_order_id} not found'
-        }
-    except Exception as e:
-        # Log the error and re-raise
-        self.retry(exc=e, max_retries=3, countdown=60)
-        return {
-            'status': 'error',
-            'message': str(e)
-        }
+    from .completion import complete_work_orders  # Import here to avoid circular import
+
+    return complete_work_orders([work_order_id])[0]
+
+@shared_task(autoretry_for=(OperationalError,), max_retries=3, default_retry_delay=60)
+def complete_work_orders_batch(work_order_ids):
+    """
+    Complete up to COMPLETION_BATCH_SIZE work orders in one transaction
+    Only transient database errors are retried; the whole batch rolls back
+    first, so a retry applies nothing twice
+    """
+    from .completion import complete_work_orders  # Import here to avoid circular import
+
+    return complete_work_orders(work_order_ids)
+
+def enqueue_work_order_completions(work_order_ids, batch_size=None):
+    """
+    Split work order ids into batches, COMPLETION_BATCH_SIZE by default, and
+    queue one task per batch
+
+    Returns:
+        list: IDs of the queued tasks
+    """
+    batch_size = batch_size or COMPLETION_BATCH_SIZE
+    work_order_ids = list(work_order_ids)
+    return [
+        complete_work_orders_batch.delay(work_order_ids[i:i + batch_size]).id
+        for i in range(0, len(work_order_ids), batch_size)
+    ]
 
 @shared_task
 def check_low_stock_materials():
     """
-    Advanced periodic task to check material stock levels
-    Sends comprehensive notifications for materials below reorder level
-    Provides detailed insights and recommendations
+    Periodic task to check material stock levels
+    Alerts once per cooldown on materials at or below their reorder level,
+    with one batched event and one notification for the whole scan
     """
-    # Fetch materials below reorder level with detailed filtering
-    low_stock_materials = Material.objects.annotate(
-        shortage_percentage=ExpressionWrapper(
-            (F('reorder_level') - F('quantity')) * 100.0 / F('reorder_level'),
-            output_field=FloatField()
-        )
-    ).filter(
-        quantity__lte=F('reorder_level')
-    ).order_by('shortage_percentage')
+    from .stock_alerts import LowStockScanner  # Import here to avoid circular import
 
-    # Track materials for different notification levels
-    critical_materials = []
-    warning_materials = []
-    
-    for material in low_stock_materials:
-        # Categorize materials based on shortage percentage
-        shortage_percentage = material.shortage_percentage
-        
-        if shortage_percentage >= 75:
-            critical_materials.append(material)
-        else:
-            warning_materials.append(material)
-        
-        # Dispatch detailed workflow events
-        WorkflowEvent.dispatch_event(
-            EventType.MATERIAL_LOW_STOCK,
-            {
-                'material_id': material.id,
-                'material_name': material.name,
-                'current_quantity': material.quantity,
-                'reorder_level': material.reorder_level,
-                'shortage_percentage': shortage_percentage,
-                'recommended_reorder_quantity': max(
-                    material.max_stock_level - material.quantity, 
-                    material.reorder_level * 2
-                )
-            }
-        )
-    
-    # Optional: Send aggregated notification
+    alert = LowStockScanner.scan()
+    critical_materials = alert['critical']
+    warning_materials = alert['warning']
+
+    # The payload holds IDs and figures only, so it serializes for the broker
     if critical_materials or warning_materials:
         send_stock_alert_notification.delay(
             critical_materials=critical_materials, 
@@ -131,15 +75,20 @@ def check_low_stock_materials():
         )
     
     return {
-        'total_low_stock_materials': len(low_stock_materials),
+        'total_low_stock_materials': len(critical_materials) + len(warning_materials),
         'critical_materials_count': len(critical_materials),
-        'warning_materials_count': len(warning_materials)
+        'warning_materials_count': len(warning_materials),
+        'material_ids': [material['material_id'] for material in critical_materials + warning_materials]
     }
 
 @shared_task
 def send_stock_alert_notification(critical_materials=None, warning_materials=None):
     """
     Send comprehensive stock alert notifications via multiple channels
+
+    Args:
+        critical_materials (list): Material figures from LowStockScanner.scan
+        warning_materials (list): Material figures from LowStockScanner.scan
     """
     critical_materials = critical_materials or []
     warning_materials = warning_materials or []
@@ -156,16 +105,18 @@ def send_stock_alert_notification(critical_materials=None, warning_materials=Non
         notification_content['body'] += "CRITICAL LOW STOCK MATERIALS:\n"
         for material in critical_materials:
             notification_content['body'] += (
-                f"- {material.name}: {material.quantity} units "
-                f"(Reorder Level: {material.reorder_level})\n"
+                f"- {material['material_name']}: {material['current_quantity']} units "
+                f"(Reorder Level: {material['reorder_level']}, "
+                f"Suggested Reorder: {material['recommended_reorder_quantity']})\n"
             )
     
     if warning_materials:
         notification_content['body'] += "\nWARNING LOW STOCK MATERIALS:\n"
         for material in warning_materials:
             notification_content['body'] += (
-                f"- {material.name}: {material.quantity} units "
-                f"(Reorder Level: {material.reorder_level})\n"
+                f"- {material['material_name']}: {material['current_quantity']} units "
+                f"(Reorder Level: {material['reorder_level']}, "
+                f"Suggested Reorder: {material['recommended_reorder_quantity']})\n"
             )
     
     # Send notifications via multiple channels
@@ -233,7 +184,7 @@ def generate_production_report(start_date=None, end_date=None):
     )
     
     # Dispatch report generation event
-    WorkflowEvent.dispatch_event(
+    WorkflowEvent.publish(
         'production.report_generated',
         {
             'start_date': str(start_date),
@@ -249,19 +200,19 @@ def generate_inventory_health_report():
     """
     Generate detailed inventory health report
     """
+    from .stock_alerts import LowStockScanner  # Import here to avoid circular import
+
     # Calculate inventory metrics
     total_materials = Material.objects.count()
-    low_stock_materials = Material.objects.filter(quantity__lte=F('reorder_level')).count()
+    low_stock_materials = LowStockScanner.low_stock().count()
     
     report = {
         'total_materials': total_materials,
         'low_stock_materials': low_stock_materials,
         'low_stock_percentage': (low_stock_materials / total_materials) * 100 if total_materials > 0 else 0,
-        'generated_at': timezone.now()
+        'generated_at': timezone.now().isoformat()
     }
-    
-    # Optional: Store report in database or send via email
-    InventoryHealthReport.objects.create(**report)
+    logger.info(f"Inventory health: {low_stock_materials} of {total_materials} materials low on stock")
     
     return report
 
@@ -277,3 +228,74 @@ def periodic_inventory_check():
     generate_inventory_health_report.delay()
     
     return low_stock_result
+
+@shared_task
+def replan_production_schedule():
+    """
+    Rebuild the finite-capacity production schedule for all open work orders
+    """
+    from .scheduling import replan  # Import here to avoid circular import
+
+    summary = replan()
+    logger.info(
+        f"Scheduled {summary['operations']} operations for {summary['work_orders']} work orders, "
+        f"{len(summary['unscheduled'])} left out"
+    )
+    return {
+        'operations': summary['operations'],
+        'work_orders': summary['work_orders'],
+        'completion': summary['completion'].isoformat(),
+        'unscheduled': summary['unscheduled']
+    }
+
+@shared_task
+def repair_production_schedule(removed, trigger):
+    """
+    Repair the stored schedule after orders lose their slots
+
+    Args:
+        removed (list): (work order id, reason) pairs
+        trigger (dict): What caused the repair, included in the event
+    """
+    from .scheduling import repair_schedule  # Import here to avoid circular import
+
+    diff = repair_schedule(dict(removed), trigger)
+    if diff is None:
+        return None
+    return {'removed': len(diff['removed']), 'moved': len(diff['moved'])}
+
+@shared_task
+def compute_reorder_suggestions():
+    """
+    Nightly job suggesting reorder points and safety stock for every material
+    from its consumption over the rolling window
+    """
+    from .reorder import ReorderPointCalculator  # Import here to avoid circular import
+
+    written = ReorderPointCalculator.compute()
+    logger.info(f"Wrote reorder suggestions for {written} materials")
+    return {'materials': written}
+
+@shared_task
+def plan_material_requirements_task():
+    """
+    Compute the material shortages of all confirmed customer orders
+    """
+    from .mrp import plan_material_requirements  # Import here to avoid circular import
+
+    plan = plan_material_requirements()
+    logger.info(
+        f"Material requirements planned for {len(plan['materials'])} materials, "
+        f"{len(plan['shortages'])} shortages"
+    )
+    return {
+        'planned_for': plan['planned_for'].isoformat(),
+        'shortages': [
+            {
+                'material_id': shortage['material_id'],
+                'date': shortage['date'].isoformat(),
+                'quantity': float(shortage['quantity'])
+            }
+            for shortage in plan['shortages']
+        ]
+    }
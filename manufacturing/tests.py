@@ -1,3 +1,1805 @@
-from django.test import TestCase
+import math
+import time
+from datetime import timedelta
+from decimal import Decimal
+from statistics import NormalDist
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from kombu.exceptions import OperationalError as BrokerUnavailable
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import tasks
+from .checks import check_shared_cache
+from .completion import complete_work_orders
+from .consumers import ManufacturingConsumer
+from .costing import CostingEngine, ProductCostCache
+from .dashboard import WorkOrderDashboardStats
+from .dependencies import DependencyIndex
+from .exceptions import DependencyCycleError, MaterialShortageError
+from .ledger import StockLedger
+from .outbox import OutboxRelay
+from .mrp import MATERIAL, PRODUCT, MaterialRequirementsPlanner
+from .models import (
+    Material, MaterialReservation, MaterialStockSummary, OutboxEvent, Product, ProductCostSummary, ProductionDailyRollup,
+    ProductionLog, ProductMaterial, ProductWorkstationSequence, ReorderSuggestion, ScheduledOperation, StockMovement,
+    Supplier, SupplierMaterial, WorkOrder, WorkStation
+)
+from .reservations import MaterialReservationEngine, bulk_start_work_orders
+from .reorder import ReorderPointCalculator
+from .replay import EventReplayBuffer
+from .rollups import ProductionRollup
+from .scheduling import (
+    DEPENDENCY_CANCELLED, DEPENDENCY_CYCLE, DEPENDENCY_UNSCHEDULED, NO_ROUTING, ORDER_CANCELLED,
+    STATION_UNAVAILABLE, ProductionScheduler, ScheduleRepair
+)
+from .serializers import WorkOrderSerializer
+from .snapshot import InitialStateSnapshot
+from .stock_alerts import LowStockScanner
+from .views import WorkOrderViewSet
+
+User = get_user_model()
+
+
+class WorkOrderListQueryCountTest(TestCase):
+    """
+    Serializing the work order list must not issue queries per row
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Bracket')
+        cls.workstation = WorkStation.objects.create(name='Laser Cutter')
+        cls.material = Material.objects.create(
+            name='Steel Sheet', unit='kg', quantity=Decimal('100000'), reorder_level=Decimal('10')
+        )
+
+    def create_work_orders(self, count):
+        work_orders = WorkOrder.objects.bulk_create([
+            WorkOrder(
+                product=self.product,
+                workstation=self.workstation if i % 2 else None,
+                quantity=Decimal('1'),
+                status='IN_PROGRESS' if i % 3 else 'PENDING'
+            )
+            for i in range(count)
+        ])
+        MaterialReservation.objects.bulk_create([
+            MaterialReservation(work_order=work_order, material=self.material, quantity_reserved=Decimal('1'))
+            for work_order in work_orders
+        ])
+        Dependency = WorkOrder.dependencies.through
+        Dependency.objects.bulk_create([
+            Dependency(from_workorder=work_order, to_workorder=work_orders[0])
+            for work_order in work_orders[1:]
+        ])
+        # Written straight to the through table, so recount
+        DependencyIndex.rebuild()
+
+    def list_queries(self):
+        view = WorkOrderViewSet(
+            request=Request(APIRequestFactory().get('/api/work-orders/')),
+            format_kwarg=None
+        )
+        queryset = view.get_queryset()
+        with CaptureQueriesContext(connection) as queries:
+            data = WorkOrderSerializer(queryset, many=True).data
+        return data, len(queries)
+
+    def test_query_count_is_constant(self):
+        self.create_work_orders(10)
+        _, small = self.list_queries()
+
+        self.create_work_orders(990)
+        data, large = self.list_queries()
+
+        self.assertEqual(len(data), 1000)
+        self.assertEqual(small, large)
+        # Work orders, dependencies and reservations with their materials
+        self.assertEqual(large, 3)
+
+    def test_can_start_matches_dependencies(self):
+        self.create_work_orders(3)
+        data, _ = self.list_queries()
+
+        first = WorkOrder.objects.order_by('id').first()
+        for row in data:
+            if row['id'] == first.id:
+                self.assertTrue(row['can_start'])
+            else:
+                self.assertEqual(row['can_start'], first.status == 'COMPLETED')
+            self.assertEqual(row['product_name'], 'Bracket')
+            self.assertEqual(len(row['material_reservations']), 1)
+
+
+class WorkOrderListFieldsTest(TestCase):
+    """
+    The work order list honours fields= and expand= and pages by cursor
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(name='Hinge')
+        material = Material.objects.create(
+            name='Aluminium Bar', unit='kg', quantity=Decimal('1000'), reorder_level=Decimal('10')
+        )
+        work_orders = WorkOrder.objects.bulk_create([
+            WorkOrder(product=product, quantity=Decimal('1')) for _ in range(5)
+        ])
+        MaterialReservation.objects.bulk_create([
+            MaterialReservation(work_order=work_order, material=material, quantity_reserved=Decimal('1'))
+            for work_order in work_orders
+        ])
+
+    def test_sparse_fields_use_a_single_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/work-orders/', {'fields': 'id,status,priority,product_name'}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()['results']
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(set(rows[0]), {'id', 'status', 'priority', 'product_name'})
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_reservations_only_when_expanded(self):
+        rows = self.client.get('/api/work-orders/').json()['results']
+        self.assertNotIn('material_reservations', rows[0])
+
+        rows = self.client.get('/api/work-orders/', {'expand': 'material_reservations'}).json()['results']
+        self.assertEqual(len(rows[0]['material_reservations']), 1)
+
+    def test_no_join_without_related_fields(self):
+        request = Request(APIRequestFactory().get('/api/work-orders/', {'fields': 'id,status'}))
+        view = WorkOrderViewSet(request=request, format_kwarg=None, action='list')
+        self.assertIs(view.get_queryset().query.select_related, False)
+
+    def test_writes_ignore_sparse_fields(self):
+        # quantity is validated even though fields= leaves it out
+        work_order = WorkOrder.objects.order_by('id').first()
+        response = self.client.patch(
+            f'/api/work-orders/{work_order.id}/?fields=id',
+            {'product': work_order.product_id, 'quantity': 'many'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.json()['field_errors'])
+
+    def test_cursor_pages_cover_every_row(self):
+        seen = []
+        url = '/api/work-orders/?page_size=2&fields=id'
+        while url:
+            page = self.client.get(url).json()
+            self.assertNotIn('count', page)
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+
+        self.assertEqual(sorted(seen), sorted(WorkOrder.objects.values_list('id', flat=True)))
+
+
+class WorkOrderDashboardStatsTest(TestCase):
+    """
+    Dashboard counters come from one aggregate and follow status changes
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(name='Flange')
+        cls.work_orders = WorkOrder.objects.bulk_create([
+            WorkOrder(product=product, quantity=Decimal('1'), status=status)
+            for status in ['PENDING', 'PENDING', 'IN_PROGRESS', 'BLOCKED']
+        ])
+        Dependency = WorkOrder.dependencies.through
+        Dependency.objects.create(from_workorder=cls.work_orders[2], to_workorder=cls.work_orders[0])
+
+    def setUp(self):
+        WorkOrderDashboardStats.invalidate()
+
+    def test_counts_in_two_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            stats = WorkOrderDashboardStats.get()
+
+        # The aggregate and the bounded dependency query
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(stats['total_work_orders'], 4)
+        self.assertEqual(stats['status_breakdown']['PENDING'], 2)
+        self.assertEqual(stats['blocked_work_orders'], 1)
+        self.assertEqual([row['id'] for row in stats['upcoming_dependencies']], [self.work_orders[2].id])
+
+        with CaptureQueriesContext(connection) as queries:
+            WorkOrderDashboardStats.get()
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_status_change_invalidates_cache(self):
+        WorkOrderDashboardStats.get()
+
+        work_order = WorkOrder.objects.get(pk=self.work_orders[3].pk)
+        work_order.status = 'PENDING'
+        with self.captureOnCommitCallbacks(execute=True):
+            work_order.save()
+
+        stats = WorkOrderDashboardStats.get()
+        self.assertEqual(stats['status_breakdown']['PENDING'], 3)
+        self.assertEqual(stats['blocked_work_orders'], 0)
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_counted_fields_deletes_and_dependencies_invalidate_cache(self):
+        cache_key = WorkOrderDashboardStats.cache_key(timezone.now().date())
+        work_order = WorkOrder.objects.get(pk=self.work_orders[1].pk)
+
+        # Fields the counters do not read keep the cached copy
+        WorkOrderDashboardStats.get()
+        work_order.blocking_reason = 'Waiting for paint'
+        with self.captureOnCommitCallbacks(execute=True):
+            work_order.save()
+        self.assertIsNotNone(cache.get(cache_key))
+
+        work_order.priority = 'CRITICAL'
+        with self.captureOnCommitCallbacks(execute=True):
+            work_order.save()
+        self.assertEqual(WorkOrderDashboardStats.get()['priority_breakdown']['CRITICAL'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            work_order.dependencies.add(self.work_orders[0])
+        self.assertEqual(len(WorkOrderDashboardStats.get()['upcoming_dependencies']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            work_order.delete()
+        self.assertEqual(WorkOrderDashboardStats.get()['total_work_orders'], 3)
+
+
+class ProductionRollupTest(TestCase):
+    """
+    Rollups follow log writes and match a rebuild from the raw logs
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Gusset')
+        cls.workstation = WorkStation.objects.create(name='Press Brake')
+        cls.work_order = WorkOrder.objects.create(product=cls.product, quantity=Decimal('10'))
+
+    def rollup_rows(self):
+        return list(
+            ProductionDailyRollup.objects.filter(log_count__gt=0).order_by(
+                'day', 'workstation_id', 'product_id'
+            ).values_list(
+                'day', 'workstation_id', 'product_id', 'log_count',
+                'quantity_produced', 'wastage', 'efficiency_total', 'efficiency_count'
+            )
+        )
+
+    def create_log(self, quantity, workstation=None):
+        return ProductionLog.objects.create(
+            work_order=self.work_order,
+            workstation=workstation,
+            quantity_produced=quantity,
+            wastage=Decimal('0.50')
+        )
+
+    def test_writes_match_rebuild(self):
+        first = self.create_log(4, self.workstation)
+        self.create_log(6, self.workstation)
+        last = self.create_log(2)
+
+        first.quantity_produced = 5
+        first.workstation = None
+        first.save()
+        last.delete()
+
+        incremental = self.rollup_rows()
+        ProductionRollup.rebuild()
+        self.assertEqual(incremental, self.rollup_rows())
+        self.assertEqual(
+            ProductionDailyRollup.objects.filter(workstation=self.workstation).get().quantity_produced, 6
+        )
+
+    def test_one_row_per_key(self):
+        self.create_log(4)
+        logs = ProductionLog.objects.bulk_create([
+            ProductionLog(work_order=self.work_order, workstation=workstation, quantity_produced=1, wastage=Decimal('0'))
+            for workstation in (None, None, self.workstation)
+        ])
+        ProductionRollup.record_many(logs, {self.work_order.id: self.product.id})
+
+        self.assertEqual(
+            [(row[1], row[3], row[4]) for row in self.rollup_rows()],
+            [(None, 3, 6), (self.workstation.id, 1, 1)]
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductionDailyRollup.objects.create(day=timezone.localdate(), product=self.product)
+
+    def test_efficiency_is_exact(self):
+        log = self.create_log(1)
+        log.work_order.quantity = Decimal('3')
+        self.assertEqual(log.calculate_efficiency(save_instance=False), Decimal('33.33'))
+        log.quantity_produced = 5
+        self.assertEqual(log.calculate_efficiency(save_instance=False), Decimal('100.00'))
+
+    def test_reads_history_from_rollups_and_today_from_logs(self):
+        old = self.create_log(3)
+        self.create_log(7)
+        yesterday = timezone.now() - timedelta(days=1)
+        ProductionLog.objects.filter(pk=old.pk).update(created_at=yesterday)
+        ProductionRollup.rebuild()
+
+        daily = ProductionRollup.daily_production()
+        self.assertEqual([row['total_quantity'] for row in daily], [3, 7])
+        self.assertEqual(daily[0]['day'].date(), timezone.localdate(yesterday))
+
+        monthly = ProductionRollup.monthly_efficiency()
+        self.assertEqual(sum(row['total_production'] for row in monthly), 10)
+        same_month = timezone.localdate(yesterday).month == timezone.localdate().month
+        self.assertEqual(monthly[-1]['avg_efficiency'], Decimal('50' if same_month else '70'))
+
+
+class CostingEngineTest(TestCase):
+    """
+    Batch costing loads the catalogue in fixed queries and costs it exactly
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        steel = Material.objects.create(
+            name='Steel Rod', unit='kg', quantity=Decimal('100'), reorder_level=Decimal('10'),
+            cost_per_unit=Decimal('2.50')
+        )
+        paint = Material.objects.create(
+            name='Paint', unit='l', quantity=Decimal('100'), reorder_level=Decimal('10')
+        )
+        welder = WorkStation.objects.create(name='Welder', hourly_operating_cost=Decimal('30.00'))
+        cls.frame = Product.objects.create(name='Frame', sell_cost=Decimal('100.00'), labor_cost=Decimal('10.00'))
+        cls.plate = Product.objects.create(name='Plate', sell_cost=Decimal('0'))
+        ProductMaterial.objects.create(product=cls.frame, material=steel, quantity=Decimal('4'))
+        ProductMaterial.objects.create(product=cls.frame, material=paint, quantity=Decimal('1'))
+        ProductWorkstationSequence.objects.create(
+            product=cls.frame, workstation=welder, sequence_order=1, estimated_time=timedelta(minutes=20)
+        )
+
+    def test_costs_catalogue_in_fixed_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            summary = CostingEngine.from_database().summary()
+        self.assertEqual(len(queries), 5)
+
+        frame, plate = summary['products']
+        self.assertEqual(summary['total_products'], 2)
+        self.assertEqual(frame['material_costs'], Decimal('10.00'))
+        self.assertEqual(frame['workstation_costs'], Decimal('10'))
+        self.assertEqual(frame['total_cost'], Decimal('30.00'))
+        self.assertEqual(frame['profit_margin'], Decimal('70'))
+        self.assertEqual(frame['profitability_category'], 'Highly Profitable')
+        self.assertEqual(
+            [line['material_total_cost'] for line in frame['material_breakdown']], [Decimal('10'), Decimal('0')]
+        )
+        self.assertEqual(plate['total_cost'], 0)
+        self.assertEqual(plate['profitability_category'], 'Loss-Making')
+
+    def test_loads_a_subset(self):
+        products = CostingEngine.from_database([self.frame.id]).product_costs()
+        self.assertEqual([product['product_name'] for product in products], ['Frame'])
+        self.assertEqual(products[0]['workstation_breakdown'][0]['estimated_time_hours'], 1 / 3)
+
+
+class ProductCostCacheTest(TestCase):
+    """
+    Cost summaries are dropped only for products whose inputs changed
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.steel = Material.objects.create(
+            name='Steel', unit='kg', quantity=Decimal('100'), reorder_level=Decimal('10'),
+            cost_per_unit=Decimal('3.00')
+        )
+        cls.copper = Material.objects.create(
+            name='Copper', unit='kg', quantity=Decimal('100'), reorder_level=Decimal('10'),
+            cost_per_unit=Decimal('8.00')
+        )
+        cls.lathe = WorkStation.objects.create(name='Lathe', hourly_operating_cost=Decimal('60.00'))
+        cls.shaft = Product.objects.create(name='Shaft', sell_cost=Decimal('50.00'))
+        cls.coil = Product.objects.create(name='Coil', sell_cost=Decimal('50.00'))
+        ProductMaterial.objects.create(product=cls.shaft, material=cls.steel, quantity=Decimal('2'))
+        ProductMaterial.objects.create(product=cls.coil, material=cls.copper, quantity=Decimal('1'))
+        ProductWorkstationSequence.objects.create(
+            product=cls.coil, workstation=cls.lathe, sequence_order=1, estimated_time=timedelta(minutes=30)
+        )
+
+    def cached_ids(self):
+        return set(ProductCostSummary.objects.values_list('product_id', flat=True))
+
+    def test_material_price_invalidates_only_its_products(self):
+        ProductCostCache.refresh()
+        self.steel.cost_per_unit = Decimal('4.00')
+        self.steel.save()
+        self.assertEqual(self.cached_ids(), {self.coil.id})
+
+        self.steel.quantity = Decimal('90')
+        self.steel.save()
+        self.assertEqual(self.cached_ids(), {self.coil.id})
+
+        self.assertEqual(ProductCostCache.summaries()[self.shaft.id].material_cost, Decimal('8.00'))
+
+    def test_routing_and_rate_changes_invalidate(self):
+        ProductCostCache.refresh()
+        self.lathe.hourly_operating_cost = Decimal('80.00')
+        self.lathe.save()
+        self.assertEqual(self.cached_ids(), {self.shaft.id})
+
+        ProductCostCache.refresh()
+        ProductWorkstationSequence.objects.create(
+            product=self.shaft, workstation=self.lathe, sequence_order=1, estimated_time=timedelta(hours=1)
+        )
+        self.assertEqual(self.cached_ids(), {self.coil.id})
+
+    def test_profitability_reads_match_engine(self):
+        ProductCostCache.refresh()
+        with CaptureQueriesContext(connection) as queries:
+            cached = ProductCostCache.profitability()
+        # Missing summaries check, summaries and products
+        self.assertEqual(len(queries), 3)
+
+        computed = CostingEngine.from_database().summary()
+        self.assertEqual(cached['total_cost'], computed['total_cost'])
+        self.assertEqual(
+            [product['profit_margin'] for product in cached['products']],
+            [product['profit_margin'] for product in computed['products']]
+        )
+
+
+class CostAnalyticsTest(TestCase):
+    """
+    Work order costs scale with quantity and honour filters and paging
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='analyst', password='secret')
+        steel = Material.objects.create(
+            name='Steel', unit='kg', quantity=Decimal('100'), reorder_level=Decimal('10'),
+            cost_per_unit=Decimal('2.00')
+        )
+        paint = Material.objects.create(
+            name='Paint', unit='l', quantity=Decimal('100'), reorder_level=Decimal('10'),
+            cost_per_unit=Decimal('5.00')
+        )
+        cls.gate = Product.objects.create(name='Gate')
+        cls.rail = Product.objects.create(name='Rail')
+        ProductMaterial.objects.create(product=cls.gate, material=steel, quantity=Decimal('3'))
+        ProductMaterial.objects.create(product=cls.gate, material=paint, quantity=Decimal('1'))
+        ProductMaterial.objects.create(product=cls.rail, material=steel, quantity=Decimal('1'))
+        WorkOrder.objects.create(product=cls.gate, quantity=Decimal('4'))
+        WorkOrder.objects.create(product=cls.gate, quantity=Decimal('1'))
+        WorkOrder.objects.create(product=cls.rail, quantity=Decimal('10'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cost_multiplies_quantity(self):
+        data = self.client.get('/api/analytics/cost/').json()
+
+        # Gate costs 11.00 per unit, rail 2.00
+        self.assertEqual(Decimal(str(data['work_order_cost']['total_cost'])), Decimal('75'))
+        self.assertEqual(Decimal(str(data['work_order_cost']['avg_cost'])), Decimal('25'))
+        self.assertEqual(
+            sorted(Decimal(str(row['estimated_material_cost'])) for row in data['work_order_cost_analysis']),
+            [Decimal('11'), Decimal('20'), Decimal('44')]
+        )
+
+    def test_filters_and_pages(self):
+        data = self.client.get('/api/analytics/cost/', {'product': self.gate.id, 'page_size': 1}).json()
+        self.assertEqual(Decimal(str(data['work_order_cost']['total_cost'])), Decimal('55'))
+        self.assertEqual(len(data['work_order_cost_analysis']), 1)
+        self.assertIsNotNone(data['next'])
+
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        data = self.client.get('/api/analytics/cost/', {'start_date': tomorrow}).json()
+        self.assertEqual(data['work_order_cost_analysis'], [])
+
+        response = self.client.get('/api/analytics/cost/', {'end_date': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductionSchedulerTest(TestCase):
+    """
+    List scheduling respects station capacity, routings and dependencies
+    """
+    origin = timezone.now()
+
+    def scheduler(self, orders, dependencies=(), stations=((1, 'ACTIVE'), (2, 'ACTIVE'))):
+        routings = [
+            (10, 1, 1, timedelta(minutes=30)),
+            (10, 2, 2, timedelta(minutes=10)),
+            (20, 1, 2, timedelta(minutes=20)),
+        ]
+        return ProductionScheduler(
+            [
+                (order_id, product_id, Decimal(quantity), priority, self.origin + timedelta(seconds=order_id))
+                for order_id, product_id, quantity, priority in orders
+            ],
+            routings,
+            stations,
+            dependencies,
+            self.origin
+        )
+
+    def test_stations_run_one_operation_at_a_time(self):
+        scheduler = self.scheduler([(1, 10, '2', 'MEDIUM'), (2, 10, '1', 'MEDIUM'), (3, 20, '3', 'LOW')])
+        operations = scheduler.plan()
+
+        self.assertEqual(len(operations), 5)
+        for workstation_id in (1, 2):
+            slots = sorted((start, end) for _, _, ws, start, end in operations if ws == workstation_id)
+            for (_, end), (start, _) in zip(slots, slots[1:]):
+                self.assertLessEqual(end, start)
+
+        steps = {(order_id, sequence): (start, end) for order_id, sequence, _, start, end in operations}
+        self.assertLessEqual(steps[(1, 1)][1], steps[(1, 2)][0])
+        self.assertEqual(steps[(1, 1)], (0, 3600))
+
+    def test_priority_and_dependencies(self):
+        scheduler = self.scheduler(
+            [(1, 10, '1', 'LOW'), (2, 10, '1', 'CRITICAL'), (3, 20, '1', 'CRITICAL')],
+            dependencies=[(3, 1, 'PENDING')]
+        )
+        steps = {(order_id, sequence): (start, end) for order_id, sequence, _, start, end in scheduler.plan()}
+
+        self.assertEqual(steps[(2, 1)][0], 0)
+        self.assertGreaterEqual(steps[(3, 1)][0], steps[(1, 2)][1])
+
+    def test_unavailable_stations_and_cycles_are_reported(self):
+        scheduler = self.scheduler(
+            [(1, 10, '1', 'MEDIUM'), (2, 20, '1', 'MEDIUM'), (3, 20, '1', 'MEDIUM'),
+             (4, 20, '1', 'MEDIUM'), (5, 30, '1', 'MEDIUM')],
+            dependencies=[(3, 4, 'PENDING'), (4, 3, 'PENDING'), (2, 1, 'PENDING')],
+            stations=((1, 'MAINTENANCE'), (2, 'ACTIVE'))
+        )
+        self.assertEqual(scheduler.plan(), [])
+        self.assertEqual(scheduler.unscheduled, {
+            1: STATION_UNAVAILABLE,
+            2: DEPENDENCY_UNSCHEDULED,
+            3: DEPENDENCY_CYCLE,
+            4: DEPENDENCY_CYCLE,
+            5: NO_ROUTING,
+        })
+
+    def test_replans_five_thousand_orders_quickly(self):
+        stations = [(workstation_id, 'ACTIVE') for workstation_id in range(50)]
+        routings = [
+            (product_id, step, (product_id * 7 + step * 3) % 50, timedelta(minutes=5 + step))
+            for product_id in range(200)
+            for step in range(5)
+        ]
+        orders = [
+            (order_id, order_id % 200, Decimal('3'), WorkOrder.PRIORITY_CHOICES[order_id % 4][0],
+             self.origin + timedelta(seconds=order_id))
+            for order_id in range(5000)
+        ]
+        dependencies = [(order_id, order_id - 7, 'PENDING') for order_id in range(7, 5000, 3)]
+
+        started = time.perf_counter()
+        operations = ProductionScheduler(orders, routings, stations, dependencies, self.origin).plan()
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(operations), 25000)
+        self.assertLess(elapsed, 3)
+
+    def test_replan_endpoint_stores_schedule(self):
+        product = Product.objects.create(name='Bracket')
+        press = WorkStation.objects.create(name='Press')
+        ProductWorkstationSequence.objects.create(
+            product=product, workstation=press, sequence_order=1, estimated_time=timedelta(minutes=15)
+        )
+        work_order = WorkOrder.objects.create(product=product, quantity=Decimal('4'))
+
+        summary = self.client.post('/api/production-schedule/replan/').json()
+        self.assertEqual(summary['operations'], 1)
+
+        operation = ScheduledOperation.objects.get()
+        self.assertEqual(operation.end_time - operation.start_time, timedelta(hours=1))
+        self.assertEqual(work_order.calculate_estimated_completion(), operation.end_time)
+
+        rows = self.client.get('/api/production-schedule/', {'workstation': press.id}).json()['results']
+        self.assertEqual(rows[0]['workstation_name'], 'Press')
+
+    def test_async_replan_runs_the_task(self):
+        product = Product.objects.create(name='Hinge')
+        press = WorkStation.objects.create(name='Press')
+        ProductWorkstationSequence.objects.create(
+            product=product, workstation=press, sequence_order=1, estimated_time=timedelta(minutes=30)
+        )
+        WorkOrder.objects.create(product=product, quantity=Decimal('2'))
+
+        task = tasks.replan_production_schedule
+        queued = []
+        with mock.patch.object(task, 'delay', side_effect=lambda: queued.append(task.apply()) or queued[-1]):
+            response = self.client.post('/api/production-schedule/replan/', {'async': True}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['task_id'], queued[0].id)
+        self.assertEqual(queued[0].get()['operations'], 1)
+        operation = ScheduledOperation.objects.get()
+        self.assertEqual(operation.end_time - operation.start_time, timedelta(hours=1))
+
+        summary = task.apply().get()
+        self.assertEqual((summary['operations'], summary['work_orders'], summary['unscheduled']), (1, 1, []))
+
+        with mock.patch.object(task, 'delay', side_effect=BrokerUnavailable('Connection refused')):
+            response = self.client.post('/api/production-schedule/replan/', {'async': True}, content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+
+
+class ScheduleRepairTest(TestCase):
+    """
+    Repairs drop the affected orders and only pull later operations forward
+    """
+    now = timezone.now().replace(microsecond=0)
+
+    def at(self, minutes):
+        return self.now + timedelta(minutes=minutes)
+
+    def repair(self):
+        rows = [
+            (1, 1, 1, 1, self.at(30), self.at(90)),
+            (2, 2, 1, 1, self.at(90), self.at(150)),
+            (3, 2, 2, 2, self.at(150), self.at(180)),
+            (4, 3, 2, 1, self.at(180), self.at(210)),
+            (5, 4, 3, 1, self.at(210), self.at(270)),
+            (6, 5, 3, 1, self.at(30), self.at(60)),
+        ]
+        return ScheduleRepair(rows, [(4, 2), (6, 1)], self.now)
+
+    def test_cancelled_order_pulls_downstream_operations_forward(self):
+        repair = self.repair()
+        removed, moved = repair.repair({1: ORDER_CANCELLED})
+
+        self.assertEqual(removed, {1: ORDER_CANCELLED, 6: DEPENDENCY_CANCELLED})
+        self.assertEqual([operation_id for operation_id, _ in moved], [2, 3, 4, 5])
+        times = {operation_id: tuple(repair.operations[operation_id][3:]) for operation_id in range(2, 7)}
+        self.assertEqual(times[2], (self.now, self.at(60)))
+        self.assertEqual(times[3], (self.at(60), self.at(90)))
+        self.assertEqual(times[4], (self.at(90), self.at(120)))
+        # Waits for order 2 even though its station frees up earlier
+        self.assertEqual(times[5], (self.at(90), self.at(150)))
+        self.assertEqual(times[6], (self.at(30), self.at(60)))
+
+    def test_started_operations_stay_put(self):
+        repair = self.repair()
+        repair.since = self.at(100)
+        _, moved = repair.repair({1: ORDER_CANCELLED})
+
+        self.assertEqual(moved, [])
+        self.assertEqual(repair.operations[2][3], self.at(90))
+
+    def schedule_two_orders(self):
+        saw, press = WorkStation.objects.create(name='Saw'), WorkStation.objects.create(name='Press')
+        bracket, plate = Product.objects.create(name='Bracket'), Product.objects.create(name='Plate')
+        for product, sequence_order, workstation in ((bracket, 1, saw), (bracket, 2, press), (plate, 1, saw)):
+            ProductWorkstationSequence.objects.create(
+                product=product, workstation=workstation, sequence_order=sequence_order,
+                estimated_time=timedelta(minutes=30)
+            )
+        first = WorkOrder.objects.create(product=bracket, quantity=Decimal('2'), priority='HIGH')
+        second = WorkOrder.objects.create(product=plate, quantity=Decimal('1'))
+        self.client.post('/api/production-schedule/replan/')
+        return press, first, second
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_station_maintenance_repairs_stored_schedule(self):
+        press, first, second = self.schedule_two_orders()
+        before = ScheduledOperation.objects.get(work_order=second).start_time
+
+        task = tasks.repair_production_schedule
+        with mock.patch.object(task, 'delay', side_effect=lambda *args: task.apply(args=args)) as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/workstations/{press.id}/update_status/', {'status': 'MAINTENANCE'})
+        delay.assert_called_once_with(
+            [(first.id, STATION_UNAVAILABLE)], {'workstation_id': press.id, 'status': 'MAINTENANCE'}
+        )
+
+        self.assertFalse(ScheduledOperation.objects.filter(work_order=first).exists())
+        after = ScheduledOperation.objects.get(work_order=second).start_time
+        self.assertLess(after, before)
+
+        event = OutboxEvent.objects.get(event_type='schedule.repaired')
+        self.assertEqual(event.payload['removed'], [{'work_order_id': first.id, 'reason': STATION_UNAVAILABLE}])
+        self.assertEqual([operation['work_order_id'] for operation in event.payload['moved']], [second.id])
+        self.assertIn('production', event.groups)
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_cancellation_is_repaired_in_process_without_a_queue(self):
+        _, first, second = self.schedule_two_orders()
+
+        with mock.patch.object(
+            tasks.repair_production_schedule, 'delay', side_effect=BrokerUnavailable('Connection refused')
+        ), self.captureOnCommitCallbacks(execute=True):
+            first.status = 'CANCELLED'
+            first.save()
+        self.assertFalse(ScheduledOperation.objects.filter(work_order=first).exists())
+        self.assertTrue(OutboxEvent.objects.filter(event_type='schedule.repaired').exists())
+
+        # Nothing scheduled for the order, nothing to queue
+        with mock.patch.object(tasks.repair_production_schedule, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            ScheduledOperation.objects.filter(work_order=second).delete()
+            second.status = 'CANCELLED'
+            second.save()
+        delay.assert_not_called()
+
+
+class DependencyIndexTest(TestCase):
+    """
+    Unfinished dependency counts follow writes and cycles are rejected
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Hinge')
+
+    def create(self, count, **kwargs):
+        return [WorkOrder.objects.create(product=self.product, quantity=Decimal('1'), **kwargs) for _ in range(count)]
+
+    def counts(self, work_orders):
+        return [
+            WorkOrder.objects.get(pk=work_order.pk).unfinished_dependencies
+            for work_order in work_orders
+        ]
+
+    def test_counts_follow_dependencies_and_completion(self):
+        cut, weld, paint = self.create(3)
+        paint.dependencies.add(cut, weld)
+        self.assertEqual(paint.unfinished_dependencies, 2)
+        self.assertFalse(paint.can_start())
+
+        cut.status = 'COMPLETED'
+        cut.save()
+        self.assertEqual(self.counts([paint]), [1])
+
+        # A stale copy saved later keeps the index's count
+        stale = WorkOrder.objects.get(pk=paint.pk)
+        weld.dependent_orders.remove(paint)
+        stale.notes = 'Edited'
+        stale.save()
+        self.assertEqual(self.counts([paint]), [0])
+
+        weld.dependent_orders.add(paint)
+        self.assertEqual(self.counts([paint]), [1])
+        weld.delete()
+        self.assertEqual(self.counts([paint]), [0])
+
+        paint.dependencies.add(*self.create(1))
+        paint.dependencies.clear()
+        self.assertEqual(paint.unfinished_dependencies, 0)
+        self.assertEqual(self.counts([paint]), [0])
+
+    def test_cycles_are_rejected(self):
+        first, second, third = self.create(3)
+        second.dependencies.add(first)
+        third.dependencies.add(second)
+
+        for add in (
+            lambda: first.dependencies.add(third),
+            lambda: third.dependent_orders.add(first),
+            lambda: first.dependencies.add(first)
+        ):
+            with self.assertRaises(DependencyCycleError), transaction.atomic():
+                add()
+        self.assertFalse(first.dependencies.exists())
+
+        response = self.client.patch(
+            f'/api/work-orders/{first.id}/',
+            {'product': self.product.id, 'quantity': '1', 'dependencies': [third.id]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_ready_queue(self):
+        low, critical, waiting = self.create(3)
+        critical.priority = 'CRITICAL'
+        critical.save()
+        waiting.dependencies.add(low)
+        self.create(1, status='IN_PROGRESS')
+
+        rows = self.client.get('/api/work-orders/ready/').json()['results']
+        self.assertEqual([row['id'] for row in rows], [critical.id, low.id])
+
+        low.status = 'COMPLETED'
+        low.save()
+        rows = self.client.get('/api/work-orders/ready/', {'fields': 'id,can_start'}).json()['results']
+        self.assertEqual(rows, [{'id': critical.id, 'can_start': True}, {'id': waiting.id, 'can_start': True}])
+
+    def test_rebuild_matches_maintained_counts(self):
+        work_orders = self.create(4)
+        work_orders[3].dependencies.add(*work_orders[:3])
+        work_orders[2].dependencies.add(work_orders[0])
+        work_orders[0].status = 'COMPLETED'
+        work_orders[0].save()
+        maintained = self.counts(work_orders)
+
+        WorkOrder.objects.update(unfinished_dependencies=0)
+        DependencyIndex.rebuild()
+        self.assertEqual(self.counts(work_orders), maintained)
+        self.assertEqual(maintained, [0, 0, 0, 2])
+
+
+class CompletionPipelineTest(TestCase):
+    """
+    Batched completion applies every delta once and skips repeats
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.steel = Material.objects.create(
+            name='Steel', unit='KG', quantity=Decimal('100'), reorder_level=Decimal('10'), cost_per_unit=Decimal('3')
+        )
+        cls.frame = Product.objects.create(name='Frame', current_quantity=0, restock_level=5)
+        ProductMaterial.objects.create(product=cls.frame, material=cls.steel, quantity=Decimal('2'))
+        cls.station = WorkStation.objects.create(name='Press')
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_batch_completion_is_applied_once(self):
+        first, second = [
+            WorkOrder.objects.create(
+                product=self.frame, quantity=Decimal(quantity), workstation=self.station, status='READY'
+            )
+            for quantity in ('3', '4')
+        ]
+        waiting = WorkOrder.objects.create(product=self.frame, quantity=Decimal('1'))
+        waiting.dependencies.add(first)
+        self.assertEqual(
+            [result['status'] for result in bulk_start_work_orders([first.id, second.id])], ['admitted', 'admitted']
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            results = complete_work_orders([first.id, second.id, waiting.id])
+        self.assertEqual([result['status'] for result in results], ['completed', 'completed', 'rejected'])
+
+        self.steel.refresh_from_db()
+        summary = MaterialStockSummary.objects.get(material=self.steel)
+        self.assertEqual(self.steel.quantity, Decimal('86'))
+        self.assertEqual((summary.on_hand, summary.reserved), (Decimal('86'), Decimal('0')))
+        self.assertFalse(MaterialReservation.objects.exists())
+
+        self.frame.refresh_from_db()
+        self.assertEqual((self.frame.current_quantity, self.frame.stock_status), (7, 'IN_STOCK'))
+        rollup = ProductionDailyRollup.objects.get(product=self.frame)
+        self.assertEqual((rollup.log_count, rollup.quantity_produced), (2, 7))
+        self.assertEqual(WorkOrder.objects.get(pk=waiting.pk).unfinished_dependencies, 0)
+        self.assertEqual(OutboxEvent.objects.filter(event_type='work_order.bulk_completed').count(), 1)
+
+        # Retrying the same batch finds the completion records and writes nothing
+        results = complete_work_orders([second.id, first.id])
+        self.assertEqual([result['status'] for result in results], ['duplicate', 'duplicate'])
+        self.frame.refresh_from_db()
+        self.assertEqual(self.frame.current_quantity, 7)
+        self.assertEqual(ProductionLog.objects.count(), 2)
+        self.assertEqual(OutboxEvent.objects.filter(event_type='work_order.bulk_completed').count(), 1)
+
+    def in_progress(self, count):
+        return [
+            WorkOrder.objects.create(
+                product=self.frame, quantity=Decimal('1'), workstation=self.station, status='IN_PROGRESS'
+            )
+            for _ in range(count)
+        ]
+
+    @staticmethod
+    def run_eagerly(task):
+        return mock.patch.object(task, 'delay', side_effect=lambda *args: task.apply(args=args))
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_batch_task_completes_and_is_safe_to_retry(self):
+        work_orders = self.in_progress(2)
+        ids = [work_order.id for work_order in work_orders]
+
+        results = tasks.complete_work_orders_batch.apply(args=(ids,)).get()
+        self.assertEqual([result['status'] for result in results], ['completed', 'completed'])
+        results = tasks.complete_work_orders_batch.apply(args=(ids,)).get()
+        self.assertEqual([result['status'] for result in results], ['duplicate', 'duplicate'])
+        self.assertEqual(tasks.process_work_order_completion.apply(args=(ids[0],)).get()['status'], 'duplicate')
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_async_bulk_complete_queues_one_task_per_batch(self):
+        work_orders = self.in_progress(5)
+        with self.run_eagerly(tasks.complete_work_orders_batch) as delay, \
+                mock.patch.object(tasks, 'COMPLETION_BATCH_SIZE', 2):
+            response = self.client.post(
+                '/api/work-orders/bulk-complete/',
+                {'work_order_ids': [work_order.id for work_order in work_orders], 'async': True},
+                content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(response.json()['task_ids']), 3)
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [2, 2, 1])
+        self.assertEqual(WorkOrder.objects.filter(status='COMPLETED').count(), 5)
+
+    def test_async_bulk_complete_without_broker_is_unavailable(self):
+        work_order, = self.in_progress(1)
+        with mock.patch.object(
+            tasks.complete_work_orders_batch, 'delay', side_effect=BrokerUnavailable('Connection refused')
+        ):
+            response = self.client.post(
+                '/api/work-orders/bulk-complete/',
+                {'work_order_ids': [work_order.id], 'async': True},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('unavailable', response.json()['error'])
+        self.assertEqual(WorkOrder.objects.get(pk=work_order.pk).status, 'IN_PROGRESS')
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_fractional_quantity_is_rejected(self):
+        whole, fractional = [
+            WorkOrder.objects.create(
+                product=self.frame, quantity=Decimal(quantity), workstation=self.station, status='IN_PROGRESS'
+            )
+            for quantity in ('6.00', '2.5')
+        ]
+
+        results = complete_work_orders([whole.id, fractional.id])
+        self.assertEqual(results[0]['status'], 'completed')
+        self.assertEqual(results[1], {
+            'work_order_id': fractional.id,
+            'status': 'rejected',
+            'reason': 'Quantity 2.50 is not a whole number of units'
+        })
+        self.assertEqual(WorkOrder.objects.get(pk=fractional.pk).status, 'IN_PROGRESS')
+        self.assertEqual(list(ProductionLog.objects.values_list('work_order_id', 'quantity_produced')), [(whole.id, 6)])
+
+        # The restock bypasses Product.save but still reports the status change
+        self.frame.refresh_from_db()
+        self.assertEqual((self.frame.current_quantity, self.frame.stock_status), (6, 'IN_STOCK'))
+        event = OutboxEvent.objects.get(event_type='product.status_changed')
+        self.assertEqual(
+            (event.payload['product_id'], event.payload['old_status'], event.payload['new_status']),
+            (self.frame.id, 'OUT_OF_STOCK', 'IN_STOCK')
+        )
+
+
+class LowStockScannerTest(TestCase):
+    """
+    One scan alerts on every low material once per cooldown
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.materials = {
+            name: Material.objects.create(
+                name=name, unit='KG', quantity=Decimal(quantity), reorder_level=Decimal('20')
+            )
+            for name, quantity in (('Steel', '2'), ('Paint', '15'), ('Bolts', '50'), ('Wire', '30'))
+        }
+        # Wire has 30 on hand but only 12 available
+        work_order = WorkOrder.objects.create(product=Product.objects.create(name='Fence'), quantity=Decimal('1'))
+        StockLedger.record([StockMovement(
+            material=cls.materials['Wire'], movement_type='RESERVE', quantity=Decimal('18'), work_order=work_order
+        )])
+
+    def test_scan_batches_and_respects_cooldown(self):
+        now = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            alert = LowStockScanner.scan(now)
+        # One select, one stamp and one outbox insert
+        self.assertEqual(len([q for q in queries if 'SAVEPOINT' not in q['sql']]), 3)
+        self.assertEqual([m['material_name'] for m in alert['critical']], ['Steel'])
+        self.assertEqual([m['material_name'] for m in alert['warning']], ['Wire', 'Paint'])
+        self.assertEqual(alert['critical'][0]['recommended_reorder_quantity'], 38.0)
+        self.assertEqual(alert['warning'][0]['current_quantity'], 12.0)
+        self.assertEqual(alert['warning'][0]['recommended_reorder_quantity'], 28.0)
+        event = OutboxEvent.objects.filter(event_type='material.low_stock').latest('id')
+        self.assertEqual(len(event.payload['materials']), 3)
+
+        self.assertEqual(LowStockScanner.scan(now + timedelta(hours=1)), {'critical': [], 'warning': []})
+        alert = LowStockScanner.scan(now + LowStockScanner.cooldown)
+        self.assertEqual(len(alert['critical']) + len(alert['warning']), 3)
+
+        response = self.client.get('/api/materials/low_stock/')
+        self.assertEqual(sorted(row['name'] for row in response.json()), ['Paint', 'Steel', 'Wire'])
+
+    def test_stale_save_keeps_the_alert_stamp(self):
+        stale = Material.objects.get(pk=self.materials['Steel'].pk)
+        now = timezone.now()
+        LowStockScanner.scan(now)
+
+        stale.name = 'Mild steel'
+        stale.save()
+        stale.quantity = Decimal('1')
+        stale.save()
+        self.assertEqual(Material.objects.get(pk=stale.pk).low_stock_alerted_at, now)
+        self.assertEqual(LowStockScanner.scan(now + timedelta(hours=1)), {'critical': [], 'warning': []})
+
+    def test_reorder_level_edits_reach_the_summary(self):
+        bolts = self.materials['Bolts']
+        bolts.reorder_level = Decimal('60')
+        bolts.save()
+        self.assertEqual(MaterialStockSummary.objects.get(material=bolts).reorder_level, Decimal('60'))
+        self.assertIn(bolts.id, LowStockScanner.low_stock().values_list('id', flat=True))
+
+    def test_unsummarized_material_falls_back_to_quantity(self):
+        MaterialStockSummary.objects.filter(material=self.materials['Paint']).delete()
+        self.assertEqual(
+            sorted(LowStockScanner.low_stock().values_list('name', 'available_stock')),
+            [('Paint', Decimal('15')), ('Steel', Decimal('2')), ('Wire', Decimal('12'))]
+        )
+
+
+class ReorderPointCalculatorTest(TestCase):
+    """
+    Suggestions follow consumption, wastage and supplier lead time
+    """
+
+    def test_suggestions_from_consumption_history(self):
+        now = timezone.now()
+        steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('100'), reorder_level=Decimal('10'))
+        idle = Material.objects.create(name='Rivets', unit='PCS', quantity=Decimal('5'), reorder_level=Decimal('1'))
+        frame = Product.objects.create(name='Frame')
+        ProductMaterial.objects.create(product=frame, material=steel, quantity=Decimal('3'))
+        work_order = WorkOrder.objects.create(product=frame, quantity=Decimal('5'))
+        for name, lead_time, preferred in (('Acme', 4, True), ('Quick', 2, False)):
+            supplier = Supplier.objects.create(name=name, email=f'{name.lower()}@example.com')
+            SupplierMaterial.objects.create(
+                supplier=supplier, material=steel, typical_lead_time=lead_time, is_preferred_supplier=preferred
+            )
+
+        for days_ago, quantity in ((1, '10'), (3, '30')):
+            movement = StockMovement.objects.create(material=steel, movement_type='CONSUME', quantity=Decimal(quantity))
+            StockMovement.objects.filter(pk=movement.pk).update(created_at=now - timedelta(days=days_ago))
+        log = ProductionLog.objects.create(work_order=work_order, quantity_produced=5, wastage=Decimal('2'))
+        ProductionLog.objects.filter(pk=log.pk).update(created_at=now - timedelta(days=1))
+
+        self.assertEqual(ReorderPointCalculator.compute(now=now, window_days=10), 2)
+
+        suggestion = ReorderSuggestion.objects.get(material=steel)
+        # Daily demand 16 (10 consumed + 2 wasted * 3 per unit) and 30 over 10 days
+        deviation = math.sqrt((16 ** 2 + 30 ** 2 - 46 * 4.6) / 9)
+        expected = 4.6 * 4 + NormalDist().inv_cdf(0.95) * deviation * 2
+        self.assertEqual(suggestion.demand_rate, Decimal('4.6'))
+        self.assertEqual(suggestion.lead_time_days, 4)
+        self.assertAlmostEqual(float(suggestion.reorder_point), expected, places=2)
+        self.assertEqual(suggestion.explain['wasted'], 6.0)
+        self.assertEqual(suggestion.explain['lead_time_source'], 'supplier')
+
+        idle_suggestion = ReorderSuggestion.objects.get(material=idle)
+        self.assertEqual((idle_suggestion.reorder_point, idle_suggestion.lead_time_days), (Decimal('0'), 7))
+
+        # A rerun updates the rows in place
+        ReorderPointCalculator.compute(now=now, window_days=10)
+        self.assertEqual(ReorderSuggestion.objects.count(), 2)
+
+
+class MaterialRequirementsPlannerTest(TestCase):
+    """
+    Demand explodes through every BOM level and nets against supply by date
+    """
+
+    def test_time_phased_shortages(self):
+        today = timezone.localdate()
+        later = today + timedelta(days=5)
+        bom = {
+            # Frame needs 2 of steel and 1 bracket sub-assembly of 3 of steel and 4 bolts
+            (PRODUCT, 1): {(MATERIAL, 10): Decimal('2'), (PRODUCT, 2): Decimal('1')},
+            (PRODUCT, 2): {(MATERIAL, 10): Decimal('3'), (MATERIAL, 11): Decimal('4')},
+        }
+        planner = MaterialRequirementsPlanner(
+            bom,
+            available={10: Decimal('30'), 11: Decimal('100')},
+            receipts={10: {later: Decimal('20')}}
+        )
+        self.assertEqual(planner.explode({1: 2}), {10: Decimal('10'), 11: Decimal('8')})
+
+        plan = planner.plan({None: {1: 4}, later: {1: 6, 2: 5}}, today)
+        # Steel: 20 today from 30, then 30 + 15 on day 5 against the 10 left and 20 arriving
+        self.assertEqual(plan['shortages'], [{'material_id': 10, 'date': later, 'quantity': Decimal('15')}])
+        steel = plan['materials'][10]
+        self.assertEqual(
+            (steel['gross_requirement'], steel['net_requirement'], steel['on_order'], steel['first_shortage_date']),
+            (Decimal('65'), Decimal('15'), Decimal('20'), later)
+        )
+        self.assertEqual(plan['materials'][11]['net_requirement'], Decimal('0'))
+
+    def test_explodes_three_levels(self):
+        bom = {
+            # Gate: 2 frames and 6 bolts; frame: 1 bracket and 4 steel; bracket: 3 steel and 2 bolts
+            (PRODUCT, 1): {(PRODUCT, 2): Decimal('2'), (MATERIAL, 11): Decimal('6')},
+            (PRODUCT, 2): {(PRODUCT, 3): Decimal('1'), (MATERIAL, 10): Decimal('4')},
+            (PRODUCT, 3): {(MATERIAL, 10): Decimal('3'), (MATERIAL, 11): Decimal('2')},
+        }
+        planner = MaterialRequirementsPlanner(bom, available={})
+        self.assertEqual(planner.explode({1: 3}), {10: Decimal('42'), 11: Decimal('30')})
+        # Demand for a sub-assembly explodes from its own level
+        self.assertEqual(planner.explode({2: 1, 3: 1}), {10: Decimal('10'), 11: Decimal('4')})
+
+        # A BOM containing itself stops after MAX_BOM_LEVELS
+        looping = MaterialRequirementsPlanner({
+            (PRODUCT, 1): {(PRODUCT, 1): Decimal('1'), (MATERIAL, 10): Decimal('1')}
+        }, available={})
+        self.assertEqual(looping.explode({1: 1}), {10: Decimal('25')})
+
+    @override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+    def test_plans_from_database_without_the_orders_app(self):
+        from inventory.models import MaterialOrder, MaterialOrderItem
+
+        steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('10'), reorder_level=Decimal('1'))
+        frame = Product.objects.create(name='Frame')
+        ProductMaterial.objects.create(product=frame, material=steel, quantity=Decimal('4'))
+        order = MaterialOrder.objects.create(order_number='PO-1', status='ORDERED', total_cost=Decimal('0'))
+        MaterialOrderItem.objects.create(
+            order=order, material=steel, quantity_ordered=Decimal('8'), quantity_received=Decimal('3'),
+            unit_price=Decimal('1')
+        )
+
+        planner = MaterialRequirementsPlanner.from_database()
+        self.assertEqual(planner.bom, {(PRODUCT, frame.id): {(MATERIAL, steel.id): Decimal('4')}})
+        self.assertEqual(planner.available, {steel.id: Decimal('10')})
+        self.assertEqual(planner.receipts, {steel.id: {None: Decimal('5')}})
+        self.assertEqual(planner.plan({None: {frame.id: 5}})['shortages'][0]['quantity'], Decimal('5'))
+
+        # Customer orders are not installed, so there is no demand to plan
+        self.assertEqual(MaterialRequirementsPlanner.confirmed_demand(), {})
+        result = tasks.plan_material_requirements_task.apply().get()
+        self.assertEqual(result['shortages'], [])
+
+
+class StockLedgerTest(TestCase):
+    """
+    Movements keep on-hand, reserved and available in step
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Bracket')
+
+    def setUp(self):
+        self.steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('10'), reorder_level=Decimal('2'))
+        self.work_order = WorkOrder.objects.create(product=self.product, quantity=Decimal('1'))
+
+    def movement(self, movement_type, quantity):
+        return StockMovement(
+            material=self.steel, movement_type=movement_type, quantity=Decimal(quantity), work_order=self.work_order
+        )
+
+    def stock(self):
+        summary = MaterialStockSummary.objects.get(material=self.steel)
+        self.steel.refresh_from_db()
+        return self.steel.quantity, summary.on_hand, summary.reserved, summary.available
+
+    def test_receive_reserve_consume_release(self):
+        StockLedger.receive(self.steel.id, Decimal('5'))
+        self.assertEqual(self.stock(), (15, 15, 0, 15))
+
+        StockLedger.record([self.movement('RESERVE', '6')], require_available=True)
+        MaterialReservation.objects.create(work_order=self.work_order, material=self.steel, quantity_reserved=Decimal('4'))
+        self.assertEqual(self.stock(), (15, 15, 6, 9))
+
+        # Consumes the 4 reserved by the work order, the other 2 stay reserved
+        StockLedger.consume_work_order(self.work_order)
+        self.assertEqual(self.stock(), (11, 11, 2, 9))
+        self.assertFalse(MaterialReservation.objects.exists())
+
+        StockLedger.record([self.movement('RELEASE', '2')])
+        self.assertEqual(self.stock(), (11, 11, 0, 11))
+
+    def test_require_available_rejects_over_promising(self):
+        with self.assertRaises(MaterialShortageError), transaction.atomic():
+            StockLedger.record([self.movement('RESERVE', '11')], require_available=True)
+        self.assertEqual(self.stock(), (10, 10, 0, 10))
+        self.assertFalse(StockMovement.objects.filter(movement_type='RESERVE').exists())
+
+    def test_stale_save_keeps_ledger_quantity(self):
+        stale = Material.objects.get(pk=self.steel.pk)
+        StockLedger.receive(self.steel.id, Decimal('5'))
+        adjustments = StockMovement.objects.filter(movement_type='ADJUSTMENT').count()
+
+        stale.name = 'Mild steel'
+        stale.save()
+        self.assertEqual(self.stock(), (15, 15, 0, 15))
+        self.assertEqual(self.steel.name, 'Mild steel')
+        self.assertEqual(StockMovement.objects.filter(movement_type='ADJUSTMENT').count(), adjustments)
+
+        # A deliberate quantity edit is still booked as an adjustment
+        self.steel.quantity = Decimal('12')
+        self.steel.save()
+        self.assertEqual(self.stock(), (12, 12, 0, 12))
+        self.assertEqual(StockMovement.objects.filter(movement_type='ADJUSTMENT').count(), adjustments + 1)
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class BulkStartTest(TestCase):
+    """
+    The bulk-start endpoint admits orders by priority while stock lasts
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('10'), reorder_level=Decimal('1'))
+        cls.frame = Product.objects.create(name='Frame')
+        ProductMaterial.objects.create(product=cls.frame, material=cls.steel, quantity=Decimal('2'))
+
+    def create(self, priority, quantity):
+        return WorkOrder.objects.create(
+            product=self.frame, quantity=Decimal(quantity), priority=priority, status='READY'
+        )
+
+    def bulk_start(self, work_orders, **data):
+        return self.client.post(
+            '/api/work-orders/bulk-start/',
+            {'work_order_ids': [work_order.id for work_order in work_orders], **data},
+            content_type='application/json'
+        )
+
+    def test_priority_admission_and_rejection(self):
+        low = self.create('LOW', '2')
+        critical = self.create('CRITICAL', '3')
+        high = self.create('HIGH', '2')
+
+        response = self.bulk_start([low, critical, high])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        # 10 kg covers the critical (6) and high (4) orders, the low one is left out
+        self.assertEqual(body['admitted'], [critical.id, high.id])
+        self.assertEqual(body['rejected_count'], 1)
+        rejected = body['results'][0]
+        self.assertEqual((rejected['work_order_id'], rejected['reason']), (low.id, 'Insufficient materials'))
+        self.assertEqual(rejected['material_details'][0]['material_id'], self.steel.id)
+
+        self.assertEqual(
+            set(WorkOrder.objects.filter(status='IN_PROGRESS').values_list('id', flat=True)), {critical.id, high.id}
+        )
+        summary = MaterialStockSummary.objects.get(material=self.steel)
+        self.assertEqual((summary.reserved, summary.available), (Decimal('10'), Decimal('0')))
+
+    def test_repeated_bulk_start_reserves_once(self):
+        work_order = self.create('MEDIUM', '2')
+        self.assertEqual(self.bulk_start([work_order]).json()['admitted'], [work_order.id])
+
+        body = self.bulk_start([work_order]).json()
+        self.assertEqual(body['admitted_count'], 0)
+        self.assertIn('Invalid status transition', body['results'][0]['reason'])
+        self.assertEqual(MaterialReservation.objects.filter(work_order=work_order).count(), 1)
+        self.assertEqual(MaterialStockSummary.objects.get(material=self.steel).reserved, Decimal('4'))
+
+    def test_invalid_payload(self):
+        self.assertEqual(self.bulk_start([]).status_code, 400)
+        self.assertEqual(self.bulk_start([self.create('LOW', '1')], priority_policy='random').status_code, 400)
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class MaterialLowStockEventTest(TestCase):
+    """
+    Saving a material alerts once, when available stock crosses the reorder level
+    """
+
+    def setUp(self):
+        self.steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('50'), reorder_level=Decimal('10'))
+        work_order = WorkOrder.objects.create(product=Product.objects.create(name='Bracket'), quantity=Decimal('1'))
+        StockLedger.record([StockMovement(
+            material=self.steel, movement_type='RESERVE', quantity=Decimal('35'), work_order=work_order
+        )])
+
+    def alerts(self):
+        return [
+            event.payload['materials']
+            for event in OutboxEvent.objects.filter(event_type='material.low_stock').order_by('id')
+        ]
+
+    def test_alerts_on_available_stock_crossing_only(self):
+        self.assertEqual(self.alerts(), [])
+
+        # 40 on hand is well above the level, but only 5 of it is available
+        self.steel.quantity = Decimal('40')
+        self.steel.save()
+        alerts = self.alerts()
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0][0]['material_id'], self.steel.id)
+        self.assertEqual(alerts[0][0]['current_quantity'], 5.0)
+
+        # Still low, saving again stays quiet
+        self.steel.name = 'Mild steel'
+        self.steel.save()
+        self.steel.quantity = Decimal('38')
+        self.steel.save()
+        self.assertEqual(len(self.alerts()), 1)
+
+        # Back above the level and down again is a new crossing
+        self.steel.quantity = Decimal('60')
+        self.steel.save()
+        self.steel.quantity = Decimal('44')
+        self.steel.save()
+        self.assertEqual(len(self.alerts()), 2)
+
+    def test_raising_the_reorder_level_alerts(self):
+        self.steel.reorder_level = Decimal('12')
+        self.steel.save()
+        self.assertEqual(self.alerts(), [])
+
+        self.steel.reorder_level = Decimal('15')
+        self.steel.save()
+        self.assertEqual([alert[0]['reorder_level'] for alert in self.alerts()], [15.0])
+
+    def test_new_material_below_its_level_alerts(self):
+        paint = Material.objects.create(name='Paint', unit='L', quantity=Decimal('1'), reorder_level=Decimal('5'))
+        self.assertEqual([alert[0]['material_id'] for alert in self.alerts()], [paint.id])
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class MaterialReservationEngineTest(TestCase):
+    """
+    BOM demand is reserved as a set, with shortages reported per material
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('20'), reorder_level=Decimal('5'))
+        cls.paint = Material.objects.create(name='Paint', unit='L', quantity=Decimal('3'), reorder_level=Decimal('1'))
+        cls.frame = Product.objects.create(name='Frame')
+        ProductMaterial.objects.create(product=cls.frame, material=cls.steel, quantity=Decimal('4'))
+        ProductMaterial.objects.create(product=cls.frame, material=cls.paint, quantity=Decimal('1'))
+
+    def create(self, quantity):
+        return WorkOrder.objects.create(product=self.frame, quantity=Decimal(quantity))
+
+    def test_allocation_follows_the_given_order(self):
+        first, second, third = self.create('2'), self.create('3'), self.create('1')
+        engine = MaterialReservationEngine([first, second, third])
+        self.assertEqual(engine.total_demand(), {self.steel.id: Decimal('24'), self.paint.id: Decimal('6')})
+
+        with transaction.atomic():
+            materials = engine.lock_materials(engine.total_demand().keys())
+            admitted, rejected = engine.allocate([second.id, first.id, third.id], materials)
+        # The second order takes 12 steel and 3 paint, leaving no paint for the others
+        self.assertEqual(admitted, [second.id])
+        self.assertEqual(set(rejected), {first.id, third.id})
+        self.assertEqual([shortage['material_id'] for shortage in rejected[third.id]], [self.paint.id])
+
+    def test_shortage_payload_and_nothing_reserved(self):
+        work_order = self.create('6')
+        with self.assertRaises(MaterialShortageError) as raised, transaction.atomic():
+            MaterialReservationEngine([work_order]).reserve()
+
+        details = {detail['material_id']: detail for detail in raised.exception.material_details}
+        self.assertEqual(set(details), {self.steel.id, self.paint.id})
+        self.assertEqual(details[self.steel.id]['required_quantity'], Decimal('24'))
+        self.assertEqual(details[self.steel.id]['available_quantity'], Decimal('20'))
+        self.assertAlmostEqual(float(details[self.paint.id]['shortage_percentage']), 50.0)
+        self.assertFalse(MaterialReservation.objects.exists())
+        self.assertEqual(MaterialStockSummary.objects.get(material=self.steel).reserved, 0)
+
+    def test_reservation_raises_one_low_stock_event(self):
+        work_order = self.create('3')
+        OutboxEvent.objects.all().delete()
+        reservations = MaterialReservationEngine([work_order]).reserve()
+
+        self.assertEqual(len(reservations), 2)
+        summaries = dict(MaterialStockSummary.objects.values_list('material_id', 'available'))
+        self.assertEqual((summaries[self.steel.id], summaries[self.paint.id]), (Decimal('8'), Decimal('0')))
+        # Only paint drops to its reorder level, in a single batched event
+        event = OutboxEvent.objects.get(event_type='material.low_stock')
+        self.assertEqual([material['material_id'] for material in event.payload['materials']], [self.paint.id])
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class FieldTrackerTest(TestCase):
+    """
+    Tracked fields report changes against the values last loaded or saved
+    """
+
+    def test_changed_fields_after_load(self):
+        created = WorkStation.objects.create(name='Lathe', hourly_operating_cost=Decimal('30'))
+        workstation = WorkStation.objects.get(pk=created.pk)
+        self.assertEqual(workstation.changed_fields, {})
+
+        workstation.name = 'Big lathe'
+        workstation.status = 'INACTIVE'
+        workstation.description = 'Untracked'
+        self.assertEqual(workstation.changed_fields, {'name': 'Lathe', 'status': 'ACTIVE'})
+        self.assertTrue(workstation.has_changed('status'))
+        self.assertFalse(workstation.has_changed('hourly_operating_cost'))
+        self.assertEqual(workstation.previous('status'), 'ACTIVE')
+
+    def test_snapshot_resets_on_save_and_refresh(self):
+        workstation = WorkStation.objects.create(name='Press')
+        workstation.status = 'INACTIVE'
+        workstation.save()
+        self.assertEqual(workstation.changed_fields, {})
+        self.assertEqual(workstation.previous('status'), 'INACTIVE')
+
+        # Only the saved fields are re-snapshotted on a partial save
+        workstation.name = 'Small press'
+        workstation.status = 'ACTIVE'
+        workstation.save(update_fields=['name'])
+        self.assertEqual(workstation.changed_fields, {'status': 'INACTIVE'})
+
+        WorkStation.objects.filter(pk=workstation.pk).update(status='MAINTENANCE')
+        workstation.refresh_from_db()
+        self.assertEqual(workstation.changed_fields, {})
+        self.assertEqual(workstation.previous('status'), 'MAINTENANCE')
+
+    def test_leaving_maintenance_stamps_last_maintenance(self):
+        workstation = WorkStation.objects.create(name='Mill', status='MAINTENANCE')
+        self.assertIsNone(workstation.last_maintenance)
+
+        workstation = WorkStation.objects.get(pk=workstation.pk)
+        workstation.status = 'ACTIVE'
+        workstation.save(update_fields=['status'])
+        stamped = WorkStation.objects.get(pk=workstation.pk).last_maintenance
+        self.assertIsNotNone(stamped)
+
+        # Other transitions leave it alone
+        workstation.status = 'INACTIVE'
+        workstation.save()
+        workstation.status = 'ACTIVE'
+        workstation.save()
+        self.assertEqual(WorkStation.objects.get(pk=workstation.pk).last_maintenance, stamped)
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class OutboxRelayTest(TestCase):
+    """
+    Only committed events are relayed, and relayed ones are marked sent
+    """
+
+    def test_rolled_back_enqueue_emits_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                OutboxRelay.enqueue('work_order.created', {'work_order_id': 1}, ['orders'])
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+        channel_layer = InMemoryChannelLayer()
+        with mock.patch('manufacturing.outbox.get_channel_layer', return_value=channel_layer):
+            self.assertEqual(OutboxRelay.drain_all(), 0)
+        self.assertEqual(channel_layer.channels, {})
+
+    def test_drain_sends_one_batch_per_group_and_marks_rows_sent(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            first = OutboxRelay.enqueue('work_order.created', {'work_order_id': 1}, ['orders', 'work_order.1'])
+            second = OutboxRelay.enqueue('work_order.updated', {'work_order_id': 2}, ['orders'])
+        self.assertEqual(len(callbacks), 2)
+
+        channel_layer = mock.Mock()
+        channel_layer.group_send = mock.AsyncMock()
+        with mock.patch('manufacturing.outbox.get_channel_layer', return_value=channel_layer):
+            self.assertEqual(OutboxRelay.drain_all(batch_size=1), 2)
+            # Nothing is pending any more
+            self.assertEqual(OutboxRelay.drain(), 0)
+
+        sent = {}
+        for call in channel_layer.group_send.await_args_list:
+            group_name, message = call.args
+            self.assertEqual(message['type'], 'event_batch')
+            sent.setdefault(group_name, []).extend(event['event_type'] for event in message['events'])
+        self.assertEqual(sent, {
+            'orders': ['work_order.created', 'work_order.updated'],
+            'work_order.1': ['work_order.created']
+        })
+        self.assertFalse(OutboxEvent.objects.filter(pk__in=[first.pk, second.pk], dispatched_at__isnull=True).exists())
+
+    def test_failed_send_is_retried_under_the_same_sequence_number(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        workstation = WorkStation.objects.create(name='Press')
+        OutboxEvent.objects.all().delete()
+        InitialStateSnapshot.get()
+        event = OutboxRelay.enqueue(
+            'workstation.status_changed',
+            {'workstation_id': workstation.id, 'name': 'Press', 'status': 'MAINTENANCE'},
+            ['workstations', 'orders']
+        )
+        version = InitialStateSnapshot.as_message()['version']
+
+        # The second group fails after the first one was sent
+        channel_layer = mock.Mock()
+        channel_layer.group_send = mock.AsyncMock(side_effect=[None, ConnectionError])
+        with mock.patch('manufacturing.outbox.get_channel_layer', return_value=channel_layer):
+            with self.assertRaises(ConnectionError):
+                OutboxRelay.drain()
+        self.assertTrue(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+        # Neither the replay buffer nor the snapshot saw the failed batch
+        self.assertIsNone(cache.get(EventReplayBuffer.buffer_key))
+        self.assertEqual(InitialStateSnapshot.as_message()['version'], version)
+
+        channel_layer.group_send = mock.AsyncMock()
+        with mock.patch('manufacturing.outbox.get_channel_layer', return_value=channel_layer):
+            self.assertEqual(OutboxRelay.drain(), 1)
+        first_try = channel_layer.group_send.await_args_list[0].args[1]['events'][0]['seq']
+        self.assertEqual(first_try, event.id)
+        self.assertEqual(
+            [message['seq'] for message in EventReplayBuffer.since(event.id - 1, {'orders'})], [event.id]
+        )
+        self.assertEqual(InitialStateSnapshot.as_message(version)['version'], version + 1)
+
+        # Appending the same event again, as a resent batch would, keeps one copy
+        EventReplayBuffer.append([(['orders'], {'seq': event.id, 'event_type': 'workstation.status_changed'})])
+        self.assertEqual(len(EventReplayBuffer.since(event.id - 1, {'orders'})), 1)
+
+    def test_replay_buffer_reports_evicted_events(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        with mock.patch.object(EventReplayBuffer, 'size', 2):
+            EventReplayBuffer.append([(['orders'], {'seq': seq}) for seq in (5, 7, 9)])
+        # 5 was evicted, so a client at 4 or 5 cannot catch up
+        self.assertIsNone(EventReplayBuffer.since(4, {'orders'}))
+        self.assertEqual([message['seq'] for message in EventReplayBuffer.since(7, {'orders'})], [9])
+        self.assertEqual(EventReplayBuffer.since(9, {'orders'}), [])
+        self.assertIsNone(EventReplayBuffer.since(10, {'orders'}))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ManufacturingConsumerTest(TestCase):
+    """
+    Events reach a subscribed socket coalesced per entity and bounded per window
+    """
+    initial_state = {'type': 'initial_state', 'version': 1, 'data': {}}
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            ManufacturingConsumer, 'get_initial_state', mock.AsyncMock(return_value=self.initial_state)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, query='topics=orders'):
+        communicator = WebsocketCommunicator(ManufacturingConsumer.as_asgi(), f'/ws/manufacturing/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    @staticmethod
+    def event(seq, work_order_id, status):
+        return {
+            'seq': seq,
+            'event_type': 'work_order.status_changed',
+            'data': {'work_order_id': work_order_id, 'new_status': status},
+            'timestamp': None
+        }
+
+    async def test_updates_to_one_entity_arrive_as_one(self):
+        communicator = await self.connect()
+        self.assertEqual((await communicator.receive_json_from())['topics'], ['orders'])
+        self.assertEqual(await communicator.receive_json_from(), self.initial_state)
+
+        channel_layer = get_channel_layer()
+        await channel_layer.group_send('orders', {
+            'type': 'event_batch',
+            'events': [self.event(1, 7, 'READY'), self.event(2, 8, 'READY')]
+        })
+        await channel_layer.group_send('orders', {'type': 'event_batch', 'events': [self.event(3, 7, 'IN_PROGRESS')]})
+
+        frame = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(frame['type'], 'manufacturing_events')
+        self.assertNotIn('dropped', frame)
+        self.assertEqual(
+            [(event['seq'], event['data']['work_order_id'], event['data']['new_status']) for event in frame['events']],
+            [(2, 8, 'READY'), (3, 7, 'IN_PROGRESS')]
+        )
+        self.assertTrue(await communicator.receive_nothing(ManufacturingConsumer.coalesce_window * 2))
+        await communicator.disconnect()
+
+    async def test_overflow_drops_oldest_and_flags_frame(self):
+        communicator = await self.connect()
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+
+        with mock.patch.object(ManufacturingConsumer, 'max_pending_events', 3):
+            await get_channel_layer().group_send('orders', {
+                'type': 'event_batch',
+                'events': [self.event(seq, seq, 'READY') for seq in range(1, 6)]
+            })
+            frame = await communicator.receive_json_from(timeout=1)
+
+        self.assertEqual([event['seq'] for event in frame['events']], [3, 4, 5])
+        self.assertEqual(frame['dropped'], 2)
+        await communicator.disconnect()
+
+    async def test_resume_replays_missed_events_on_subscribed_topics(self):
+        await sync_to_async(cache.clear)()
+        await sync_to_async(EventReplayBuffer.append)([
+            (['orders'], self.event(1, 1, 'READY')),
+            (['workstations'], {'seq': 2, 'event_type': 'workstation.status_changed', 'data': {'workstation_id': 2}}),
+            (['orders', 'work_order.3'], self.event(3, 3, 'READY')),
+        ])
+
+        communicator = await self.connect('topics=orders&resume_from=1')
+        await communicator.receive_json_from()
+        frame = await communicator.receive_json_from()
+        self.assertTrue(frame['resumed'])
+        self.assertEqual([(event['seq'], event['data']['work_order_id']) for event in frame['events']], [(3, 3)])
+        # A resumed client is not sent the initial state
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to({'type': 'resume', 'resume_from': 3})
+        self.assertEqual((await communicator.receive_json_from())['events'], [])
+        await communicator.disconnect()
+
+    async def test_invalid_resume_position_falls_back_to_initial_state(self):
+        communicator = await self.connect('topics=orders&resume_from=latest')
+        await communicator.receive_json_from()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'resume_failed', 'resume_from': None})
+        self.assertEqual(await communicator.receive_json_from(), self.initial_state)
+
+        await communicator.send_json_to({'type': 'resume', 'resume_from': 'x'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'resume_failed')
+        await communicator.send_json_to({'type': 'request_initial_state', 'since_version': 'x'})
+        self.assertEqual(await communicator.receive_json_from(), self.initial_state)
+        ManufacturingConsumer.get_initial_state.assert_awaited_with(None)
+        await communicator.disconnect()
+
+
+class SharedCacheCheckTest(TestCase):
+    """
+    A process-local default cache is reported at startup
+    """
+
+    def test_process_local_cache_warns(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['manufacturing.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(OUTBOX_RELAY_IN_PROCESS=False)
+class InitialStateSnapshotTest(TestCase):
+    """
+    Relayed events patch the cached snapshot and bump its version
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.press = WorkStation.objects.create(name='Press')
+
+    def status_changed(self, status):
+        return ('workstation.status_changed', {'workstation_id': self.press.id, 'name': 'Press', 'status': status})
+
+    def test_deltas_since_a_retained_version(self):
+        version = InitialStateSnapshot.as_message()['version']
+
+        InitialStateSnapshot.apply_events([
+            self.status_changed('MAINTENANCE'),
+            ('material.restocked', {'material_ids': [999]}),
+        ])
+        # Events already applied are not versioned again
+        InitialStateSnapshot.apply_events([self.status_changed('MAINTENANCE')])
+        InitialStateSnapshot.apply_events([self.status_changed('ACTIVE')])
+
+        message = InitialStateSnapshot.as_message(version)
+        self.assertEqual(message['type'], 'initial_state_delta')
+        self.assertEqual(message['version'], version + 2)
+        self.assertEqual(
+            [(change['version'], change['op'], change['item']['status']) for change in message['changes']],
+            [(version + 1, 'upsert', 'MAINTENANCE'), (version + 2, 'upsert', 'ACTIVE')]
+        )
+        self.assertEqual(InitialStateSnapshot.as_message(version + 1)['changes'][0]['version'], version + 2)
+        self.assertEqual(InitialStateSnapshot.as_message(version + 2)['changes'], [])
+
+    def test_full_state_when_version_is_unknown(self):
+        snapshot = InitialStateSnapshot.as_message()
+        self.assertEqual(snapshot['type'], 'initial_state')
+        self.assertEqual(snapshot['data']['workstations'], [{'id': self.press.id, 'name': 'Press', 'status': 'ACTIVE'}])
+
+        InitialStateSnapshot.apply_events([self.status_changed('INACTIVE')])
+        with mock.patch.object(InitialStateSnapshot, 'max_deltas', 1):
+            InitialStateSnapshot.apply_events([self.status_changed('ACTIVE')])
+        # The first delta was discarded, and versions from the future are unknown
+        for since_version in (snapshot['version'], snapshot['version'] + 5):
+            message = InitialStateSnapshot.as_message(since_version)
+            self.assertEqual(message['type'], 'initial_state')
+            self.assertEqual(message['version'], snapshot['version'] + 2)
+
+        # A rebuild continues the version sequence, so old deltas never match
+        cache.delete(InitialStateSnapshot.cache_key)
+        rebuilt = InitialStateSnapshot.as_message(snapshot['version'] + 2)
+        self.assertEqual(rebuilt['type'], 'initial_state')
+        self.assertEqual(rebuilt['version'], snapshot['version'] + 3)
+
+
+    def test_low_stock_includes_unsummarized_materials(self):
+        steel = Material.objects.create(name='Steel', unit='KG', quantity=Decimal('3'), reorder_level=Decimal('10'))
+        paint = Material.objects.create(name='Paint', unit='L', quantity=Decimal('2'), reorder_level=Decimal('5'))
+        Material.objects.create(name='Bolts', unit='PCS', quantity=Decimal('50'), reorder_level=Decimal('5'))
+        MaterialStockSummary.objects.filter(material=paint).delete()
+
+        low_stock = InitialStateSnapshot.as_message()['data']['low_stock_materials']
+        self.assertEqual(
+            sorted((material['id'], material['quantity']) for material in low_stock),
+            [(steel.id, Decimal('3')), (paint.id, Decimal('2'))]
+        )
+
+class WorkStationRuntimeTest(TestCase):
+    """
+    Utilization comes from work order runtime in the window, in one query
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='supervisor', password='secret-pass-1')
+        cls.product = Product.objects.create(name='Hinge')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.now = timezone.now()
+
+    def work_order(self, workstation, status, started_hours_ago, ended_hours_ago=None):
+        return WorkOrder(
+            product=self.product,
+            workstation=workstation,
+            quantity=Decimal('1'),
+            status=status,
+            start_date=self.now - timedelta(hours=started_hours_ago),
+            end_date=None if ended_hours_ago is None else self.now - timedelta(hours=ended_hours_ago)
+        )
+
+    def real_time_status(self, **params):
+        response = self.client.get('/api/workstations/real_time_status/', params)
+        self.assertEqual(response.status_code, 200)
+        return {row['id']: row for row in response.data}
+
+    def test_runtime_is_clipped_to_the_window(self):
+        lathe, press, mill, idle = WorkStation.objects.bulk_create([
+            WorkStation(name=name) for name in ('Lathe', 'Press', 'Mill', 'Idle')
+        ])
+        WorkOrder.objects.bulk_create([
+            # 6 of its 12 hours fall inside the last 24, plus 2 whole hours
+            self.work_order(lathe, 'COMPLETED', 30, 18),
+            self.work_order(lathe, 'COMPLETED', 4, 2),
+            # Finished before the window
+            self.work_order(lathe, 'COMPLETED', 40, 30),
+            # Runs until now
+            self.work_order(press, 'IN_PROGRESS', 12),
+            self.work_order(mill, 'IN_PROGRESS', 48),
+            # Neither running nor completed
+            self.work_order(idle, 'PAUSED', 10),
+        ])
+
+        rows = self.real_time_status()
+        utilization = {workstation_id: row['utilization_rate'] for workstation_id, row in rows.items()}
+        self.assertAlmostEqual(utilization[lathe.id], 100 * 8 / 24, places=1)
+        self.assertAlmostEqual(utilization[press.id], 50.0, places=1)
+        self.assertEqual(utilization[mill.id], 100.0)
+        self.assertEqual(utilization[idle.id], 0.0)
+        self.assertEqual(rows[press.id]['current_work_order']['product_name'], 'Hinge')
+        self.assertIsNone(rows[idle.id]['current_work_order']['id'])
+
+        # A shorter window only counts its own hours
+        rows = self.real_time_status(window_hours=6)
+        self.assertAlmostEqual(rows[lathe.id]['utilization_rate'], 100 * 2 / 6, places=1)
+        self.assertAlmostEqual(lathe.calculate_utilization_rate(timedelta(hours=6)), 100 * 2 / 6, places=1)
+
+    def test_query_count_is_constant(self):
+        def add_workstations(count):
+            workstations = WorkStation.objects.bulk_create([WorkStation(name=f'Station {i}') for i in range(count)])
+            WorkOrder.objects.bulk_create([
+                self.work_order(workstation, status, 5, 1 if status == 'COMPLETED' else None)
+                for workstation in workstations
+                for status in ('IN_PROGRESS', 'COMPLETED')
+            ])
+
+        add_workstations(2)
+        with CaptureQueriesContext(connection) as small:
+            self.real_time_status()
+        add_workstations(50)
+        with CaptureQueriesContext(connection) as large:
+            rows = self.real_time_status()
+
+        self.assertEqual(len(rows), 52)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(large), 1)
+
+    def test_invalid_window(self):
+        for window_hours in ('soon', '0'):
+            response = self.client.get('/api/workstations/real_time_status/', {'window_hours': window_hours})
+            self.assertEqual(response.status_code, 400)
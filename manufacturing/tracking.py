@@ -0,0 +1,68 @@
+"""
+Field change tracking for models
+
+Snapshots the tracked field values an instance was loaded with, so save
+methods and signal receivers can detect transitions without re-reading the
+row from the database.
+"""
+
+
+class FieldTrackerMixin:
+    """
+    Remember the loaded values of ``tracked_fields`` and report changes
+
+    Mix in before models.Model. Values are captured when an instance is loaded
+    from the database and again after every save or refresh, so inside
+    pre_save/post_save receivers previous() still returns the stored value.
+    Fields deferred at load time are not tracked until they are saved.
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def _snapshot_tracked_fields(self, field_names=None):
+        loaded = self.__dict__
+        initial = getattr(self, '_tracked_initial', {}) if field_names is not None else {}
+        initial.update({
+            name: loaded[attname]
+            for name, attname in self._tracked_attnames()
+            if attname in loaded and (field_names is None or name in field_names)
+        })
+        self._tracked_initial = initial
+
+    @classmethod
+    def _tracked_attnames(cls):
+        return [(name, cls._meta.get_field(name).attname) for name in cls.tracked_fields]
+
+    @property
+    def changed_fields(self):
+        """
+        Tracked fields whose value differs from the stored one, mapped to
+        their previous value
+        """
+        initial = getattr(self, '_tracked_initial', {})
+        return {
+            name: initial[name]
+            for name, attname in self._tracked_attnames()
+            if name in initial and getattr(self, attname) != initial[name]
+        }
+
+    def has_changed(self, field_name):
+        """Whether the tracked field differs from its stored value"""
+        return field_name in self.changed_fields
+
+    def previous(self, field_name):
+        """Stored value of a tracked field, None for unsaved instances"""
+        return getattr(self, '_tracked_initial', {}).get(field_name)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot_tracked_fields(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot_tracked_fields(fields)
@@ -7,7 +7,7 @@ from .views import (
     RegisterView, LogoutView,
     # New ViewSets
     WorkstationProcessViewSet, WorkstationEfficiencyViewSet, 
-    ProductionDesignViewSet, ProductionEventViewSet
+    ProductionDesignViewSet, ProductionEventViewSet, ProductionScheduleViewSet
 )
 from .analytics import ProfitabilityAnalyticsView
 
@@ -26,6 +26,7 @@ router.register(r'workstation-processes', WorkstationProcessViewSet)
 router.register(r'workstation-efficiency', WorkstationEfficiencyViewSet)
 router.register(r'production-designs', ProductionDesignViewSet)
 router.register(r'production-events', ProductionEventViewSet)
+router.register(r'production-schedule', ProductionScheduleViewSet)
 
 urlpatterns = [
     # Router URLs
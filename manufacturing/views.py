@@ -2,13 +2,14 @@ from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Avg, F, ExpressionWrapper, fields
+from django.db.models import Sum, Count, Avg, F, ExpressionWrapper, fields, OuterRef, Prefetch, Subquery
+from django.db import transaction
 from django.utils import timezone
 from .models import (
-    WorkStation, Material, Product, WorkOrder, ProductionLog, 
+    WorkStation, Material, Product, WorkOrder, ProductionLog, MaterialReservation,
     WorkstationProcess, WorkstationEfficiencyMetric, 
     ProductionDesign, ProductionEvent, ProductWorkstationSequence,
-    Supplier
+    Supplier, ScheduledOperation
 )
 from .serializers import (
     WorkStationSerializer, MaterialSerializer, ProductSerializer,
@@ -16,16 +17,39 @@ from .serializers import (
     WorkstationProcessSerializer, WorkstationEfficiencyMetricSerializer,
     ProductionDesignSerializer, ProductionEventSerializer,
     ProductWorkstationSequenceSerializer,
-    SupplierSerializer
+    SupplierSerializer, ScheduledOperationSerializer
 )
 import logging
 from django.db.models import Q
 from rest_framework.pagination import PageNumberPagination
-from datetime import datetime
+from datetime import datetime, timedelta
 from .analytics import ProfitabilityAnalyticsView
+from .completion import complete_work_orders
+from .costing import ProductCostCache
+from .dashboard import WorkOrderDashboardStats
+from .dependencies import DependencyIndex
+from .ledger import StockLedger
+from .pagination import ScheduleCursorPagination, WorkOrderCursorPagination
+from .reservations import ADMISSION_POLICIES, bulk_start_work_orders
+from .scheduling import replan
+from .stock_alerts import LowStockScanner
+
+try:
+    from kombu.exceptions import OperationalError as BrokerUnavailable
+except ImportError:  # Celery is only needed by workers
+    BrokerUnavailable = ImportError
 
 logger = logging.getLogger(__name__)
 
+def queue_unavailable(error):
+    """
+    503 response for an async request that could not be queued
+    """
+    logger.error(f"Could not queue task: {error}")
+    return Response({
+        'error': 'The task queue is unavailable, retry later or without async'
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
 # Create your views here.
 
 class WorkStationViewSet(viewsets.ModelViewSet):
@@ -64,49 +88,67 @@ class WorkStationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def real_time_status(self, request):
         """
-        Provide real-time status of all workstations
+        Provide real-time status of all workstations in a single query
+
+        Query parameters:
+            window_hours: Trailing window for utilization_rate (default 24)
         """
-        workstations = WorkStation.objects.all()
-        status_data = []
-        
-        for workstation in workstations:
-            # Get the most recent work order for this workstation
-            current_work_order = WorkOrder.objects.filter(
-                workstation=workstation, 
-                status='IN_PROGRESS'
-            ).first()
-            
-            # Get the most recent production log
-            latest_log = ProductionLog.objects.filter(
-                workstation=workstation
-            ).order_by('-created_at').first()
-            
-            status_data.append({
-                'id': workstation.id,
-                'name': workstation.name,
-                'status': workstation.status,
+        try:
+            window = timedelta(hours=float(request.query_params.get('window_hours', 24)))
+        except (ValueError, OverflowError):
+            return Response({'error': 'window_hours must be a number'}, status=400)
+        if window <= timedelta(0):
+            return Response({'error': 'window_hours must be positive'}, status=400)
+
+        current_work_order = WorkOrder.objects.filter(
+            workstation=OuterRef('pk'),
+            status='IN_PROGRESS'
+        ).order_by('-start_date', '-id')
+        latest_log = ProductionLog.objects.filter(
+            workstation=OuterRef('pk')
+        ).order_by('-created_at', '-id')
+
+        workstations = WorkStation.with_runtime(WorkStation.objects.all(), window).annotate(
+            current_work_order_id=Subquery(current_work_order.values('id')[:1]),
+            current_product_name=Subquery(current_work_order.values('product__name')[:1]),
+            current_quantity=Subquery(current_work_order.values('quantity')[:1]),
+            latest_quantity_produced=Subquery(latest_log.values('quantity_produced')[:1]),
+            latest_production_at=Subquery(latest_log.values('created_at')[:1])
+        ).order_by('id').values(
+            'id', 'name', 'status', 'runtime',
+            'current_work_order_id', 'current_product_name', 'current_quantity',
+            'latest_quantity_produced', 'latest_production_at'
+        )
+
+        status_data = [
+            {
+                'id': workstation['id'],
+                'name': workstation['name'],
+                'status': workstation['status'],
                 'current_work_order': {
-                    'id': current_work_order.id if current_work_order else None,
-                    'product_name': current_work_order.product.name if current_work_order else None,
-                    'quantity': current_work_order.quantity if current_work_order else None,
+                    'id': workstation['current_work_order_id'],
+                    'product_name': workstation['current_product_name'],
+                    'quantity': workstation['current_quantity'],
                 },
                 'latest_production': {
-                    'quantity_produced': latest_log.quantity_produced if latest_log else 0,
-                    'created_at': latest_log.created_at if latest_log else None,
+                    'quantity_produced': workstation['latest_quantity_produced'] or 0,
+                    'created_at': workstation['latest_production_at'],
                 },
-                'utilization_rate': workstation.calculate_utilization_rate() if hasattr(workstation, 'calculate_utilization_rate') else None
-            })
+                'utilization_rate': WorkStation.utilization_from_runtime(workstation['runtime'], window)
+            }
+            for workstation in workstations
+        ]
         
         return Response(status_data)
 
 class MaterialViewSet(viewsets.ModelViewSet):
-    queryset = Material.objects.all()
+    queryset = Material.objects.select_related('stock_summary')
     serializer_class = MaterialSerializer
     permission_classes = [permissions.AllowAny]  # Change to AllowAny for development
 
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
-        materials = Material.objects.filter(quantity__lte=Material.reorder_level)
+        materials = LowStockScanner.low_stock(self.get_queryset())
         serializer = self.get_serializer(materials, many=True)
         return Response(serializer.data)
 
@@ -189,12 +231,12 @@ class ProductViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def material_requirements(self, request, pk=None):
         product = self.get_object()
-        materials = product.productmaterial_set.all()
+        materials = product.productmaterial_set.select_related('material__stock_summary')
         data = [{
             'material': material.material.name,
             'required_quantity': material.quantity,
-            'available_quantity': material.material.quantity,
-            'status': 'Available' if material.material.quantity >= material.quantity else 'Insufficient'
+            'available_quantity': material.material.available_quantity,
+            'status': 'Available' if material.material.available_quantity >= material.quantity else 'Insufficient'
         } for material in materials]
         return Response(data)
 
@@ -282,6 +324,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         # Bulk create sequences
         ProductWorkstationSequence.objects.bulk_create(sequences_to_create)
+        ProductCostCache.invalidate([product.id])
         
         # Retrieve and return the created sequences
         created_sequences = ProductWorkstationSequence.objects.filter(product=product)
@@ -305,18 +348,14 @@ class ProductViewSet(viewsets.ModelViewSet):
         # Optional cancellation reason
         reason = request.data.get('reason', '')
         
-        # If work order was in progress, restore materials
-        if work_order.status == 'IN_PROGRESS':
-            for product_material in work_order.product.productmaterial_set.all():
-                material = product_material.material
-                required_quantity = product_material.quantity * work_order.quantity
-                material.quantity += required_quantity
-                material.save()
-        
-        # Update work order
-        work_order.status = 'CANCELLED'
-        work_order.notes = f"Cancelled: {reason}"
-        work_order.save()
+        with transaction.atomic():
+            # Return any reserved materials to available stock
+            StockLedger.release_work_order(work_order)
+            
+            # Update work order
+            work_order.status = 'CANCELLED'
+            work_order.notes = f"Cancelled: {reason}"
+            work_order.save()
         
         serializer = self.get_serializer(work_order)
         return Response(serializer.data)
@@ -326,61 +365,47 @@ class ProductViewSet(viewsets.ModelViewSet):
         """
         Comprehensive work order dashboard statistics
         """
-        today = timezone.now().date()
-        
-        stats = {
-            'total_work_orders': WorkOrder.objects.count(),
-            'status_breakdown': {
-                status: WorkOrder.objects.filter(status=status).count()
-                for status, _ in WorkOrder.WORK_ORDER_STATUS_CHOICES
-            },
-            'priority_breakdown': {
-                priority: WorkOrder.objects.filter(priority=priority).count()
-                for priority, _ in WorkOrder.PRIORITY_CHOICES
-            },
-            'today_work_orders': {
-                'total': WorkOrder.objects.filter(start_date__date=today).count(),
-                'completed': WorkOrder.objects.filter(
-                    start_date__date=today, 
-                    status='COMPLETED'
-                ).count(),
-                'in_progress': WorkOrder.objects.filter(
-                    start_date__date=today, 
-                    status='IN_PROGRESS'
-                ).count()
-            },
-            'overdue_work_orders': WorkOrder.objects.filter(
-                end_date__lt=today, 
-                status__in=['PENDING', 'IN_PROGRESS']
-            ).count(),
-            'blocked_work_orders': WorkOrder.objects.filter(
-                status='BLOCKED'
-            ).count(),
-            'upcoming_dependencies': WorkOrder.objects.filter(
-                dependencies__status='PENDING'
-            ).values('id', 'product__name', 'status').distinct()
-        }
-        
-        return Response(stats)
+        return Response(WorkOrderDashboardStats.get())
 
 class WorkOrderViewSet(viewsets.ModelViewSet):
     queryset = WorkOrder.objects.all()
     serializer_class = WorkOrderSerializer
     permission_classes = [permissions.AllowAny]  # Change to AllowAny for development
+    pagination_class = WorkOrderCursorPagination
 
     def get_queryset(self):
-        queryset = WorkOrder.objects.all().order_by('-created_at')
-        
+        # Only join and prefetch what the requested fields= will serialize
+        field_names = set(self.get_serializer().fields)
+        related = [
+            relation for field_name, relation in (
+                ('product_name', 'product'),
+                ('workstation_name', 'workstation'),
+                ('assigned_to_username', 'assigned_to')
+            )
+            if field_name in field_names
+        ]
+        queryset = WorkOrder.objects.order_by('-created_at', 'id')
+        if related:
+            # select_related() without arguments would follow every foreign key
+            queryset = queryset.select_related(*related)
+        if 'dependencies' in field_names:
+            queryset = queryset.prefetch_related(
+                Prefetch('dependencies', queryset=WorkOrder.objects.only('id'))
+            )
+        if 'material_reservations' in field_names:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'material_reservations',
+                    queryset=MaterialReservation.objects.select_related('material')
+                )
+            )
+
         # Optional filtering parameters
         status = self.request.query_params.get('status', None)
         product_id = self.request.query_params.get('product', None)
         start_date_from = self.request.query_params.get('start_date_from', None)
         start_date_to = self.request.query_params.get('start_date_to', None)
 
-        # Log the query parameters for debugging
-        print(f"WorkOrder Query Params: status={status}, product_id={product_id}, "
-              f"start_date_from={start_date_from}, start_date_to={start_date_to}")
-
         if status:
             queryset = queryset.filter(status=status)
         if product_id:
@@ -390,9 +415,6 @@ class WorkOrderViewSet(viewsets.ModelViewSet):
         if start_date_to:
             queryset = queryset.filter(start_date__lte=start_date_to)
 
-        # Log the number of work orders after filtering
-        print(f"Total WorkOrders after filtering: {queryset.count()}")
-
         return queryset
 
     @action(detail=True, methods=['post'])
@@ -452,6 +474,128 @@ class WorkOrderViewSet(viewsets.ModelViewSet):
                 'error': 'Failed to start work order'
             }, status=500)
 
+    @action(detail=False, methods=['post'], url_path='bulk-start')
+    def bulk_start(self, request):
+        """
+        Start many work orders at once, allocating scarce materials by priority
+        
+        Expected payload:
+        {
+            "work_order_ids": [1, 2, 3],
+            "priority_policy": "priority"  # or "fifo", "smallest_demand"
+        }
+        """
+        work_order_ids = request.data.get('work_order_ids', [])
+        policy = request.data.get('priority_policy', 'priority')
+        
+        if not isinstance(work_order_ids, list) or not work_order_ids:
+            return Response({
+                'error': 'work_order_ids must be a non-empty list'
+            }, status=400)
+        try:
+            work_order_ids = [int(work_order_id) for work_order_id in work_order_ids]
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'work_order_ids must contain integer IDs'
+            }, status=400)
+        if policy not in ADMISSION_POLICIES:
+            return Response({
+                'error': f"Unknown priority_policy '{policy}'. "
+                         f"Expected one of: {', '.join(ADMISSION_POLICIES)}"
+            }, status=400)
+        
+        try:
+            results = bulk_start_work_orders(work_order_ids, policy)
+        except Exception as e:
+            logger.error(f"Error bulk starting work orders {work_order_ids}: {str(e)}")
+            return Response({
+                'error': 'Failed to start work orders'
+            }, status=500)
+        
+        admitted = [result['work_order_id'] for result in results if result['status'] == 'admitted']
+        return Response({
+            'admitted_count': len(admitted),
+            'rejected_count': len(results) - len(admitted),
+            'admitted': admitted,
+            'results': results
+        })
+
+    @action(detail=False, methods=['post'], url_path='bulk-complete')
+    def bulk_complete(self, request):
+        """
+        Complete many in-progress work orders in one transaction
+
+        Orders already completed are reported as duplicates, so a repeated
+        request changes nothing. With {"async": true} the orders are queued
+        in batches for the workers instead.
+
+        Expected payload:
+        {
+            "work_order_ids": [1, 2, 3],
+            "async": false
+        }
+        """
+        work_order_ids = request.data.get('work_order_ids', [])
+
+        if not isinstance(work_order_ids, list) or not work_order_ids:
+            return Response({
+                'error': 'work_order_ids must be a non-empty list'
+            }, status=400)
+        try:
+            work_order_ids = [int(work_order_id) for work_order_id in work_order_ids]
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'work_order_ids must contain integer IDs'
+            }, status=400)
+
+        if request.data.get('async'):
+            try:
+                from .tasks import enqueue_work_order_completions  # Import here, Celery is only needed by workers
+                task_ids = enqueue_work_order_completions(work_order_ids)
+            except (ImportError, BrokerUnavailable) as e:
+                return queue_unavailable(e)
+            return Response({'task_ids': task_ids}, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            results = complete_work_orders(work_order_ids)
+        except Exception as e:
+            logger.error(f"Error bulk completing work orders {work_order_ids}: {str(e)}")
+            return Response({
+                'error': 'Failed to complete work orders'
+            }, status=500)
+
+        completed = [result['work_order_id'] for result in results if result['status'] == 'completed']
+        return Response({
+            'completed_count': len(completed),
+            'duplicate_count': sum(result['status'] == 'duplicate' for result in results),
+            'rejected_count': sum(result['status'] == 'rejected' for result in results),
+            'completed': completed,
+            'results': results
+        })
+
+    @action(detail=False, methods=['get'])
+    def ready(self, request):
+        """
+        Queue of work orders not started yet whose dependencies are all
+        completed, most urgent and oldest first
+
+        Query parameters:
+            limit: Maximum number of work orders returned (default 50, max 500)
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=400)
+        if limit <= 0:
+            return Response({'error': 'limit must be positive'}, status=400)
+
+        work_orders = DependencyIndex.ready(self.get_queryset())[:limit]
+        serializer = self.get_serializer(work_orders, many=True)
+        return Response({
+            'count': len(serializer.data),
+            'results': serializer.data
+        })
+
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
         """
@@ -561,10 +705,14 @@ class WorkOrderViewSet(viewsets.ModelViewSet):
             notes=f"Completed work order {work_order.id}"
         )
         
-        # Update work order
-        work_order.status = 'COMPLETED'
-        work_order.end_date = timezone.now()
-        work_order.save()
+        with transaction.atomic():
+            # Consume the reserved materials
+            StockLedger.consume_work_order(work_order)
+            
+            # Update work order
+            work_order.status = 'COMPLETED'
+            work_order.end_date = timezone.now()
+            work_order.save()
         
         serializer = self.get_serializer(work_order)
         return Response(serializer.data)
@@ -585,18 +733,14 @@ class WorkOrderViewSet(viewsets.ModelViewSet):
         # Optional cancellation reason
         reason = request.data.get('reason', '')
         
-        # If work order was in progress, restore materials
-        if work_order.status == 'IN_PROGRESS':
-            for product_material in work_order.product.productmaterial_set.all():
-                material = product_material.material
-                required_quantity = product_material.quantity * work_order.quantity
-                material.quantity += required_quantity
-                material.save()
-        
-        # Update work order
-        work_order.status = 'CANCELLED'
-        work_order.notes = f"Cancelled: {reason}"
-        work_order.save()
+        with transaction.atomic():
+            # Return any reserved materials to available stock
+            StockLedger.release_work_order(work_order)
+            
+            # Update work order
+            work_order.status = 'CANCELLED'
+            work_order.notes = f"Cancelled: {reason}"
+            work_order.save()
         
         serializer = self.get_serializer(work_order)
         return Response(serializer.data)
@@ -606,42 +750,7 @@ class WorkOrderViewSet(viewsets.ModelViewSet):
         """
         Comprehensive work order dashboard statistics
         """
-        today = timezone.now().date()
-        
-        stats = {
-            'total_work_orders': WorkOrder.objects.count(),
-            'status_breakdown': {
-                status: WorkOrder.objects.filter(status=status).count()
-                for status, _ in WorkOrder.WORK_ORDER_STATUS_CHOICES
-            },
-            'priority_breakdown': {
-                priority: WorkOrder.objects.filter(priority=priority).count()
-                for priority, _ in WorkOrder.PRIORITY_CHOICES
-            },
-            'today_work_orders': {
-                'total': WorkOrder.objects.filter(start_date__date=today).count(),
-                'completed': WorkOrder.objects.filter(
-                    start_date__date=today, 
-                    status='COMPLETED'
-                ).count(),
-                'in_progress': WorkOrder.objects.filter(
-                    start_date__date=today, 
-                    status='IN_PROGRESS'
-                ).count()
-            },
-            'overdue_work_orders': WorkOrder.objects.filter(
-                end_date__lt=today, 
-                status__in=['PENDING', 'IN_PROGRESS']
-            ).count(),
-            'blocked_work_orders': WorkOrder.objects.filter(
-                status='BLOCKED'
-            ).count(),
-            'upcoming_dependencies': WorkOrder.objects.filter(
-                dependencies__status='PENDING'
-            ).values('id', 'product__name', 'status').distinct()
-        }
-        
-        return Response(stats)
+        return Response(WorkOrderDashboardStats.get())
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
@@ -846,6 +955,48 @@ class SupplierViewSet(viewsets.ModelViewSet):
         
         return queryset
 
+class ProductionScheduleViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The current finite-capacity production schedule
+    """
+    queryset = ScheduledOperation.objects.select_related('workstation')
+    serializer_class = ScheduledOperationSerializer
+    permission_classes = [permissions.AllowAny]  # Change to AllowAny for development
+    pagination_class = ScheduleCursorPagination
+
+    def get_queryset(self):
+        """
+        Optionally filter operations by workstation or work order
+        """
+        queryset = super().get_queryset()
+        workstation = self.request.query_params.get('workstation')
+        work_order = self.request.query_params.get('work_order')
+
+        if workstation:
+            queryset = queryset.filter(workstation_id=workstation)
+        if work_order:
+            queryset = queryset.filter(work_order_id=work_order)
+
+        return queryset
+
+    @action(detail=False, methods=['post'])
+    def replan(self, request):
+        """
+        Rebuild the schedule for all open work orders
+
+        Runs inline and returns the plan summary, or with {"async": true}
+        queues the Celery task and returns its id.
+        """
+        if request.data.get('async'):
+            try:
+                from .tasks import replan_production_schedule  # Import here, Celery is only needed by workers
+                result = replan_production_schedule.delay()
+            except (ImportError, BrokerUnavailable) as e:
+                return queue_unavailable(e)
+            return Response({'task_id': result.id}, status=status.HTTP_202_ACCEPTED)
+
+        return Response(replan())
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
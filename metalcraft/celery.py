@@ -0,0 +1,14 @@
+"""
+Celery application for the metalcraft project
+
+Workers are started with: celery -A metalcraft worker
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "metalcraft.settings")
+
+app = Celery("metalcraft")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     "rest_framework.authtoken",
     "corsheaders",
     "manufacturing",
+    "inventory",
     "accounts",
     'rest_framework_simplejwt',
 ]
@@ -145,6 +146,28 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Event sequence numbers, the replay buffer, the initial state snapshot and
+# the cost and dashboard caches must be shared by every web process and the
+# outbox relay, manufacturing.W001 warns about a process-local cache.
+# Tests use metalcraft.test_settings instead.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+    },
+}
+
+# Relay committed outbox events from a thread in each web process.
+# Disable when running the relay_outbox management command instead.
+OUTBOX_RELAY_IN_PROCESS = True
+
+# Celery workers run the batch completion, replanning and nightly jobs
+CELERY_BROKER_URL = "redis://127.0.0.1:6379/0"
+CELERY_TIMEZONE = TIME_ZONE
+# Fail fast when the broker is down, the API answers 503 instead of hanging
+CELERY_BROKER_CONNECTION_TIMEOUT = 2
+CELERY_TASK_PUBLISH_RETRY_POLICY = {"max_retries": 1}
+
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # React development server
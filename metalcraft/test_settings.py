@@ -0,0 +1,18 @@
+"""
+Django settings for the metalcraft test run.
+
+Tests run in one process without a Redis server, so the default cache is
+process-local. manage.py test picks this module, other runners select it
+with DJANGO_SETTINGS_MODULE=metalcraft.test_settings.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+
+# Expected with the cache above, SharedCacheCheckTest covers the check
+SILENCED_SYSTEM_CHECKS = ["manufacturing.W001"]
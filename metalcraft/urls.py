@@ -21,7 +21,7 @@ from manufacturing.views import (
     LoginView, RegisterView, LogoutView,
     WorkstationProcessViewSet, WorkstationEfficiencyViewSet, 
     ProductionDesignViewSet, ProductionEventViewSet,
-    SupplierViewSet
+    SupplierViewSet, ProductionScheduleViewSet
 )
 from manufacturing.analytics import (
     DashboardAnalyticsView, 
@@ -43,6 +43,7 @@ router.register(r'workstation-efficiency', WorkstationEfficiencyViewSet)
 router.register(r'production-designs', ProductionDesignViewSet)
 router.register(r'production-events', ProductionEventViewSet)
 router.register(r'suppliers', SupplierViewSet)
+router.register(r'production-schedule', ProductionScheduleViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),